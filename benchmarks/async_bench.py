@@ -0,0 +1,308 @@
+""" Compares sync Processor and AsyncProcessor against a local chain stand-in
+
+Usage: python benchmarks/async_bench.py [--txs 50] [--window 10] [--block-time 1]
+Requires running redis available at REDIS_URI. The stand-in is a JSON-RPC
+server that mines txs of consecutive nonces every block and answers with
+the configured latency.
+"""
+
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+import rlp  # type: ignore
+from eth_account import Account
+from redis import asyncio as aioredis
+from web3 import HTTPProvider, Web3
+
+from transaction_manager.aio import AsyncEth, AsyncProcessor, AsyncTxPool
+from transaction_manager.attempt_manager import AttemptManagerV2, RedisAttemptStorage
+from transaction_manager.config import REDIS_URI
+from transaction_manager.eth import Eth
+from transaction_manager.finality import BlockCountFinality
+from transaction_manager.heads import HeadFeed
+from transaction_manager.processor import Processor
+from transaction_manager.resources import rs
+from transaction_manager.structures import Fee, Tx, TxStatus
+from transaction_manager.txpool import make_score, TxPool
+
+CHAIN_ID = 31337
+GWEI = 10 ** 9
+
+
+class ChainStandIn:
+    def __init__(self, block_time: float, latency: float) -> None:
+        self.block_time = block_time
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.blocks: List[Dict] = [self.make_block(0, [])]
+        self.nonces: Dict[str, int] = {}
+        # Sender -> nonce -> (hash, raw tx fee)
+        self.mempool: Dict[str, Dict[int, Tuple[str, int]]] = {}
+        self.receipts: Dict[str, Dict] = {}
+        self.stopped = threading.Event()
+
+    def make_block(self, number: int, txs: List[str]) -> Dict:
+        return {
+            'number': hex(number),
+            'hash': '0x' + f'{number:064x}',
+            'parentHash': '0x' + f'{max(number - 1, 0):064x}',
+            'timestamp': hex(int(time.time())),
+            'gasLimit': hex(30000000),
+            'baseFeePerGas': hex(GWEI),
+            'transactions': txs
+        }
+
+    def mine(self) -> None:
+        while not self.stopped.wait(self.block_time):
+            with self.lock:
+                number = len(self.blocks)
+                mined = []
+                for sender, pending in self.mempool.items():
+                    nonce = self.nonces.get(sender, 0)
+                    while nonce in pending:
+                        h, _ = pending.pop(nonce)
+                        mined.append(h)
+                        nonce += 1
+                    self.nonces[sender] = nonce
+                block = self.make_block(number, mined)
+                for i, h in enumerate(mined):
+                    self.receipts[h] = {
+                        'transactionHash': h,
+                        'transactionIndex': hex(i),
+                        'blockNumber': block['number'],
+                        'blockHash': block['hash'],
+                        'status': '0x1',
+                        'gasUsed': hex(21000),
+                        'cumulativeGasUsed': hex(21000 * (i + 1)),
+                        'effectiveGasPrice': hex(GWEI),
+                        'type': '0x2'
+                    }
+                self.blocks.append(block)
+
+    def send(self, raw_hex: str) -> str:
+        raw = bytes.fromhex(raw_hex[2:])
+        fields = rlp.decode(raw[1:])
+        nonce = int.from_bytes(fields[1], 'big')
+        fee = int.from_bytes(fields[3 if raw[0] == 2 else 2], 'big')
+        sender = Account.recover_transaction(raw)
+        h = Web3.keccak(raw).hex()
+        pending = self.mempool.setdefault(sender, {})
+        if nonce < self.nonces.get(sender, 0):
+            raise ValueError('nonce too low')
+        if nonce in pending:
+            known_hash, known_fee = pending[nonce]
+            if known_hash == h:
+                raise ValueError('already known')
+            if fee < known_fee * 110 // 100:
+                raise ValueError('replacement transaction underpriced')
+        pending[nonce] = (h, fee)
+        return h
+
+    def block(self, tag: str) -> Dict:
+        if tag in ('latest', 'pending', 'finalized', 'safe'):
+            return self.blocks[-1]
+        number = int(tag, 16)
+        return self.blocks[number] if number < len(self.blocks) else None  # type: ignore
+
+    def count(self, address: str, tag: str) -> str:
+        nonce = self.nonces.get(address, 0)
+        if tag == 'pending':
+            while nonce in self.mempool.get(address, {}):
+                nonce += 1
+        return hex(nonce)
+
+    def call(self, method: str, params: List) -> Any:
+        with self.lock:
+            if method == 'eth_chainId':
+                return hex(CHAIN_ID)
+            if method == 'eth_blockNumber':
+                return hex(len(self.blocks) - 1)
+            if method == 'eth_getBlockByNumber':
+                return self.block(params[0])
+            if method == 'eth_feeHistory':
+                return {
+                    'oldestBlock': hex(len(self.blocks) - 1),
+                    'baseFeePerGas': [hex(GWEI)] * 2,
+                    'gasUsedRatio': [0.5],
+                    'reward': [[hex(GWEI)]]
+                }
+            if method in ('eth_gasPrice', 'eth_maxPriorityFeePerGas'):
+                return hex(GWEI)
+            if method == 'eth_estimateGas':
+                return hex(21000)
+            if method == 'eth_getBalance':
+                return hex(10 ** 24)
+            if method == 'eth_getTransactionCount':
+                return self.count(Web3.to_checksum_address(params[0]), params[1])
+            if method == 'eth_sendRawTransaction':
+                return self.send(params[0])
+            if method == 'eth_getTransactionReceipt':
+                return self.receipts.get(params[0])
+            if method == 'eth_getTransactionByHash':
+                known = params[0] in self.receipts or any(
+                    h == params[0] for p in self.mempool.values() for h, _ in p.values()
+                )
+                return {'hash': params[0]} if known else None
+        raise ValueError(f'{method} is not supported')
+
+    def respond(self, request: Dict) -> Dict:
+        response: Dict[str, Any] = {'jsonrpc': '2.0', 'id': request['id']}
+        try:
+            response['result'] = self.call(request['method'], request['params'])
+        except ValueError as err:
+            response['error'] = {'code': -32000, 'message': str(err)}
+        return response
+
+    def serve(self, port: int) -> ThreadingHTTPServer:
+        chain = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                time.sleep(chain.latency)
+                if isinstance(body, list):
+                    response: Any = [chain.respond(r) for r in body]
+                else:
+                    response = chain.respond(body)
+                data = json.dumps(response).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except BrokenPipeError:
+                    # Client has gone after the end of a run
+                    pass
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.mine, daemon=True).start()
+        return server
+
+
+class KeyWallet:
+    def __init__(self) -> None:
+        self.account = Account.create()
+        self.address = self.account.address
+
+    def sign(self, tx: Dict) -> Dict:
+        tx = {k: v for k, v in tx.items() if k != 'from'}
+        return {'rawTransaction': self.account.sign_transaction(tx).rawTransaction}
+
+
+def push(pool: TxPool, amount: int) -> None:
+    pool._clear()
+    pool.add_many(
+        Tx(
+            tx_id='',
+            status=TxStatus.PROPOSED,
+            score=make_score(priority=5),
+            to='0x0000000000000000000000000000000000000001',
+            value=i,
+            fee=Fee(),
+            meta={'enqueued': time.time()}
+        )
+        for i in range(amount)
+    )
+
+
+def collect(pool: TxPool, ids: List[bytes], start_ts: float) -> Dict[str, float]:
+    elapsed = time.time() - start_ts
+    txs = [pool.get(tx_id) for tx_id in ids]
+    done = sum(1 for tx in txs if tx is not None and tx.status == TxStatus.SUCCESS)
+    return {'done': done, 'seconds': elapsed, 'txs_per_s': done / elapsed}
+
+
+def run_sync(endpoint: str, amount: int, window: int, interval: float) -> Dict[str, float]:
+    eth = Eth(Web3(HTTPProvider(endpoint)))
+    pool = TxPool('bench_sync_pool')
+    push(pool, amount)
+    ids = pool.to_list()
+    wallet = KeyWallet()
+    rs.delete('bench_sync_attempts')
+    manager = AttemptManagerV2(eth, RedisAttemptStorage(rs, 'bench_sync_attempts'), wallet.address)
+    proc = Processor(eth, pool, manager, wallet, window=window, finality=BlockCountFinality(1))
+    eth.feed = HeadFeed(eth, interval=interval)  # type: ignore
+    eth.feed.start()
+    start_ts = time.time()
+    try:
+        while pool.size > 0:
+            if window > 1:
+                proc.process_window()
+                proc.wait_window()
+            else:
+                proc.process_next()
+    finally:
+        eth.feed.stop()
+    result = collect(pool, ids, start_ts)
+    pool._clear()
+    return result
+
+
+async def run_async(endpoint: str, amount: int, window: int, interval: float) -> Dict[str, float]:
+    eth = Eth(Web3(HTTPProvider(endpoint)))
+    pool = TxPool('bench_async_pool')
+    push(pool, amount)
+    ids = pool.to_list()
+    wallet = KeyWallet()
+    rs.delete('bench_async_attempts')
+    manager = AttemptManagerV2(eth, RedisAttemptStorage(rs, 'bench_async_attempts'), wallet.address)
+    proc = AsyncProcessor(
+        AsyncEth(endpoint),
+        AsyncTxPool(pool, aioredis.Redis.from_url(REDIS_URI)),
+        manager,
+        wallet,
+        window=window,
+        finality=BlockCountFinality(1)
+    )
+    proc.watcher.interval = interval
+    stopped = asyncio.Event()
+    start_ts = time.time()
+    runner = asyncio.create_task(proc.run(stopped))
+    while pool.size > 0:
+        await asyncio.sleep(0.1)
+    stopped.set()
+    await runner
+    result = collect(pool, ids, start_ts)
+    pool._clear()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--txs', type=int, default=50)
+    parser.add_argument('--window', type=int, default=10)
+    parser.add_argument('--block-time', type=float, default=1)
+    parser.add_argument('--latency', type=float, default=0.02, help='RPC latency, s')
+    parser.add_argument('--port', type=int, default=18545)
+    args = parser.parse_args()
+    chain = ChainStandIn(args.block_time, args.latency)
+    server = chain.serve(args.port)
+    endpoint = f'http://127.0.0.1:{args.port}'
+    interval = args.block_time / 4
+    try:
+        results = {
+            'sync, window 1': run_sync(endpoint, args.txs, 1, interval),
+            f'sync, window {args.window}': run_sync(endpoint, args.txs, args.window, interval),
+            f'async, window {args.window}': asyncio.run(
+                run_async(endpoint, args.txs, args.window, interval)
+            )
+        }
+    finally:
+        chain.stopped.set()
+        server.shutdown()
+    for name, result in results.items():
+        print(name, ', '.join(f'{k}: {v:.2f}' for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+""" Compares encode/decode cost of JSON and packed Tx and Attempt records
+
+Usage: python benchmarks/codec_bench.py [--payload 65536] [--number 2000]
+Payload is the size in bytes of the hex calldata stored in tx data.
+"""
+
+import argparse
+import timeit
+from typing import Callable, Dict
+
+from transaction_manager.structures import Attempt, Fee, Tx, TxStatus
+
+
+def make_tx(payload: int) -> Tx:
+    return Tx(
+        tx_id='tx-72c337ab0ac56aa8',
+        status=TxStatus.SENT,
+        score=1,
+        to='0x0000000000000000000000000000000000000001',
+        value=10 ** 18,
+        fee=Fee(max_fee_per_gas=10 ** 10, max_priority_fee_per_gas=10 ** 9),
+        hashes=['0x' + 'ab' * 32] * 3,
+        gas=500000,
+        nonce=10,
+        data={'data': '0x' + 'cd' * (payload // 2), 'chunks': list(range(64))},
+        meta={'chain': 'bench'}
+    )
+
+
+def make_attempt() -> Attempt:
+    return Attempt(
+        tx_id='tx-72c337ab0ac56aa8',
+        nonce=10,
+        index=2,
+        fee=Fee(max_fee_per_gas=10 ** 10, max_priority_fee_per_gas=10 ** 9),
+        wait_time=30,
+        gas=500000
+    )
+
+
+def per_call_us(fn: Callable, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 10 ** 6
+
+
+def bench(payload: int, number: int) -> Dict[str, Dict[str, float]]:
+    tx, attempt = make_tx(payload), make_attempt()
+    tx_json, tx_packed = tx.to_bytes(), tx.to_packed()
+    at_json, at_packed = attempt.to_bytes(), attempt.to_packed()
+    return {
+        'tx json': {
+            'encode_us': per_call_us(tx.to_bytes, number),
+            'decode_us': per_call_us(lambda: Tx.from_bytes(tx.raw_id, tx_json), number),
+            'size': len(tx_json)
+        },
+        'tx packed': {
+            'encode_us': per_call_us(tx.to_packed, number),
+            'decode_us': per_call_us(lambda: Tx.from_bytes(tx.raw_id, tx_packed), number),
+            'size': len(tx_packed)
+        },
+        'attempt json': {
+            'encode_us': per_call_us(attempt.to_bytes, number),
+            'decode_us': per_call_us(lambda: Attempt.from_bytes(at_json), number),
+            'size': len(at_json)
+        },
+        'attempt packed': {
+            'encode_us': per_call_us(attempt.to_packed, number),
+            'decode_us': per_call_us(lambda: Attempt.from_bytes(at_packed), number),
+            'size': len(at_packed)
+        }
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--payload', type=int, default=64 * 1024)
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+    for name, result in bench(args.payload, args.number).items():
+        print(f'{name:>15}', ', '.join(f'{k}: {v:.1f}' for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
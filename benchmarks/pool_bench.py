@@ -0,0 +1,82 @@
+""" Compares dispatch latency and redis CPU of ZSET and stream pools
+
+Usage: python benchmarks/pool_bench.py [--txs 1000] [--rate 200]
+Requires running redis available at REDIS_URI. Benchmark pools are
+created under separate names and removed afterwards.
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from typing import Dict, List
+
+from transaction_manager.resources import rs
+from transaction_manager.streampool import StreamTxPool
+from transaction_manager.structures import Fee, Tx, TxStatus
+from transaction_manager.txpool import make_score, TxPool
+
+
+def redis_cpu() -> float:
+    info = rs.info('cpu')
+    return info['used_cpu_sys'] + info['used_cpu_user']
+
+
+def produce(pool: TxPool, amount: int, rate: int) -> None:
+    for i in range(amount):
+        tx = Tx(
+            tx_id='',
+            status=TxStatus.PROPOSED,
+            score=make_score(priority=5),
+            to='0x0000000000000000000000000000000000000001',
+            value=i,
+            fee=Fee(gas_price=10 ** 9),
+            meta={'enqueued': time.time()}
+        )
+        pool.add_many([tx])
+        time.sleep(1 / rate)
+
+
+def consume(pool: TxPool, amount: int) -> List[float]:
+    latencies: List[float] = []
+    pool.subscribe()
+    while len(latencies) < amount:
+        tx = pool.fetch_next()
+        if tx is None:
+            pool.wait(timeout=1)
+            continue
+        latencies.append(time.time() - tx.meta['enqueued'])  # type: ignore
+        tx.status = TxStatus.SUCCESS
+        pool.release(tx)
+    return latencies
+
+
+def run(pool: TxPool, amount: int, rate: int) -> Dict[str, float]:
+    pool._clear()
+    cpu_before = redis_cpu()
+    producer = threading.Thread(target=produce, args=(pool, amount, rate))
+    producer.start()
+    latencies = consume(pool, amount)
+    producer.join()
+    cpu = redis_cpu() - cpu_before
+    pool._clear()
+    latencies.sort()
+    return {
+        'median_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'redis_cpu_s': cpu
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--txs', type=int, default=1000)
+    parser.add_argument('--rate', type=int, default=200, help='txs per second')
+    args = parser.parse_args()
+    for pool in (TxPool('bench_zset_pool'), StreamTxPool('bench_stream_pool')):
+        result = run(pool, args.txs, args.rate)
+        print(type(pool).__name__, ', '.join(f'{k}: {v:.3f}' for k, v in result.items()))
+
+
+if __name__ == '__main__':
+    main()
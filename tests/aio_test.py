@@ -0,0 +1,84 @@
+import asyncio
+from unittest import mock
+
+from redis import asyncio as aioredis
+
+from transaction_manager.aio import AsyncEth, AsyncProcessor, AsyncTxPool
+from transaction_manager.structures import TxStatus
+
+from tests.processor_test import get_from_pool, make_tx, push_tx
+from tests.utils.timing import in_time
+
+
+def make_proc(tpool, attempt_manager, wallet, window=3):
+    return AsyncProcessor(
+        AsyncEth(),
+        AsyncTxPool(tpool, aioredis.Redis()),
+        attempt_manager,
+        wallet,
+        window=window
+    )
+
+
+async def process(proc, tpool):
+    stopped = asyncio.Event()
+    runner = asyncio.create_task(proc.run(stopped))
+    with in_time(30):
+        while tpool.size > 0:
+            await asyncio.sleep(0.5)
+    stopped.set()
+    await runner
+
+
+def test_async_processor(tpool, eth, attempt_manager, w3, rdp, wallet):
+    txs = [push_tx(w3, rdp, tpool, wallet) for _ in range(3)]
+    start_nonce = eth.get_nonce(wallet.address)
+
+    proc = make_proc(tpool, attempt_manager, wallet)
+    asyncio.run(process(proc, tpool))
+    nonces = sorted(get_from_pool(tx.tx_id, tpool).nonce for tx in txs)
+    assert nonces == list(range(start_nonce, start_nonce + 3))
+    for tx in txs:
+        assert get_from_pool(tx.tx_id, tpool).status == TxStatus.SUCCESS
+    assert proc.inflight == {}
+    assert attempt_manager.attempts == {}
+
+
+def test_async_processor_resume(tpool, eth, attempt_manager, w3, rdp, wallet):
+    sent = push_tx(w3, rdp, tpool, wallet)
+    start_nonce = eth.get_nonce(wallet.address)
+    proc = make_proc(tpool, attempt_manager, wallet, window=1)
+
+    async def send():
+        # Tx is sent, but the node has not received it before the restart
+        with mock.patch.object(proc.eth, 'send_raw_tx', return_value='0x12323213213321321'):
+            async with proc.acquire_tx(sent):
+                await proc.launch(sent, start_nonce)
+    asyncio.run(send())
+
+    # Tx pushed after the restart goes ahead of the sent one
+    tx_id = rdp.sign_and_send(make_tx(w3, wallet), priority=1)
+    attempt_manager.fetch()
+    asyncio.run(process(make_proc(tpool, attempt_manager, wallet, window=2), tpool))
+    assert get_from_pool(sent.tx_id, tpool).status == TxStatus.SUCCESS
+    assert get_from_pool(sent.tx_id, tpool).nonce == start_nonce
+    assert get_from_pool(tx_id, tpool).nonce == start_nonce + 1
+    assert eth.get_nonce(wallet.address) == start_nonce + 2
+
+
+def test_async_processor_stop(tpool, attempt_manager, wallet):
+    proc = make_proc(tpool, attempt_manager, wallet)
+
+    async def wait_for_tx(timeout):
+        await asyncio.sleep(timeout)
+
+    async def stop():
+        stopped = asyncio.Event()
+        runner = asyncio.create_task(proc.run(stopped))
+        await asyncio.sleep(1)
+        with in_time(3):
+            stopped.set()
+            await runner
+    # Empty pool is awaited for much longer than the stop takes
+    with mock.patch.object(proc.pool, 'wait', wait_for_tx):
+        asyncio.run(stop())
@@ -1,4 +1,4 @@
-from transaction_manager.structures import Attempt, Fee
+from transaction_manager.structures import Attempt, Fee, pack
 
 
 def create_attempt(nonce=1, index=2, gas_price=10 ** 9, wait_time=30):
@@ -29,3 +29,29 @@ def test_attempt():
     raw_before_eip_1559 = b'{"gas_price": 1000000000, "index": 2, "nonce": 1, "tx_id": "id-aaaa", "wait_time": 30}'  # noqa
     attempt = Attempt.from_bytes(raw_before_eip_1559)
     assert attempt.to_bytes() == expected
+
+
+def test_attempt_packed():
+    aa = create_attempt(gas_price=10 ** 21)
+    packed = aa.to_packed()
+    assert len(packed) < len(aa.to_bytes())
+    assert Attempt.from_bytes(packed) == aa
+
+
+def test_attempt_raw_tx():
+    aa = create_attempt()
+    assert aa.signed_hash is None
+    aa.raw_tx = '0x' + '12' * 100
+    assert aa.signed_hash.startswith('0x') and len(aa.signed_hash) == 66
+    assert b'"raw_tx"' in aa.to_bytes()
+    assert Attempt.from_bytes(aa.to_bytes()) == aa
+    assert Attempt.from_bytes(aa.to_packed()) == aa
+
+    # Attempt packed before raw tx was kept
+    aa.raw_tx = None
+    legacy = pack([
+        aa.tx_id, aa.nonce, aa.index,
+        aa.fee.gas_price, aa.fee.max_fee_per_gas, aa.fee.max_priority_fee_per_gas,
+        aa.wait_time, aa.gas
+    ])
+    assert Attempt.from_bytes(legacy) == aa
@@ -0,0 +1,42 @@
+from transaction_manager.structures import Attempt, Fee
+
+
+def create_attempt(nonce=1, index=1, gas_price=10 ** 9, wait_time=30):
+    return Attempt(
+        tx_id=f'id-{nonce}',
+        nonce=nonce,
+        index=index,
+        fee=Fee(gas_price=gas_price),
+        wait_time=wait_time
+    )
+
+
+def test_storage_history(attempt_storage):
+    assert attempt_storage.get(1) is None
+    assert attempt_storage.load() == {}
+
+    a, b = create_attempt(index=1), create_attempt(index=2, gas_price=2 * 10 ** 9)
+    c = create_attempt(nonce=2)
+    for attempt in (b, a, c):
+        attempt_storage.save(attempt)
+
+    assert attempt_storage.history(1) == [a, b]
+    assert attempt_storage.get(1) == b
+    assert attempt_storage.get(2) == c
+    assert attempt_storage.load() == {1: [a, b], 2: [c]}
+
+    # Saving the attempt with the same index overrides it
+    b.fee.gas_price = 3 * 10 ** 9
+    attempt_storage.save(b)
+    assert attempt_storage.get(1).fee.gas_price == 3 * 10 ** 9
+
+    attempt_storage.prune([1])
+    assert attempt_storage.load() == {2: [c]}
+
+
+def test_storage_legacy_migration(trs, attempt_storage):
+    legacy = create_attempt(nonce=5, index=3)
+    trs.set(b'last_attempt', legacy.to_bytes())
+    assert attempt_storage.load() == {5: [legacy]}
+    assert trs.get(b'last_attempt') is None
+    assert attempt_storage.get(5) == legacy
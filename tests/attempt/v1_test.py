@@ -50,7 +50,8 @@ def test_v1_make(w3, eth, attempt_manager, wallet):
 
     initial_gp = 2 * 10 ** 9
     aa = create_attempt(gas_price=initial_gp, index=2)
-    attempt_manager._current = aa
+    aa.nonce = eth.get_nonce(wallet.address)
+    attempt_manager.attempts[aa.nonce] = aa
 
     tx = Tx(
         tx_id='1232321332132131331321',
@@ -66,7 +67,6 @@ def test_v1_make(w3, eth, attempt_manager, wallet):
         data=None,
         multiplier=1.2
     )
-    attempt_manager.current.nonce = eth.get_nonce(wallet.address)
     attempt_manager.make(tx)
     assert attempt_manager.current.tx_id == tx.tx_id
     new_gp = initial_gp * (100 + GAS_PRICE_INC_PERCENT) // 100
@@ -43,11 +43,19 @@ def test_v2_max_allowed_fee(w3, eth, attempt_manager, wallet, account):
 
 @pytest.fixture
 def history_eth(eth):
-    eth.get_fee_history = Mock(
-        return_value={
-            'baseFeePerGas': [BASE_FEE_VALUE / 10, BASE_FEE_VALUE],
-            'reward': [[P50_REWARD, P60_REWARD]]}
-    )
+    history = {
+        'baseFeePerGas': [BASE_FEE_VALUE / 10, BASE_FEE_VALUE],
+        'reward': [[P50_REWARD, P60_REWARD]]
+    }
+    eth.get_fee_history = Mock(return_value=history)
+    fetch_state = eth.fetch_state
+
+    def fetch_state_with_history(*args, **kwargs):
+        state = fetch_state(*args, **kwargs)
+        state.fee_history = history
+        return state
+
+    eth.fetch_state = Mock(side_effect=fetch_state_with_history)
     return eth
 
 
@@ -143,7 +151,9 @@ def test_v2_make(w3, history_eth, attempt_manager, account, wallet):
         data=None,
         multiplier=1.2
     )
+    # Emulates that the last attempt was made for the previous nonce
     attempt_manager.current.nonce -= 1
+    attempt_manager.attempts = {attempt_manager.current.nonce: attempt_manager.current}
     attempt_manager.make(tx)
     current = attempt_manager.current
     expected_tip = P60_REWARD
@@ -193,6 +203,7 @@ def test_v2_make(w3, history_eth, attempt_manager, account, wallet):
     )
     # Emulates that account successfully sent another transaction
     attempt_manager._current.nonce = eth.get_nonce(wallet.address) - 1
+    attempt_manager.attempts = {attempt_manager.current.nonce: attempt_manager.current}
     attempt_manager.make(tx)
     current = attempt_manager.current
 
@@ -391,3 +402,23 @@ def test_v2_make_with_low_balance(w3, eth, attempt_storage, wallet, account):
     attempt_manager.make(tx)
     tx.fee.max_priority_fee_per_gas += 1
     attempt_manager.replace(tx)
+
+
+def test_v2_next_fee(attempt_manager):
+    attempt = create_attempt(gas_price=None)
+    assert attempt_manager.next_fee(attempt) is None
+    attempt.fee = Fee(max_priority_fee_per_gas=10 ** 9, max_fee_per_gas=2 * 10 ** 9)
+    eth = attempt_manager.eth
+    eth.get_estimated_base_fee = Mock(return_value=0)
+    eth.get_p60_tip = Mock(return_value=0)
+    assert attempt_manager.next_fee(attempt) == Fee(
+        max_priority_fee_per_gas=10 ** 9 * 112 // 100,
+        max_fee_per_gas=2 * 10 ** 9 * 112 // 100
+    )
+    # Fee history minimums apply as in make
+    eth.get_estimated_base_fee = Mock(return_value=5 * 10 ** 9)
+    eth.get_p60_tip = Mock(return_value=3 * 10 ** 9)
+    assert attempt_manager.next_fee(attempt) == Fee(
+        max_priority_fee_per_gas=3 * 10 ** 9,
+        max_fee_per_gas=5 * 10 ** 9
+    )
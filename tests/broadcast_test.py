@@ -0,0 +1,62 @@
+import pytest
+
+from transaction_manager.broadcast import (
+    Broadcaster,
+    classify_error,
+    KNOWN,
+    make_broadcaster,
+    NONCE,
+    REJECTED,
+    UNAVAILABLE,
+    UNDERPRICED
+)
+from transaction_manager.config import ENDPOINT
+
+from tests.utils.account import generate_address
+
+DEAD_ENDPOINT = 'http://127.0.0.1:1'
+
+
+def rpc_error(message):
+    return ValueError({'code': -32000, 'message': message})
+
+
+def test_classify_error():
+    assert classify_error(rpc_error('already known')) == KNOWN
+    assert classify_error(rpc_error('replacement transaction underpriced')) == UNDERPRICED
+    assert classify_error(rpc_error('nonce too low')) == NONCE
+    assert classify_error(rpc_error('insufficient funds')) == REJECTED
+    assert classify_error(ConnectionError()) == UNAVAILABLE
+
+
+def test_make_broadcaster():
+    assert make_broadcaster('') is None
+    broadcaster = make_broadcaster(f'{DEAD_ENDPOINT}, {ENDPOINT}')
+    assert broadcaster.endpoints == [ENDPOINT, DEAD_ENDPOINT]
+    broadcaster.stop()
+
+
+def test_broadcast(w3, eth, wallet):
+    broadcaster = Broadcaster([DEAD_ENDPOINT, ENDPOINT])
+    eth.broadcaster = broadcaster
+    tx = {
+        'to': generate_address(w3),
+        'value': 1,
+        'gas': 22000,
+        'gasPrice': w3.eth.gas_price,
+        'nonce': eth.get_nonce(wallet.address)
+    }
+    signed = wallet.sign(tx)
+    try:
+        h = eth.send_tx(signed)
+        assert eth.wait_for_receipt(h) == 1
+        assert broadcaster.fastest == ENDPOINT
+        assert broadcaster.stats[ENDPOINT].accepted == 1
+        assert broadcaster.stats[DEAD_ENDPOINT].errors == {UNAVAILABLE: 1}
+
+        # Mined tx is rejected by all endpoints
+        with pytest.raises(ValueError):
+            eth.send_tx(signed)
+        assert broadcaster.stats[ENDPOINT].errors == {NONCE: 1}
+    finally:
+        broadcaster.stop()
@@ -1,4 +1,3 @@
-import json
 import random
 import time
 from concurrent.futures import as_completed, ThreadPoolExecutor
@@ -8,6 +7,7 @@ import pytest
 from skale.transactions.exceptions import TransactionNotMinedError
 from skale.wallets import RedisWalletAdapter
 
+from transaction_manager.attempt_manager import RedisAttemptStorage
 from transaction_manager.config import (
     HARD_REPLACE_TIP_OFFSET,
     TARGET_REWARD_PERCENTILE
@@ -86,13 +86,13 @@ def test_processor(tpool, w3, eth, trs, rdp, wallet):
     assert tx['from'] == wallet.address
     assert tx['to'] == tester_abi['address']
     assert tx['nonce'] == eth.get_nonce(wallet.address) - 1
-    last_attempt = json.loads(trs.get(b'last_attempt').decode('utf-8'))
-    assert tx['nonce'] == last_attempt['nonce']
-    assert tx['attempts'] == last_attempt['index']
-    assert tx['gasPrice'] == last_attempt['fee']['gas_price']
+    last_attempt = RedisAttemptStorage(trs).get(tx['nonce'])
+    assert tx['nonce'] == last_attempt.nonce
+    assert tx['attempts'] == last_attempt.index
+    assert tx['gasPrice'] == last_attempt.fee.gas_price
     assert tx['data'] == '0x8e4ed53e0000000000000000000000000000000000000000000000000000000000000004'  # noqa
     assert tx['score'] > 6 * 10 ** 10 + int(time.time() - 10)
-    assert tx['tx_id'] == last_attempt['tx_id']
+    assert tx['tx_id'] == last_attempt.tx_id
 
 
 def test_processor_many_tx(tpool, eth, w3, trs, rdp):
@@ -0,0 +1,49 @@
+from web3 import Web3
+
+from transaction_manager.config import ENDPOINT
+from transaction_manager.endpoints import (
+    EndpointPool,
+    LatencyHistogram,
+    make_endpoint_pool
+)
+from transaction_manager.eth import Eth
+
+DEAD_ENDPOINT = 'http://127.0.0.1:1'
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram(buckets=(0.01, 0.1, 1))
+    assert histogram.quantile(0.5) is None
+    for latency in (0.005, 0.05, 0.06, 0.5, 2):
+        histogram.observe(latency)
+    assert histogram.to_dict() == {'0.01': 1, '0.1': 2, '1': 1, 'inf': 1}
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.99) == float('inf')
+
+
+def test_make_endpoint_pool():
+    assert make_endpoint_pool('') is None
+    assert make_endpoint_pool(ENDPOINT) is None
+    pool = make_endpoint_pool(f'{DEAD_ENDPOINT},{ENDPOINT}')
+    assert [e.uri for e in pool.endpoints] == [ENDPOINT, DEAD_ENDPOINT]
+
+
+def test_endpoint_pool(w3):
+    pool = EndpointPool([DEAD_ENDPOINT, ENDPOINT], timeout=1, failure_threshold=2)
+    dead, alive = pool.endpoints
+    eth = Eth(Web3(pool))
+
+    # Requests fail over to the next endpoint
+    assert eth.block_number == w3.eth.block_number
+    assert dead.failures == 1 and not dead.ejected
+    assert eth.get_nonces(w3.eth.accounts[0])[0] >= 0
+    assert dead.ejected
+
+    # Ejected endpoint is tried last
+    assert pool.candidates() == [alive, dead]
+    pool.check()
+    assert pool.preferred is alive
+    assert alive.block is not None and alive.latency is not None
+    metrics = pool.metrics
+    assert metrics[ENDPOINT]['preferred'] and metrics[DEAD_ENDPOINT]['ejected']
+    assert sum(metrics[ENDPOINT]['histogram'].values()) == alive.histogram.count
@@ -1,11 +1,22 @@
 import time
+from unittest import mock
 
 import pytest
+from requests.exceptions import ConnectionError
+from skale.utils.web3_utils import EthClientOutdatedError
 
+from transaction_manager import eth as eth_module
 from transaction_manager.eth import (
+    batch_results,
+    BlockCache,
     BlockTimeoutError,
+    check_client,
+    EstimateCache,
+    HeaderRing,
+    is_batch_unsupported,
     MAX_WAITING_TIME,
     ReceiptTimeoutError,
+    to_int
 )
 from transaction_manager.structures import Tx, TxStatus
 
@@ -24,6 +35,194 @@ def test_eth_fee_history(eth):
     assert len(h['reward'][0]) == 2
 
 
+def test_eth_fetch_state(eth, wallet):
+    state = eth.fetch_state(
+        wallet.address,
+        nonce=True,
+        fee_history=True,
+        gas_price=True,
+        balance=True
+    )
+    assert state.nonce == eth.get_nonce(wallet.address)
+    assert state.balance == eth.get_balance(wallet.address)
+    assert state.block_gas_limit == eth.block_gas_limit
+    assert len(state.fee_history['baseFeePerGas']) == 2
+    assert len(state.fee_history['reward'][0]) == 2
+    assert 10 ** 9 < state.avg_gas_price < 31 * 10 ** 9
+
+    state = eth.fetch_state(wallet.address)
+    assert state.nonce is None and state.fee_history is None
+
+    with pytest.raises(ValueError):
+        eth.batch([('eth_unknownMethod', [])])
+
+
+def test_eth_batch_retry(eth, wallet):
+    post = eth_module.post_request
+    failures = [ConnectionError('Test error')] * 2
+
+    def flaky_post(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return post(*args, **kwargs)
+
+    with mock.patch.object(eth_module, 'post_request', side_effect=flaky_post) as m:
+        assert eth.batch([('eth_chainId', [])]) == [hex(eth.chain_id)]
+    assert m.call_count == 3
+
+    with mock.patch.object(eth_module, 'post_request', side_effect=ConnectionError):
+        with pytest.raises(ConnectionError):
+            eth.batch([('eth_chainId', [])])
+
+
+def test_batch_results():
+    responses = [{'id': 1, 'result': '0x2'}, {'id': 0, 'result': '0x1'}]
+    assert batch_results(responses, 2) == ['0x1', '0x2']
+    with pytest.raises(ValueError, match='no id 1'):
+        batch_results([{'id': 0, 'result': '0x1'}, {'error': {'code': -32000}}], 2)
+    with pytest.raises(ValueError):
+        batch_results({'message': 'Bad gateway'}, 1)
+
+    assert is_batch_unsupported({'id': None, 'error': {'code': -32600, 'message': 'Invalid'}})
+    assert is_batch_unsupported({'error': {'code': -32000, 'message': 'Batch is not allowed'}})
+    assert not is_batch_unsupported({'error': {'code': -32000, 'message': 'Bad gateway'}})
+    assert not is_batch_unsupported({'message': 'Bad gateway'})
+
+
+def test_eth_batch_transient_error(eth):
+    with mock.patch.object(eth_module, 'post_request', return_value=b'{"message": "Bad gateway"}'):
+        with pytest.raises(ValueError):
+            eth.batch([('eth_chainId', [])])
+    # Batching is disabled only by the error of batch support
+    assert eth.batching
+
+
+def test_check_client():
+    now = int(time.time())
+    check_client({'number': '0x10', 'timestamp': hex(now)}, 300, state_path=None)
+    with pytest.raises(EthClientOutdatedError):
+        check_client({'number': '0x10', 'timestamp': hex(now - 301)}, 300, state_path=None)
+    # Check is disabled
+    check_client({'number': '0x10', 'timestamp': hex(now - 301)}, -1, state_path=None)
+
+
+def test_eth_batch_client_check(eth, wallet):
+    with mock.patch.object(eth_module, 'check_client') as check:
+        eth.batch([('eth_chainId', [])])
+        block = check.call_args[0][0]
+        assert to_int(block['number']) == eth.cache.block
+        # Head calls are not checked, as by the client checking middleware
+        eth.batch([('eth_blockNumber', [])])
+        assert check.call_count == 1
+
+    eth.allowed_ts_diff = 0
+    with mock.patch.object(eth_module.time, 'time', return_value=time.time() + 10):
+        with pytest.raises(EthClientOutdatedError):
+            eth.fetch_state(wallet.address, nonce=True)
+
+
+def test_eth_block_cache(eth, wallet):
+    history = eth.get_fee_history()
+    gas_limit = eth.block_gas_limit
+    hits, misses = eth.cache.hits, eth.cache.misses
+    assert eth.get_fee_history() == history
+    assert eth.block_gas_limit == gas_limit
+    assert eth.fetch_state(wallet.address, fee_history=True).fee_history == history
+    assert (eth.cache.hits, eth.cache.misses) == (hits + 4, misses)
+
+    eth.cache.observe(eth.cache.block + 1)
+    eth.get_fee_history()
+    assert eth.cache.misses == misses + 1
+
+
+def test_block_cache_stale_head():
+    cache = BlockCache(ttl=5)
+    cache.observe(11)
+    # Head read by a slower thread does not replace the newer one
+    cache.observe(10)
+    assert cache.block == 11
+    cache.put('gas_limit', 1, block=10)
+    assert cache.get('gas_limit') is None
+    cache.put('gas_limit', 2, block=11)
+    assert cache.get('gas_limit') == 2
+
+
+def test_block_cache_none(eth):
+    eth.block_number
+    # Chain does not support the finalized tag
+    with mock.patch.object(eth, 'batch', return_value=[None]) as batch:
+        assert eth.finalized_block is None
+        assert eth.finalized_block is None
+    assert batch.call_count == 1
+
+
+def test_header_ring():
+    ring = HeaderRing(size=3)
+    ring.update([
+        {'number': hex(n), 'hash': f'0x{n}'}
+        for n in range(10, 15)
+    ])
+    assert ring.head == 14
+    assert ring.hashes == {12: '0x12', 13: '0x13', 14: '0x14'}
+    # Shorter fork replaces the head and drops later blocks
+    ring.update([{'number': hex(13), 'hash': '0x13b'}])
+    assert ring.head == 13
+    assert ring.hashes == {12: '0x12', 13: '0x13b'}
+
+
+def test_estimate_cache():
+    cache = EstimateCache(blocks=3)
+    shape = cache.shape({'from': '0x1', 'to': '0x2', 'data': '0x1234', 'value': 1})
+    assert shape != cache.shape({'from': '0x1', 'to': '0x2', 'data': '0x1235', 'value': 1})
+    cache.put(shape, 30000, block=10)
+    assert cache.get(shape, block=12) == 30000
+    # Estimate expires after the given number of blocks
+    assert cache.get(shape, block=13) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.put(shape, 30000, block=13)
+    cache.check(shape, {'status': 1, 'gasUsed': 25000})
+    assert cache.get(shape, block=13) == 30000
+    # Used more gas than estimated
+    cache.check(shape, {'status': 1, 'gasUsed': hex(31000)})
+    assert cache.get(shape, block=13) is None
+    cache.put(shape, 30000, block=13)
+    cache.check(shape, {'status': 0, 'gasUsed': 25000})
+    assert cache.get(shape, block=13) is None
+    assert cache.invalidated == 2
+
+
+def test_calculate_gas_ima(eth):
+    tx = Tx(
+        tx_id='tx-1232321332132131js',
+        status=TxStatus.PROPOSED,
+        score=1,
+        to='0x1',
+        value=1,
+        fee={'gas_price': 1000000000},
+        data='0x1234'
+    )
+    assert tx.is_sent_by_ima()
+    # Each attempt of IMA tx is a dry run
+    with mock.patch.object(eth, 'estimate_gas', return_value=30000) as estimate_gas:
+        eth.calculate_gas(tx, gas_limit=10 ** 6)
+        eth.calculate_gas(tx, gas_limit=10 ** 6)
+    assert estimate_gas.call_count == 2
+
+
+def test_eth_sync_headers(eth, w3):
+    head = eth.sync_headers()
+    block = w3.eth.get_block(head)
+    assert eth.headers.head == head
+    assert eth.is_canonical(head, block['hash'].hex())
+    assert not eth.is_canonical(head, '0x' + '12' * 32)
+    eth.wait_for_blocks(amount=1)
+    # Block before the first sync is requested directly
+    assert eth.is_canonical(head - 1, w3.eth.get_block(head - 1)['hash'].hex())
+    assert eth.sync_headers() > head
+    assert eth.headers.get(head) == block['hash'].hex()
+
+
 def test_eth_chain_id(eth):
     assert eth.chain_id == 31337
 
@@ -67,6 +266,10 @@ def test_eth_tx(w3wallet, w3, eth):
 
     tx.gas = eth.calculate_gas(tx)
     assert tx.gas > 1.2 * 21000
+    # Same call is not estimated again
+    misses = eth.estimates.misses
+    assert eth.calculate_gas(tx) == tx.gas
+    assert eth.estimates.misses == misses
     eth_tx_a = eth.convert_tx(tx)
 
     signed = w3.eth.account.sign_transaction(
@@ -90,6 +293,8 @@ def test_eth_tx(w3wallet, w3, eth):
 
 
 def test_eth_wait_for_blocks(eth, w3):
+    eth.cache.put('finalized_block', 0, eth.block_number)
     eth.wait_for_blocks(amount=1, max_time=1)
+    assert eth.cache.get('finalized_block') is None
     cblock = w3.eth.block_number
     eth.wait_for_blocks(amount=5, max_time=0, start_block=cblock - 10)
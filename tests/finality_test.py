@@ -0,0 +1,76 @@
+from unittest import mock
+
+import pytest
+
+from transaction_manager.eth import BlockTimeoutError, Eth
+from transaction_manager.finality import (
+    BlockCountFinality,
+    FinalitySelector,
+    FinalizedTagFinality,
+    InstantFinality,
+    make_finality
+)
+from transaction_manager.structures import Fee, Tx, TxStatus
+
+from tests.utils.timing import in_time
+
+
+def make_tx(meta=None):
+    return Tx(
+        tx_id='tx-1',
+        status=TxStatus.PROPOSED,
+        score=1,
+        to='0x1',
+        fee=Fee(gas_price=1),
+        meta=meta
+    )
+
+
+def test_block_count_finality(eth):
+    finality = BlockCountFinality(blocks=6)
+    assert finality.is_final(eth, block=10, head=16)
+    assert not finality.is_final(eth, block=10, head=15)
+
+    block = eth.block_number
+    with in_time(0.5):
+        finality.wait(eth, block - 6)
+    with pytest.raises(BlockTimeoutError):
+        finality.wait(eth, block, max_time=0)
+
+
+def test_finalized_finality(eth):
+    finality = FinalizedTagFinality()
+    block = eth.block_number
+    with mock.patch.object(Eth, 'finalized_block', new_callable=mock.PropertyMock) as fb:
+        fb.return_value = block
+        assert finality.is_final(eth, block=block, head=block)
+        assert not finality.is_final(eth, block=block + 1, head=block + 1)
+        with in_time(0.5):
+            finality.wait(eth, block)
+        with pytest.raises(BlockTimeoutError):
+            finality.wait(eth, block + 1, max_time=0)
+
+        # Tag is not supported, blocks are counted
+        fb.return_value = None
+        assert not finality.is_final(eth, block=block, head=block)
+        assert finality.is_final(eth, block=block - 6, head=block)
+
+
+def test_instant_finality(eth):
+    finality = InstantFinality()
+    assert finality.is_final(eth, block=10, head=10)
+    with in_time(0.1):
+        finality.wait(eth, eth.block_number + 100)
+
+
+def test_finality_selector():
+    selector = FinalitySelector(BlockCountFinality())
+    assert selector.get(make_tx()) is selector.default
+    instant = selector.get(make_tx(meta={'finality': 'instant'}))
+    assert isinstance(instant, InstantFinality)
+    assert selector.get(make_tx(meta={'finality': 'instant'})) is instant
+    assert selector.get(make_tx(meta={'finality': 'unknown'})) is selector.default
+
+    assert isinstance(make_finality('finalized'), FinalizedTagFinality)
+    with pytest.raises(ValueError):
+        make_finality('unknown')
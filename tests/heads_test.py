@@ -0,0 +1,59 @@
+from transaction_manager.eth import MAX_WAITING_TIME
+from transaction_manager.heads import HeadFeed
+
+from tests.utils.account import generate_address
+from tests.utils.timing import in_time
+
+
+def test_head_feed(w3, eth, wallet):
+    feed = HeadFeed(eth, interval=1)
+    eth.feed = feed
+    feed.start()
+    try:
+        start_block = eth.block_number
+        with in_time(seconds=MAX_WAITING_TIME):
+            eth.wait_for_blocks(amount=1, start_block=start_block)
+        assert feed.head > start_block
+
+        tx = {
+            'to': generate_address(w3),
+            'value': 1,
+            'gas': 22000,
+            'gasPrice': w3.eth.gas_price
+        }
+        h = eth.send_tx(wallet.sign(tx))
+        assert eth.wait_for_receipt(h) == 1
+        assert feed.watched == {} and feed.receipts == {}
+        assert eth.get_receipts([h])[h]['status'] == 1
+    finally:
+        feed.stop()
+        feed.join()
+    assert not feed.is_alive()
+
+
+def test_head_feed_index(w3, eth, wallet):
+    feed = HeadFeed(eth, interval=1)
+    eth.feed = feed
+    feed.start()
+    try:
+        tx = {
+            'to': generate_address(w3),
+            'value': 1,
+            'gas': 22000,
+            'gasPrice': w3.eth.gas_price
+        }
+        h = eth.send_tx(wallet.sign(tx))
+        eth.wait_for_receipt(h)
+        # Replacement hash that is never mined
+        hashes = [h, '0x' + '12' * 32]
+        assert feed.track('tx-1', hashes) == {}
+        with in_time(seconds=MAX_WAITING_TIME):
+            while not feed.track('tx-1', hashes):
+                eth.wait_for_blocks(amount=1)
+        assert feed.track('tx-1', hashes)[h]['status'] == 1
+        assert feed.pending == {hashes[1]}
+
+        feed.untrack('tx-1')
+        assert feed.index == {} and feed.receipts == {}
+    finally:
+        feed.stop()
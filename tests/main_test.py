@@ -0,0 +1,26 @@
+from unittest import mock
+
+import pytest
+
+from transaction_manager import config
+from transaction_manager.main import check_config, ConfigError, main
+
+
+def test_check_config():
+    check_config()
+    with mock.patch.object(config, 'ENGINE', 'async'), \
+            mock.patch.object(config, 'POOL_BACKEND', 'stream'):
+        with pytest.raises(ConfigError):
+            check_config()
+    with mock.patch.object(config, 'POOL_BACKEND', 'list'):
+        with pytest.raises(ConfigError):
+            check_config()
+
+
+def test_main_config_error():
+    with mock.patch.object(config, 'ENGINE', 'threads'), \
+            mock.patch('transaction_manager.main.init_logger'), \
+            mock.patch('transaction_manager.main.run_proc') as run_proc:
+        with pytest.raises(ConfigError):
+            main()
+    run_proc.assert_not_called()
@@ -0,0 +1,55 @@
+from unittest import mock
+
+from transaction_manager.nonces import NonceManager
+
+from tests.utils.account import send_eth
+
+
+def test_nonce_manager(w3, eth, wallet):
+    nonces = NonceManager(eth, wallet.address, sync_interval=60)
+    nonce = eth.get_nonce(wallet.address)
+    assert nonces.get() == nonce
+    assert nonces.pending >= nonce
+
+    # Mined txs move the local nonce without requests
+    with mock.patch.object(eth, 'get_nonces') as get_nonces:
+        nonces.mined(nonce)
+        assert nonces.get() == nonce + 1
+        nonces.mined(nonce - 1)
+        assert nonces.get() == nonce + 1
+        get_nonces.assert_not_called()
+
+    # Tx sent by another wallet is found after reset
+    nonces.reset()
+    send_eth(w3, wallet, wallet.address, 1)
+    assert nonces.get() == eth.get_nonce(wallet.address)
+    assert nonces.syncs == 2
+
+
+def test_nonce_manager_gap(eth, wallet):
+    nonces = NonceManager(eth, wallet.address, sync_interval=0)
+    with mock.patch.object(eth, 'get_nonces', return_value=(3, 4)):
+        nonces.sent(3)
+        nonces.sent(5)
+        assert nonces.get() == 3
+        assert nonces.gap == 4 and nonces.gaps == 1
+
+    with mock.patch.object(eth, 'get_nonces', return_value=(3, 6)):
+        assert nonces.get() == 3
+        assert nonces.gap is None and nonces.gaps == 1
+
+
+def test_nonce_manager_fill(eth, wallet):
+    nonces = NonceManager(eth, wallet.address, sync_interval=60)
+    with mock.patch.object(eth, 'get_nonces', return_value=(3, 3)):
+        nonces.sent(4)
+        assert nonces.get() == 3 and nonces.gap == 3
+        # Own tx took the missing nonce
+        nonces.sent(3)
+        assert nonces.gap is None
+
+        nonces.reset()
+        nonces.get()
+        nonces.fill(3)
+        assert nonces.gap is None and nonces.latest is None
+        assert nonces.metrics['filled'] == 1 and nonces.metrics['gaps'] == 2
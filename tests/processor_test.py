@@ -1,9 +1,11 @@
+import time
 from unittest import mock
 import pytest
 
+from transaction_manager.attempt_manager import AttemptManagerV2
 from transaction_manager.config import MAX_RESUBMIT_AMOUNT
 from transaction_manager.eth import EstimateGasRevertError
-from transaction_manager.processor import Processor, SendingError
+from transaction_manager.processor import ConfirmationError, Processor, SendingError
 from transaction_manager.structures import TxStatus
 
 from tests.utils.contracts import get_tester_abi
@@ -91,11 +93,20 @@ def test_get_exec_data(proc, w3, rdp, eth, tpool, wallet):
     tx = push_tx(w3, rdp, tpool, wallet)
     tx.hashes = ['0x1234', '0x1235', '0x12346']
     tx.attempts = 3
-    eth.get_status = mock.Mock(return_value=-1)
+    eth.get_receipts = mock.Mock(return_value={})
     h, r = proc.get_exec_data(tx)
     assert r is None and h is None
+    # All hashes are requested at once
+    eth.get_receipts.assert_called_once_with(tx.hashes)
 
-    eth.get_status = mock.Mock(return_value=1)
+    eth.get_receipts = mock.Mock(return_value={'0x1234': {'status': 0}})
+    h, r = proc.get_exec_data(tx)
+    assert r == 0 and h == '0x1234'
+
+    eth.get_receipts = mock.Mock(return_value={
+        '0x1235': {'status': 1},
+        '0x12346': {'status': 1}
+    })
     h, r = proc.get_exec_data(tx)
     assert r == 1 and h == '0x12346'
 
@@ -106,17 +117,18 @@ def test_send(proc, w3, rdp, eth, tpool, wallet):
     tx.nonce = 0
     proc.attempt_manager.make(tx)
 
-    proc.eth.send_tx = mock.Mock(
+    proc.eth.send_raw_tx = mock.Mock(
         side_effect=ValueError('unknown error')
     )
     with pytest.raises(SendingError):
         proc.send(tx)
-    # Test that attempt was not saved if it was neither sent or replaced
-    assert proc.attempt_manager.storage.get() is None
+    # Test that signed attempt was saved before it was sent
+    raw_tx = proc.attempt_manager.current.raw_tx
+    assert proc.attempt_manager.storage.get(tx.nonce).raw_tx == raw_tx
     assert tx.tx_hash is None
     assert tx.hashes == []
 
-    proc.eth.send_tx = mock.Mock(
+    proc.eth.send_raw_tx = mock.Mock(
         side_effect=ValueError({
                 'code': -32000,
                 'message': 'replacement transaction underpriced'
@@ -125,23 +137,97 @@ def test_send(proc, w3, rdp, eth, tpool, wallet):
     with pytest.raises(SendingError):
         proc.send(tx)
     # Test that attempt was saved if it was replaced
-    assert proc.attempt_manager.storage.get().fee == tx.fee
+    assert proc.attempt_manager.storage.get(tx.nonce).fee == tx.fee
+    assert proc.attempt_manager.storage.get(tx.nonce).raw_tx != raw_tx
     assert tx.tx_hash is None
     assert tx.hashes == []
 
-    proc.eth.send_tx = mock.Mock(return_value='0x12323213213321321')
+    proc.eth.send_raw_tx = mock.Mock(return_value='0x12323213213321321')
     proc.send(tx)
     assert tx.tx_hash == '0x12323213213321321'
     assert tx.hashes == ['0x12323213213321321']
 
-    proc.eth.send_tx = mock.Mock(return_value='0x213812903813123')
-    proc.send(tx)
+    proc.eth.send_raw_tx = mock.Mock(return_value='0x213812903813123')
+    with mock.patch.object(proc.wallet, 'sign', wraps=proc.wallet.sign) as sign:
+        proc.send(tx)
+        # Fee is the same, so the signed tx is reused
+        sign.assert_not_called()
     # Test that attempt was saved if it was sent
-    assert proc.attempt_manager.storage.get().fee == tx.fee
+    assert proc.attempt_manager.storage.get(tx.nonce).fee == tx.fee
     assert tx.tx_hash == '0x213812903813123'
     assert tx.hashes == ['0x12323213213321321', '0x213812903813123']
 
 
+def test_rebroadcast(proc, w3, rdp, eth, tpool, wallet):
+    tx = push_tx(w3, rdp, tpool, wallet)
+    proc.prepare(tx)
+    proc.attempt_manager.make(tx)
+    # Tx is signed, but the processor stopped before sending it
+    attempt = proc.attempt_manager.current
+    proc.sign(tx)
+    proc.attempt_manager._current = None
+    proc.attempt_manager.fetch()
+
+    with mock.patch.object(proc.wallet, 'sign') as sign:
+        proc.launch(tx)
+        sign.assert_not_called()
+    assert tx.tx_hash == attempt.signed_hash
+    assert proc.attempt_manager.current.index == attempt.index
+    # Same bytes are not sent twice, the next attempt raises the fee
+    with mock.patch.object(proc.eth, 'is_tx_known', return_value=False):
+        assert not proc.rebroadcast(tx)
+    assert proc.wait(tx, max_time=proc.attempt_manager.current.wait_time) == 1
+
+    # Known tx is not sent again
+    assert not proc.rebroadcast(tx)
+
+
+def test_presign(tpool, eth, attempt_manager, w3, rdp, wallet):
+    proc = Processor(eth, tpool, attempt_manager, wallet, presign=True)
+    tx = push_tx(w3, rdp, tpool, wallet)
+    proc.prepare(tx)
+    proc.attempt_manager.make(tx)
+    proc.eth.send_raw_tx = mock.Mock(return_value='0x12323213213321321')
+    proc.send(tx)
+    assert tx.tx_id in proc.presigner.signed
+
+    # Next fee is signed while the first attempt was waiting
+    proc.attempt_manager.make(tx, nonce=tx.nonce)
+    with mock.patch.object(proc.wallet, 'sign') as sign:
+        raw_tx = proc.sign(tx)
+        sign.assert_not_called()
+    assert proc.presigner.hits == 1
+    tx.fee = proc.attempt_manager.current.fee
+    assert raw_tx == wallet.sign(eth.convert_tx(tx))['rawTransaction'].hex()
+
+    tx.set_as_completed('0x12323213213321321', 1)
+    proc.discard_signed(tx)
+    assert tx.tx_id not in proc.presigner.signed
+    proc.presigner.stop()
+
+
+def test_presign_base_fee_rise(tpool, eth, attempt_manager, w3, rdp, wallet):
+    proc = Processor(eth, tpool, attempt_manager, wallet, presign=True)
+    tx = push_tx(w3, rdp, tpool, wallet)
+    proc.prepare(tx)
+    proc.attempt_manager.make(tx)
+    proc.eth.send_raw_tx = mock.Mock(return_value='0x12323213213321321')
+    fee = proc.attempt_manager.current.fee
+
+    # Fee spike lifts the next fee above the increment of the current one
+    with mock.patch.object(eth, 'get_estimated_base_fee', return_value=fee.max_fee_per_gas * 3), \
+            mock.patch.object(eth, 'get_p60_tip', return_value=fee.max_priority_fee_per_gas * 3):
+        proc.send(tx)
+        proc.attempt_manager.make(tx, nonce=tx.nonce)
+        with mock.patch.object(proc.wallet, 'sign') as sign:
+            proc.sign(tx)
+            sign.assert_not_called()
+    assert proc.attempt_manager.current.fee.max_fee_per_gas == fee.max_fee_per_gas * 3
+    assert proc.presigner.hits == 1
+    assert proc.presigner.misses == 0
+    proc.presigner.stop()
+
+
 def test_process_tx(proc, w3, tpool, eth, trs, wallet, rdp):
     tx = push_tx(w3, rdp, tpool, wallet)
     proc.process(tx)
@@ -195,9 +281,111 @@ def test_confirm(proc, w3, rdp, tpool, wallet):
     proc.attempt_manager.make(tx)
     proc.send(tx)
     proc.wait(tx, max_time=proc.attempt_manager.current.wait_time)
+    hits = proc.receipts.hits
     # Make sure it is confirmed after reasonable number of seconds
     with in_time(8):
         proc.confirm(tx)
+    # Receipt found by wait is reused to get the block
+    assert proc.receipts.hits == hits + 1
+    assert proc.receipts.receipts == {}
+    assert tx.status == TxStatus.SUCCESS
     # Make sure next time it is confirmed instantly
     with in_time(0.1):
         proc.confirm(tx)
+
+
+def test_confirm_instant(proc, w3, rdp, tpool, wallet):
+    tx = push_tx(w3, rdp, tpool, wallet)
+    tx.meta = {'finality': 'instant'}
+    proc.attempt_manager.make(tx)
+    proc.send(tx)
+    proc.wait(tx, max_time=proc.attempt_manager.current.wait_time)
+    with mock.patch.object(proc.eth, 'get_receipts', wraps=proc.eth.get_receipts) as get_receipts:
+        with in_time(0.5):
+            proc.confirm(tx)
+        # Receipt found by wait is final
+        get_receipts.assert_not_called()
+    assert tx.status == TxStatus.SUCCESS
+
+
+def test_confirm_reorganized(proc, w3, rdp, tpool, wallet):
+    tx = push_tx(w3, rdp, tpool, wallet)
+    proc.attempt_manager.make(tx)
+    proc.send(tx)
+    proc.wait(tx, max_time=proc.attempt_manager.current.wait_time)
+    with mock.patch.object(proc.eth, 'is_canonical', return_value=False):
+        with pytest.raises(ConfirmationError):
+            proc.confirm(tx)
+    # Tx goes back to pending instead of being completed
+    assert tx.status == TxStatus.SENT
+    assert tpool.get(tx.raw_id).status == TxStatus.SENT
+    proc.confirm(tx)
+    assert tx.status == TxStatus.SUCCESS
+
+
+def test_fill_gap(proc, eth, wallet):
+    proc.window = 2
+    nonces = proc.attempt_manager.nonces
+    nonce = nonces.get()
+    # Nothing is sent when there is no gap
+    proc.fill_gap()
+    assert nonces.filled == 0
+
+    nonces.gap = nonce
+    proc.fill_gap()
+    assert nonces.filled == 1 and nonces.gap is None
+    with in_time(10):
+        while eth.get_nonce(wallet.address) == nonce:
+            time.sleep(0.5)
+    assert nonces.get() == nonce + 1
+
+
+def test_process_window(proc, w3, rdp, eth, tpool, wallet):
+    proc.window = 3
+    txs = [push_tx(w3, rdp, tpool, wallet) for _ in range(3)]
+    start_nonce = eth.get_nonce(wallet.address)
+
+    proc.process_window()
+    # All txs should be sent at once with consecutive nonces
+    assert sorted(proc.inflight) == list(range(start_nonce, start_nonce + 3))
+    for tx in txs:
+        tx = get_from_pool(tx.tx_id, tpool)
+        assert tx.status == TxStatus.SENT
+        assert tx.nonce in proc.inflight
+
+    with in_time(30):
+        while proc.inflight:
+            proc.process_window()
+    for tx in txs:
+        assert get_from_pool(tx.tx_id, tpool).status == TxStatus.SUCCESS
+    assert tpool.size == 0
+    assert proc.attempt_manager.attempts == {}
+
+
+def test_process_window_resume(proc, w3, rdp, eth, tpool, wallet, attempt_storage):
+    proc.window = 2
+    sent = push_tx(w3, rdp, tpool, wallet)
+    start_nonce = eth.get_nonce(wallet.address)
+    # Tx is sent, but the node has not received it before the restart
+    with mock.patch.object(proc.eth, 'send_raw_tx', return_value='0x12323213213321321'):
+        proc.process_window()
+    assert get_from_pool(sent.tx_id, tpool).nonce == start_nonce
+
+    # Tx pushed after the restart goes ahead of the sent one
+    tx_id = rdp.sign_and_send(make_tx(w3, wallet), priority=1)
+    assert tpool.to_list()[0] == tx_id.encode('utf-8')
+    manager = AttemptManagerV2(eth, attempt_storage, wallet.address)
+    restarted = Processor(eth, tpool, manager, wallet, window=2)
+    restarted.attempt_manager.fetch()
+    restarted.process_window()
+    # Sent tx keeps its nonce, the new one takes the next free nonce
+    assert restarted.inflight[start_nonce].tx_id == sent.tx_id
+    assert restarted.inflight[start_nonce + 1].tx_id == tx_id
+
+    with in_time(30):
+        while restarted.inflight:
+            restarted.process_window()
+    assert get_from_pool(sent.tx_id, tpool).status == TxStatus.SUCCESS
+    assert get_from_pool(sent.tx_id, tpool).nonce == start_nonce
+    assert get_from_pool(tx_id, tpool).status == TxStatus.SUCCESS
+    assert eth.get_nonce(wallet.address) == start_nonce + 2
@@ -0,0 +1,94 @@
+import pytest
+
+from transaction_manager.streampool import StreamTxPool
+from transaction_manager.structures import Tx, TxStatus
+from transaction_manager.txpool import make_score, TxPool
+
+
+@pytest.fixture
+def spool(trs):
+    sp = StreamTxPool('test_stream_pool', trs)
+    yield sp
+    sp._clear()
+
+
+def make_tx(priority, value=1):
+    return Tx(
+        tx_id='',
+        status=TxStatus.PROPOSED,
+        score=make_score(priority),
+        to='0x1',
+        value=value,
+        fee={'gas_price': 10 ** 9}
+    )
+
+
+def test_stream_pool_fetch(spool, trs):
+    spool.subscribe()
+    assert spool.fetch_next() is None
+    assert not spool.wait(timeout=0.1)
+
+    low, high, other = make_tx(5), make_tx(2), make_tx(5, value=2)
+    spool.add_many([low, high, other])
+    assert spool.size == 3
+
+    # Lower priority lane goes first
+    tx = spool.fetch_next()
+    assert tx.tx_id == high.tx_id
+    # Tx remains pending until it is released
+    assert spool.fetch_next().tx_id == high.tx_id
+    spool.release(tx)
+    assert spool.size == 2
+    assert [tx.tx_id for tx in spool.fetch_many(5)] == [low.tx_id, other.tx_id]
+
+    # Pending entries are fetched again after restart
+    restarted = StreamTxPool('test_stream_pool', trs)
+    assert [tx.tx_id for tx in restarted.fetch_many(5)] == [low.tx_id, other.tx_id]
+
+    # Pending entries of dead consumer are claimed by another one
+    another = StreamTxPool('test_stream_pool', trs, consumer='tm-1')
+    assert another.fetch_many(5) == []
+    assert another.recover(min_idle_time=0) == 2
+    assert [tx.tx_id for tx in another.fetch_many(5)] == [low.tx_id, other.tx_id]
+
+
+def test_stream_pool_wait_and_orphans(spool, trs):
+    spool.subscribe()
+    tx = make_tx(5)
+    spool.add_many([tx])
+    assert spool.wait(timeout=1)
+    trs.delete(tx.raw_id)
+    assert spool.fetch_next() is None
+    assert spool.size == 0
+
+
+def test_stream_pool_sorted_set_producer(spool, trs):
+    spool.subscribe()
+    # Producer that enqueues to the sorted set as for TxPool
+    zset_pool = TxPool('test_stream_pool', trs)
+    low, high = make_tx(5), make_tx(2)
+    zset_pool.add_many([low])
+    assert spool.size == 1
+    assert spool.wait(timeout=1)
+
+    zset_pool.add_many([high])
+    assert [tx.tx_id for tx in spool.fetch_many(5)] == [high.tx_id, low.tx_id]
+    assert trs.zcard(spool.name) == 0
+    assert spool.size == 2
+    spool.release(spool.fetch_next())
+    assert spool.size == 1
+
+
+def test_stream_pool_priority_of_new_entries(spool):
+    spool.subscribe()
+    first, second = make_tx(5), make_tx(7)
+    spool.add_many([first, second])
+    tx = spool.fetch_next()
+    assert tx.tx_id == first.tx_id
+    spool.release(tx)
+
+    # Entry of higher priority lane goes ahead of the earlier one
+    high = make_tx(2)
+    spool.add_many([high])
+    assert spool.fetch_next().tx_id == high.tx_id
+    assert [tx.tx_id for tx in spool.fetch_many(5)] == [high.tx_id, second.tx_id]
@@ -30,7 +30,7 @@ def test_sample_tx():
     loaded_tx = Tx.from_bytes(tx.tx_id.encode('utf-8'), dumped_tx)
     assert loaded_tx == tx
 
-    tx.gas_price = None
+    tx.fee.gas_price = None
     dumped_tx = tx.to_bytes()
     loaded_tx = Tx.from_bytes(tx.tx_id.encode('utf-8'), dumped_tx)
     assert loaded_tx == tx
@@ -161,3 +161,57 @@ def test_is_sent_by_ima():
 
     tx.tx_id = 'tx-cfada2025eb7d62e'
     assert not tx.is_sent_by_ima()
+
+
+def test_tx_fields():
+    tx = Tx(
+        tx_id='tx-72c337ab0ac56aa8',
+        status=TxStatus.PROPOSED,
+        score=1,
+        to='0x1',
+        value=1,
+        fee={'max_fee_per_gas': 10 ** 9, 'max_priority_fee_per_gas': 10 ** 8},
+        gas=22000,
+        data={'test': 1}
+    )
+    fields = tx.to_fields()
+    assert fields['status'] == b'"PROPOSED"'
+    assert fields['maxFeePerGas'] == b'1000000000'
+    assert fields['gasPrice'] == b'null'
+    assert 'fee' not in fields
+    raw = {name.encode('utf-8'): value for name, value in fields.items()}
+    assert Tx.from_fields(tx.raw_id, raw) == tx
+
+    tx.mark_clean()
+    assert tx.dirty == set()
+    tx.set_as_sent('0x123')
+    assert tx.dirty == {'status', 'tx_hash', 'sent_ts', 'hashes'}
+    assert set(tx.to_fields(tx.dirty)) == {'status', 'tx_hash', 'sent_ts', 'hashes'}
+
+    with pytest.raises(InvalidFormatError):
+        Tx.from_fields(tx.raw_id, {b'status': b'PROPOSED'})
+
+
+def test_tx_packed():
+    tx = Tx(
+        tx_id='tx-72c337ab0ac56aa8',
+        status=TxStatus.SENT,
+        score=1,
+        to='0x1',
+        value=10 ** 20,
+        fee={'gas_price': 10 ** 9},
+        hashes=['0x1', '0x2'],
+        data={'test': 1, 'amount': 2 ** 70},
+        meta={'chain': 'test'}
+    )
+    packed = tx.to_packed()
+    assert packed[:2] == b'\xff\x01'
+    assert len(packed) < len(tx.to_bytes())
+    assert Tx.from_bytes(tx.raw_id, packed) == tx
+    # JSON records are still accepted
+    assert Tx.from_bytes(tx.raw_id, tx.to_bytes()) == tx
+
+    with pytest.raises(InvalidFormatError):
+        Tx.from_bytes(tx.raw_id, b'\xff\x02' + packed[2:])
+    with pytest.raises(InvalidFormatError):
+        Tx.from_bytes(tx.raw_id, packed[:-3])
@@ -1,6 +1,22 @@
+import json
+import threading
 import time
+from unittest import mock
 
-from transaction_manager.structures import TxStatus
+import pytest
+import redis
+
+from transaction_manager.structures import (
+    InvalidFormatError,
+    is_packed,
+    MSGPACK_FORMAT,
+    Tx,
+    TxStatus
+)
+from transaction_manager.config import TXRECORD_EXPIRATION
+from transaction_manager.txpool import HASH_LAYOUT, make_score, TxPool
+
+from tests.utils.timing import in_time
 
 
 def test_get_next_rdp(tpool, trs, rdp):
@@ -77,3 +93,200 @@ def test_get_next(tpool, trs):
 
     tpool.release(tx)
     assert tpool.size == 0
+
+
+def test_wait(tpool, trs):
+    tpool.subscribe()
+    with in_time(1.5):
+        assert not tpool.wait(timeout=1)
+
+    def add_later(delay=0.5):
+        time.sleep(delay)
+        tpool._add_record(b'tx-1', 1, b'{}')
+
+    threading.Thread(target=add_later).start()
+    with in_time(0.8):
+        assert tpool.wait(timeout=5)
+
+    # Removing tx should not wake up the processor
+    tpool.drop(b'tx-1')
+    with in_time(1.5):
+        assert not tpool.wait(timeout=1)
+
+
+def test_enable_notifications(trs):
+    trs.config_set('notify-keyspace-events', 'E')
+    assert not TxPool('test_pool', trs).enable_notifications()
+    assert trs.config_get('notify-keyspace-events')['notify-keyspace-events'] == 'E'
+
+    tpool = TxPool('test_pool', trs, keyspace_events=True)
+    assert tpool.enable_notifications()
+    assert set(trs.config_get('notify-keyspace-events')['notify-keyspace-events']) == set('EKz')
+
+    with mock.patch.object(trs, 'config_get', side_effect=redis.ResponseError('NOPERM')):
+        assert not tpool.enable_notifications()
+    trs.config_set('notify-keyspace-events', '')
+
+
+def test_fetch_next_orphans(tpool, trs):
+    valid_record = b'{"attempts": 0, "chain_id": null, "data": null, "from": null, "gas": 22000, "gasPrice": 1000000000, "hashes": [], "nonce": 3, "score": 1, "sent_ts": null, "status": "PROPOSED", "to": "0x1", "tx_hash": null, "value": 1}'  # noqa
+    # Ids which records were expired
+    trs.zadd(tpool.name, {f'tx-orphan-{i}': 0 for i in range(250)})
+    tpool._add_record(b'tx-1', 1, valid_record)
+    tpool._add_record(b'tx-2', 2, valid_record)
+
+    assert tpool.fetch_next().tx_id == 'tx-1'
+    assert tpool.size == 2
+    assert [tx.tx_id for tx in tpool.fetch_many(3)] == ['tx-1', 'tx-2']
+
+    # Id released after it was read from the head is skipped
+    trs.set(b'tx-0', valid_record)
+    with mock.patch.object(tpool, 'get_next_ids', return_value=[b'tx-0', b'tx-1']):
+        assert [tx.tx_id for tx in tpool.fetch_many(1)] == ['tx-1']
+    assert trs.exists(b'tx-0')
+
+
+def test_add_many(tpool, trs):
+    txs = [
+        Tx(
+            tx_id='',
+            status=TxStatus.PROPOSED,
+            score=make_score(priority=5),
+            to='0x1',
+            value=i,
+            fee={'gas_price': 10 ** 9}
+        )
+        for i in range(2500)
+    ]
+    ids = tpool.add_many(txs, chunk_size=1000)
+    assert len(set(ids)) == 2500
+    assert all(tx_id.startswith('tx-') and len(tx_id) == 19 for tx_id in ids)
+    assert tpool.size == 2500
+    assert tpool.get(ids[-1].encode('utf-8')) == txs[-1]
+
+    bad = Tx(
+        tx_id='tx-bad',
+        status=TxStatus.PROPOSED,
+        score=1,
+        to='0x1',
+        fee={'gas_price': 10 ** 9},
+        data={'payload': object()}
+    )
+    with pytest.raises(InvalidFormatError):
+        tpool.add_many([bad])
+    assert tpool.size == 2500
+
+
+def test_sweep(tpool, trs):
+    tpool._add_record(b'tx-1', 1, b'{}')
+    tpool._add_record(b'tx-2', 2, b'{}')
+    trs.zadd(tpool.name, {f'tx-orphan-{i}': 0 for i in range(2500)})
+
+    assert tpool.sweep(batch_size=1000) == 2500
+    assert tpool.to_list() == [b'tx-1', b'tx-2']
+    assert tpool.sweep() == 0
+
+
+def test_hash_layout(trs):
+    tpool = TxPool('test_hash_pool', trs, layout=HASH_LAYOUT)
+    tx = Tx(
+        tx_id='',
+        status=TxStatus.PROPOSED,
+        score=make_score(priority=5),
+        to='0x1',
+        fee={'gas_price': 10 ** 9},
+        data={'test': 1}
+    )
+    tx_id = tpool.add_many([tx])[0].encode('utf-8')
+    assert trs.hget(tx_id, 'status') == b'"PROPOSED"'
+    fetched = tpool.fetch_next()
+    assert fetched == tx
+
+    fetched.set_as_sent('0x123')
+    trs.hset(tx_id, 'data', b'{"test": 2}')
+    tpool.save(fetched)
+    # Unchanged fields are not rewritten
+    saved = tpool.get(tx_id)
+    assert (saved.status, saved.tx_hash, saved.data) == (TxStatus.SENT, '0x123', {'test': 2})
+    assert 0 < trs.ttl(tx_id) <= TXRECORD_EXPIRATION
+
+    # Changed fields are not written alone to the expired record
+    trs.delete(tx_id)
+    fetched.attempts += 1
+    tpool.save(fetched)
+    assert tpool.get(tx_id) == fetched
+
+    fetched.status = TxStatus.SUCCESS
+    tpool.release(fetched)
+    assert tpool.size == 0
+    assert tpool.get(tx_id).status == TxStatus.SUCCESS
+    tpool._clear()
+
+
+def test_hash_layout_string_records(trs):
+    tpool = TxPool('test_mixed_pool', trs, layout=HASH_LAYOUT)
+    json_pool = TxPool('test_mixed_pool', trs)
+    txs = [
+        Tx(
+            tx_id='',
+            status=TxStatus.PROPOSED,
+            score=make_score(priority=5) + i,
+            to='0x1',
+            fee={'gas_price': 10 ** 9},
+            value=i
+        )
+        for i in range(4)
+    ]
+    # String records of external producers and of the json layout
+    string_ids = [i.encode('utf-8') for i in json_pool.add_many(txs[::2])]
+    hash_ids = [i.encode('utf-8') for i in tpool.add_many(txs[1::2])]
+    assert trs.type(string_ids[0]) == b'string'
+    assert trs.type(hash_ids[0]) == b'hash'
+
+    fetched = tpool.fetch_many(4)
+    assert [tx.value for tx in fetched] == [0, 1, 2, 3]
+    assert tpool.get(string_ids[0]).value == 0
+
+    for tx in fetched:
+        tx.set_as_sent('0x123')
+        tpool.save(tx)
+    # Records keep their type, producers read them as they wrote
+    assert trs.type(string_ids[0]) == b'string'
+    assert trs.type(hash_ids[0]) == b'hash'
+    assert json_pool.get(string_ids[1]).status == TxStatus.SENT
+    assert tpool.get(hash_ids[1]).status == TxStatus.SENT
+
+    for tx in fetched:
+        tx.status = TxStatus.SUCCESS
+        tpool.release(tx)
+    assert tpool.size == 0
+    assert tpool.string_records == set()
+    assert all(tpool.get(i).status == TxStatus.SUCCESS for i in string_ids + hash_ids)
+    tpool._clear()
+
+
+def test_msgpack_keeps_json_records(trs):
+    tpool = TxPool('test_packed_pool', trs, record_format=MSGPACK_FORMAT)
+    json_pool = TxPool('test_packed_pool', trs)
+    txs = [
+        Tx(
+            tx_id='',
+            status=TxStatus.PROPOSED,
+            score=make_score(priority=5) + i,
+            to='0x1',
+            fee={'gas_price': 10 ** 9},
+            value=i
+        )
+        for i in range(2)
+    ]
+    json_id = json_pool.add_many(txs[:1])[0].encode('utf-8')
+    packed_id = tpool.add_many(txs[1:])[0].encode('utf-8')
+    assert is_packed(trs.get(packed_id))
+
+    for tx in tpool.fetch_many(2):
+        tx.set_as_sent('0x123')
+        tpool.save(tx)
+    # Producer of the json record reads it with json.loads
+    assert json.loads(trs.get(json_id))['status'] == 'SENT'
+    assert is_packed(trs.get(packed_id))
+    tpool._clear()
@@ -0,0 +1,3 @@
+from .eth import AsyncEth, ReceiptWatcher  # noqa
+from .processor import AsyncProcessor  # noqa
+from .txpool import AsyncTxPool  # noqa
@@ -0,0 +1,193 @@
+#   -*- coding: utf-8 -*-
+#
+#   This file is part of SKALE Transaction Manager
+#
+#   Copyright (C) 2021 SKALE Labs
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import aiohttp
+from hexbytes import HexBytes
+from web3 import AsyncHTTPProvider, AsyncWeb3
+
+from ..broadcast import Broadcaster
+from ..config import ENDPOINT, HEAD_POLL_INTERVAL, RPC_RETRIES, RPC_TIMEOUT
+from ..eth import (
+    batch_results,
+    check_client,
+    Eth,
+    HEAD_METHODS,
+    latest_receipt,
+    ReceiptTimeoutError,
+    RETRY_BACKOFF,
+    RpcCall,
+    to_int
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEth:
+    """ Requests of the processing loop that are awaited on the event loop """
+
+    def __init__(
+        self,
+        endpoint: str = ENDPOINT,
+        timeout: int = RPC_TIMEOUT,
+        broadcaster: Optional[Broadcaster] = None
+    ) -> None:
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.broadcaster = broadcaster
+        self.w3 = AsyncWeb3(AsyncHTTPProvider(endpoint, request_kwargs={'timeout': timeout}))
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def batch(self, calls: List[RpcCall]) -> List[Any]:
+        """
+        Sends independent calls as one JSON-RPC batch, returns raw results.
+        The latest block is checked as by Eth.batch
+        """
+        if not calls:
+            return []
+        checked = any(method not in HEAD_METHODS for method, _ in calls)
+        if checked:
+            calls = calls + [('eth_getBlockByNumber', ['latest', False])]
+        payload = [
+            {'jsonrpc': '2.0', 'method': method, 'params': params, 'id': i}
+            for i, (method, params) in enumerate(calls)
+        ]
+        raw = await self.post(json.dumps(payload).encode('utf-8'))
+        results = batch_results(json.loads(raw), len(calls))
+        if checked:
+            check_client(results.pop())
+        return results
+
+    async def post(self, data: bytes) -> bytes:
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                headers={'Content-Type': 'application/json'},
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        for i in range(RPC_RETRIES):
+            try:
+                async with self.session.post(self.endpoint, data=data) as response:
+                    response.raise_for_status()
+                    return await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if i == RPC_RETRIES - 1:
+                    raise
+                logger.info('Batch request failed, retrying')
+                await asyncio.sleep(RETRY_BACKOFF)
+        raise ConnectionError('Batch request was not sent')  # pragma: no cover
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def block_number(self) -> int:
+        return to_int((await self.batch([('eth_blockNumber', [])]))[0])
+
+    async def get_receipts(self, hashes: List[str]) -> Dict[str, Dict]:
+        results = await self.batch([('eth_getTransactionReceipt', [h]) for h in hashes])
+        return {
+            h: Eth.format_receipt(receipt)
+            for h, receipt in zip(hashes, results)
+            if receipt is not None
+        }
+
+    async def send_raw_tx(self, raw_tx: Union[str, bytes]) -> str:
+        if self.broadcaster is not None:
+            return await asyncio.to_thread(self.broadcaster.send, raw_tx)
+        return (await self.w3.eth.send_raw_transaction(HexBytes(raw_tx))).hex()
+
+
+class ReceiptWatcher:
+    """
+    Polls the head on the event loop. On each new block the receipts of all
+    awaited hashes are requested with one batch and passed to the waiters
+    """
+
+    def __init__(self, eth: AsyncEth, interval: float = HEAD_POLL_INTERVAL) -> None:
+        self.eth = eth
+        self.interval = interval
+        self.head: Optional[int] = None
+        self.waiters: Dict[str, List[asyncio.Future]] = {}
+        self.new_head = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception('Receipt watcher poll failed')
+            await asyncio.sleep(self.interval)
+
+    async def poll(self) -> None:
+        head = await self.eth.block_number()
+        if head == self.head:
+            return
+        self.head = head
+        if self.waiters:
+            self.resolve(await self.eth.get_receipts(list(self.waiters)))
+        new_head, self.new_head = self.new_head, asyncio.Event()
+        new_head.set()
+
+    def resolve(self, receipts: Dict[str, Dict]) -> None:
+        for h, receipt in receipts.items():
+            for waiter in self.waiters.pop(h, []):
+                if not waiter.done():
+                    waiter.set_result((h, receipt))
+
+    async def wait_for_receipt(
+        self,
+        hashes: List[str],
+        max_time: float
+    ) -> Tuple[str, Dict]:
+        """ Waits until any of the hashes is mined, returns the latest mined one """
+        h, receipt = latest_receipt(hashes, await self.eth.get_receipts(hashes))
+        if receipt is not None:
+            return h, receipt  # type: ignore
+        waiter = asyncio.get_running_loop().create_future()
+        for h in hashes:
+            self.waiters.setdefault(h, []).append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, max_time)
+        except asyncio.TimeoutError:
+            raise ReceiptTimeoutError(f'No receipt after {max_time}')
+        finally:
+            for h in hashes:
+                waiters = self.waiters.get(h, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
+                if not waiters:
+                    self.waiters.pop(h, None)
+
+    async def wait_for_head(self, max_time: float) -> int:
+        await asyncio.wait_for(self.new_head.wait(), max_time)
+        return self.head  # type: ignore
@@ -0,0 +1,332 @@
+#   -*- coding: utf-8 -*-
+#
+#   This file is part of SKALE Transaction Manager
+#
+#   Copyright (C) 2021 SKALE Labs
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Awaitable, Callable, cast, Dict, Optional
+
+from hexbytes import HexBytes
+from skale.wallets import BaseWallet  # type: ignore
+from web3 import Web3
+
+from .eth import AsyncEth, ReceiptWatcher
+from .txpool import AsyncTxPool
+from ..attempt_manager import BaseAttemptManager
+from ..config import (
+    BASE_WAITING_TIME,
+    MAX_WAITING_TIME,
+    PIPELINE_WINDOW,
+    POOL_WAIT_TIMEOUT,
+    UNDERPRICED_RETRIES
+)
+from ..eth import (
+    Eth,
+    is_already_known,
+    is_nonce_error,
+    is_replacement_underpriced,
+    ReceiptTimeoutError
+)
+from ..finality import BaseFinality, FinalitySelector
+from ..processor import SendingError
+from ..structures import Attempt, Tx, TxStatus
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncProcessor:
+    """
+    Processor that follows each in-flight tx as a task of one event loop.
+    Txs go through the same statuses as in Processor. Attempts are made by
+    the attempt manager and signed by the wallet in a worker thread, one
+    at a time, since both are blocking. The nonces, estimates and headers
+    kept by the attempt manager are changed under the same lock
+    """
+
+    def __init__(
+        self,
+        eth: AsyncEth,
+        pool: AsyncTxPool,
+        attempt_manager: BaseAttemptManager,
+        wallet: BaseWallet,
+        window: int = PIPELINE_WINDOW,
+        finality: Optional[BaseFinality] = None
+    ) -> None:
+        self.eth = eth
+        self.pool = pool
+        self.attempt_manager = attempt_manager
+        self.wallet = wallet
+        self.address = wallet.address
+        self.window = window
+        self.finality = FinalitySelector(finality)
+        self.watcher = ReceiptWatcher(eth)
+        # Attempts are made and sent in nonce order, state of the attempt
+        # manager is not changed by the loop while a worker runs
+        self.launching = asyncio.Lock()
+        self.inflight: Dict[int, Tx] = {}
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.freed = asyncio.Event()
+        self.stopped = asyncio.Event()
+
+    @asynccontextmanager
+    async def acquire_tx(self, tx: Tx) -> AsyncGenerator[Tx, None]:
+        logger.info('Aquiring %s. Attempt %s', tx.tx_id, tx.attempts)
+        tx.attempts += 1
+        if tx.status == TxStatus.PROPOSED:
+            tx.status = TxStatus.SEEN
+        try:
+            yield tx
+        finally:
+            if not tx.is_completed() and tx.is_last_attempt():
+                tx.set_as_dropped()
+            if tx.is_completed():
+                await self.pool.release(tx)
+            else:
+                await self.pool.save(tx)
+
+    def prepare(self, tx: Tx) -> None:
+        tx.chain_id = self.attempt_manager.eth.chain_id  # type: ignore
+        tx.source = self.address
+
+    def sign(self, tx: Tx) -> str:
+        attempt = cast(Attempt, self.attempt_manager.current)
+        signed = self.wallet.sign(self.attempt_manager.eth.convert_tx(tx))  # type: ignore
+        attempt.raw_tx = Web3.to_hex(HexBytes(signed['rawTransaction']))
+        self.attempt_manager.save()
+        return attempt.raw_tx
+
+    async def locked(self, func: Callable[..., Any], *args: Any) -> Any:
+        """ Runs func in a worker thread while no attempt is made """
+        async with self.launching:
+            return await asyncio.to_thread(func, *args)
+
+    def make(self, tx: Tx, nonce: int) -> str:
+        self.prepare(tx)
+        self.attempt_manager.make(tx, nonce=nonce)
+        return self.sign(tx)
+
+    def replace(self, tx: Tx, retry: int) -> str:
+        self.attempt_manager.replace(tx, replace_attempt=retry)
+        return self.sign(tx)
+
+    async def launch(self, tx: Tx, nonce: int) -> None:
+        """ Makes the next attempt for the nonce and sends it """
+        async with self.launching:
+            raw_tx = await asyncio.to_thread(self.make, tx, nonce)
+            tx_hash, err, retry = None, None, 0
+            while tx_hash is None and retry < UNDERPRICED_RETRIES:
+                try:
+                    tx_hash = await self.eth.send_raw_tx(raw_tx)
+                except Exception as e:
+                    err = e
+                    logger.info('Sending %s failed with error %s', tx.tx_id, err)
+                    if not is_replacement_underpriced(err):
+                        if is_nonce_error(err):
+                            self.attempt_manager.nonces.reset()
+                        break
+                    raw_tx = await asyncio.to_thread(self.replace, tx, retry)
+                    retry += 1
+            if tx_hash is None:
+                tx.status = TxStatus.UNSENT
+                raise SendingError(err)
+            tx.set_as_sent(tx_hash)
+            self.attempt_manager.nonces.sent(nonce)
+        await self.pool.save(tx)
+        logger.info('Tx %s was sent with nonce %d', tx.tx_id, nonce)
+
+    async def follow(self, tx: Tx) -> None:
+        """ Waits for the tx receipt, replaces the tx on timeout, confirms it """
+        nonce = cast(int, tx.nonce)
+        try:
+            while not tx.is_completed():
+                attempt = self.attempt_manager.attempts.get(nonce)
+                wait_time = attempt.wait_time if attempt else BASE_WAITING_TIME
+                try:
+                    h, receipt = await self.watcher.wait_for_receipt(tx.hashes, wait_time)
+                except ReceiptTimeoutError:
+                    logger.info('Tx %s is not mined within %d', tx.tx_id, wait_time)
+                    tx.status = TxStatus.TIMEOUT
+                    try:
+                        if not await self.relaunch(tx, nonce):
+                            return
+                    except Exception:
+                        logger.exception('Failed to replace tx %s', tx.tx_id)
+                    continue
+                if not tx.is_mined():
+                    await self.locked(self.mined, tx, nonce, receipt)
+                    tx.set_as_mined()
+                    await self.pool.save(tx)
+                await self.confirm(tx, h, receipt)
+        except Exception:
+            logger.exception('Failed to process tx %s', tx.tx_id)
+        finally:
+            self.inflight.pop(nonce, None)
+            self.tasks.pop(nonce, None)
+            self.freed.set()
+
+    def mined(self, tx: Tx, nonce: int, receipt: Dict) -> None:
+        self.attempt_manager.eth.check_estimate(tx, receipt)  # type: ignore
+        self.attempt_manager.nonces.mined(nonce)
+
+    async def relaunch(self, tx: Tx, nonce: int) -> bool:
+        chain_nonce = await self.locked(self.attempt_manager.nonces.get)
+        if nonce < chain_nonce:
+            # The nonce could be taken by one of the sent attempts
+            if await self.eth.get_receipts(tx.hashes):
+                return True
+            logger.info('Nonce %d was taken by another tx. Resetting %s', nonce, tx.tx_id)
+            await self.forget(nonce)
+            return False
+        async with self.acquire_tx(tx):
+            await self.launch(tx, nonce)
+        return not tx.is_completed()
+
+    async def confirm(self, tx: Tx, h: str, receipt: Dict) -> None:
+        finality = self.finality.get(tx)
+        block = receipt['blockNumber']
+        while not await self.locked(
+            finality.is_final,
+            self.attempt_manager.eth,  # type: ignore
+            block,
+            self.watcher.head or block
+        ):
+            await self.watcher.wait_for_head(MAX_WAITING_TIME)
+        if finality.reorgs and not await self.locked(
+            self.is_canonical,
+            block,
+            receipt['blockHash']
+        ):
+            logger.warning('Block of tx %s was reorganized. Tx is pending again', tx.tx_id)
+            tx.status = TxStatus.SENT
+            await self.pool.save(tx)
+            return
+        logger.info('Setting tx %s as completed, result %d', tx.tx_id, receipt['status'])
+        tx.set_as_completed(h, receipt['status'])
+        await self.pool.release(tx)
+        await self.forget(cast(int, tx.nonce))
+
+    def is_canonical(self, block: int, block_hash: str) -> bool:
+        """ Header ring is shared by all the txs, it is moved to the watched head """
+        eth: Eth = self.attempt_manager.eth  # type: ignore
+        if self.watcher.head is not None:
+            eth.cache.observe(self.watcher.head)
+        return eth.is_canonical(block, block_hash)
+
+    async def forget(self, nonce: int) -> None:
+        await self.locked(self.attempt_manager.forget, nonce)
+
+    def follow_in_background(self, tx: Tx, nonce: int) -> None:
+        self.inflight[nonce] = tx
+        self.tasks[nonce] = asyncio.create_task(self.follow(tx))
+
+    async def resume(self, tx: Tx) -> None:
+        """ Follows the sent tx with its own nonce, sends it again if the node lost it """
+        nonce = cast(int, tx.nonce)
+        logger.info('Resuming tx %s with nonce %d', tx.tx_id, nonce)
+        attempt = self.attempt_manager.last_signed(tx)
+        if attempt is not None and attempt.nonce == nonce:
+            try:
+                await self.eth.send_raw_tx(cast(str, attempt.raw_tx))
+            except Exception as err:
+                if not is_already_known(err):
+                    logger.info('Sending signed attempt failed with %s', err)
+            # Receipt is awaited for each hash the tx could be mined with
+            if attempt.signed_hash not in tx.hashes:
+                tx.set_as_sent(cast(str, attempt.signed_hash))
+                await self.pool.save(tx)
+        await self.locked(self.attempt_manager.nonces.sent, nonce)
+        self.follow_in_background(tx, nonce)
+
+    async def fill(self) -> None:
+        """ Launches pool txs until the window of in-flight nonces is full """
+        if len(self.inflight) >= self.window:
+            return
+        busy = {tx.tx_id for tx in self.inflight.values()}
+        txs = [
+            tx for tx in await self.pool.fetch_many(self.window + len(self.inflight))
+            if tx.tx_id not in busy
+        ]
+        chain_nonce = await self.locked(self.attempt_manager.nonces.get)
+        # Hash sent with the nonce could still be mined, so the tx keeps it.
+        # If another tx has taken the nonce, the tx waits until it is freed
+        for tx in txs:
+            if tx.is_sent() and tx.nonce is not None and tx.nonce >= chain_nonce:
+                if tx.nonce not in self.inflight:
+                    await self.resume(tx)
+                busy.add(tx.tx_id)
+        next_nonce = chain_nonce
+        for tx in txs:
+            if len(self.inflight) >= self.window:
+                break
+            if tx.tx_id in busy:
+                continue
+            if tx.is_sent() and tx.nonce is not None and tx.nonce not in self.inflight \
+                    and await self.eth.get_receipts(tx.hashes):
+                logger.info('Tx %s has been already mined', tx.tx_id)
+                self.follow_in_background(tx, tx.nonce)
+                continue
+            # Nonces of the resumed txs are skipped
+            while next_nonce in self.inflight:
+                next_nonce += 1
+            try:
+                async with self.acquire_tx(tx):
+                    await self.launch(tx, next_nonce)
+            except Exception:
+                logger.exception('Failed to launch tx %s', tx.tx_id)
+                continue
+            if not tx.is_completed():
+                self.follow_in_background(tx, next_nonce)
+
+    async def wait(self) -> None:
+        self.freed.clear()
+        if not self.inflight:
+            wakeup: Awaitable = self.pool.wait(POOL_WAIT_TIMEOUT)
+        elif len(self.inflight) < self.window:
+            wakeup = self.pool.wait(timeout=1)
+        else:
+            wakeup = asyncio.wait_for(self.freed.wait(), timeout=1)
+        # Stop is not delayed by the pool wait
+        waiters = {asyncio.ensure_future(wakeup), asyncio.ensure_future(self.stopped.wait())}
+        done, pending = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        for waiter in pending:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    async def run(self, stopped: Optional[asyncio.Event] = None) -> None:
+        self.stopped = stopped or self.stopped
+        await asyncio.to_thread(self.attempt_manager.fetch)
+        logger.info('Loaded attempts for nonces %s', sorted(self.attempt_manager.attempts))
+        for nonce in self.attempt_manager.attempts:
+            self.attempt_manager.nonces.sent(nonce)
+        await self.pool.subscribe()
+        self.watcher.start()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    await self.fill()
+                    await self.wait()
+                except Exception:
+                    logger.exception('Failed to process txs')
+                    await asyncio.sleep(1)
+        finally:
+            await self.watcher.stop()
+            for task in self.tasks.values():
+                task.cancel()
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+            await self.eth.close()
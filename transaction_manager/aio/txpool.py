@@ -0,0 +1,119 @@
+#   -*- coding: utf-8 -*-
+#
+#   This file is part of SKALE Transaction Manager
+#
+#   Copyright (C) 2021 SKALE Labs
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import time
+from typing import List, Optional
+
+from redis import asyncio as aioredis
+
+from ..config import POOL_POLL_INTERVAL, POOL_WAIT_TIMEOUT, REDIS_URI
+from ..structures import Tx
+from ..txpool import FETCH_SCRIPT, MAX_ORPHANS_PER_FETCH, to_record, TxPool
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTxPool:
+    """
+    Awaitable access to the keys of a TxPool. Records are encoded and
+    decoded by the pool, so both can be used for the same transactions
+    """
+
+    def __init__(self, pool: TxPool, rs: Optional[aioredis.Redis] = None) -> None:
+        self.pool = pool
+        self.rs: aioredis.Redis = rs or aioredis.Redis.from_url(REDIS_URI)
+        self.pubsub: Optional[aioredis.client.PubSub] = None
+        self.notifications: bool = False
+        self._fetch = self.rs.register_script(FETCH_SCRIPT)
+
+    @property
+    def name(self) -> str:
+        return self.pool.name
+
+    async def fetch_many(self, amount: int) -> List[Tx]:
+        txs: List[Tx] = []
+        removed = 1
+        while len(txs) < amount and removed > 0:
+            ids = await self.rs.zrange(self.name, 0, amount + MAX_ORPHANS_PER_FETCH - 1)
+            removed, *records = await self._fetch(
+                keys=[self.name, *ids],
+                args=[amount, self.pool.layout]
+            )
+            if removed > 0:
+                logger.info('Removed %d expired ids from pool', removed)
+            txs = []
+            for tx_id, record in zip(records[::2], records[1::2]):
+                tx = self.pool.decode(tx_id, to_record(record))
+                if tx is None:
+                    logger.error('Received malformed tx %s. Going to remove', tx_id)
+                    await self.rs.zrem(self.name, tx_id)
+                    removed += 1
+                else:
+                    txs.append(tx)
+        return txs
+
+    async def save(self, tx: Tx) -> None:
+        logger.info('Updating record for tx %s', tx.tx_id)
+        pipe = self.rs.pipeline(transaction=False)
+        self.pool._update_record(pipe, tx)  # type: ignore
+        existed, *_ = await pipe.execute()
+        await self._restore_record(tx, existed)
+        tx.mark_clean()
+
+    async def release(self, tx: Tx) -> None:
+        logger.info('Releasing tx %s', tx.tx_id)
+        pipe = self.rs.pipeline()
+        self.pool._update_record(pipe, tx)  # type: ignore
+        pipe.zrem(self.name, tx.tx_id)
+        existed, *_ = await pipe.execute()
+        await self._restore_record(tx, existed)
+        tx.mark_clean()
+        self.pool._forget_record(tx.raw_id)
+
+    async def _restore_record(self, tx: Tx, existed: int) -> None:
+        record = self.pool._full_record(tx, existed)
+        if record is not None:
+            logger.warning('Record of tx %s has expired. Writing it in full', tx.tx_id)
+            pipe = self.rs.pipeline(transaction=False)
+            self.pool._write_record(pipe, tx.raw_id, record)  # type: ignore
+            await pipe.execute()
+
+    async def subscribe(self) -> None:
+        if self.pubsub is not None:
+            return
+        self.notifications = await asyncio.to_thread(self.pool.enable_notifications)
+        self.pubsub = self.rs.pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.subscribe(self.pool.channel, self.pool.keyspace_channel)
+
+    async def wait(self, timeout: float = POOL_WAIT_TIMEOUT) -> bool:
+        """ Waits until a tx is added to the pool or timeout expires """
+        await self.subscribe()
+        pubsub: aioredis.client.PubSub = self.pubsub  # type: ignore
+        if not self.notifications:
+            timeout = min(timeout, POOL_POLL_INTERVAL)
+        deadline = time.time() + timeout
+        woken = False
+        while not woken and (remaining := deadline - time.time()) > 0:
+            message = await pubsub.get_message(timeout=remaining)
+            woken = message is not None and self.pool.is_addition(message)
+        while await pubsub.get_message() is not None:
+            pass
+        return woken
@@ -20,9 +20,10 @@
 import logging
 from abc import ABCMeta, abstractmethod
 from functools import wraps
-from typing import Any, Callable, cast, Optional, TypeVar
+from typing import Any, Callable, cast, Dict, Optional, TypeVar
 
-from ..structures import Attempt, Tx
+from ..nonces import NonceManager
+from ..structures import Attempt, Fee, Tx
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +45,10 @@ def made(func: F) -> F:
 
 
 class BaseAttemptManager(metaclass=ABCMeta):
+    attempts: Dict[int, Attempt]
+    nonces: NonceManager
+    _current: Optional[Attempt]
+
     @property
     @abstractmethod
     def current(self) -> Optional[Attempt]:  # pragma: no cover
@@ -58,9 +63,31 @@ class BaseAttemptManager(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def make(self, tx: Tx) -> None:  # pragma: no cover
+    def make(
+        self,
+        tx: Tx,
+        nonce: Optional[int] = None
+    ) -> None:  # pragma: no cover
+        pass
+
+    @abstractmethod
+    def forget(self, nonce: int) -> None:  # pragma: no cover
         pass
 
     @abstractmethod
     def replace(self, tx: Tx, replace_attempt: int) -> None:  # pragma: no cover
         pass
+
+    def next_fee(self, attempt: Attempt) -> Optional[Fee]:
+        """ Fee of the attempt after the timeout, if chain fees stay below it """
+        return None
+
+    def last_signed(self, tx: Tx) -> Optional[Attempt]:
+        """ Last attempt for the nonce of the tx, if it was signed for the tx """
+        attempt = self.attempts.get(tx.nonce) if tx.nonce is not None else None
+        if attempt is None or attempt.tx_id != tx.tx_id or attempt.raw_tx is None:
+            return None
+        return attempt
+
+    def resume(self, attempt: Attempt) -> None:
+        self._current = attempt
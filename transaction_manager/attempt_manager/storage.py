@@ -18,31 +18,102 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
+import logging
 from abc import ABCMeta, abstractmethod
-from typing import Optional
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
 
-from ..structures import Attempt
+from ..config import RECORD_FORMAT
+from ..structures import Attempt, MSGPACK_FORMAT
 from ..resources import rs as grs, redis
 
+logger = logging.getLogger(__name__)
+
+LEGACY_ATTEMPT_KEY = b'last_attempt'
+
 
 class BaseAttemptStorage(metaclass=ABCMeta):
     @abstractmethod
-    def get(self) -> Optional[Attempt]:  # pragma: no cover
+    def get(self, nonce: int) -> Optional[Attempt]:  # pragma: no cover
+        pass
+
+    @abstractmethod
+    def load(self) -> Dict[int, List[Attempt]]:  # pragma: no cover
         pass
 
+    @abstractmethod
     def save(self, attempt: Attempt) -> None:  # pragma: no cover
         pass
 
+    @abstractmethod
+    def prune(self, nonces: Iterable[int]) -> None:  # pragma: no cover
+        pass
+
 
 class RedisAttemptStorage(BaseAttemptStorage):
-    def __init__(self, rs: redis.Redis = grs) -> None:
+    """ Keeps attempt history in a single hash, one field per nonce:index """
+
+    def __init__(
+        self,
+        rs: redis.Redis = grs,
+        name: str = 'attempts',
+        record_format: str = RECORD_FORMAT
+    ) -> None:
         self.rs = rs
+        self.name = name
+        self.record_format = record_format
+
+    @classmethod
+    def _field(cls, attempt: Attempt) -> bytes:
+        return f'{attempt.nonce}:{attempt.index}'.encode('utf-8')
+
+    @classmethod
+    def _parse_field(cls, field: bytes) -> List[int]:
+        return list(map(int, field.split(b':')))
 
-    def get(self) -> Optional[Attempt]:
-        attempt_bytes = self.rs.get(b'last_attempt')
-        if not attempt_bytes:
-            return None
-        return Attempt.from_bytes(attempt_bytes)
+    def history(self, nonce: int) -> List[Attempt]:
+        records = sorted(
+            (self._parse_field(field)[1], record)
+            for field, record in self.rs.hscan_iter(self.name, match=f'{nonce}:*')
+        )
+        return [Attempt.from_bytes(record) for _, record in records]
+
+    def get(self, nonce: int) -> Optional[Attempt]:
+        history = self.history(nonce)
+        return history[-1] if history else None
+
+    def _migrate_legacy(self) -> None:
+        attempt_bytes = self.rs.get(LEGACY_ATTEMPT_KEY)
+        if attempt_bytes:
+            attempt = Attempt.from_bytes(attempt_bytes)
+            logger.info('Moving legacy attempt for nonce %d', attempt.nonce)
+            self.save(attempt)
+            self.rs.delete(LEGACY_ATTEMPT_KEY)
+
+    def load(self) -> Dict[int, List[Attempt]]:
+        self._migrate_legacy()
+        indexed = defaultdict(list)
+        for field, record in self.rs.hgetall(self.name).items():
+            nonce, index = self._parse_field(field)
+            indexed[nonce].append((index, record))
+        return {
+            nonce: [Attempt.from_bytes(r) for _, r in sorted(records)]
+            for nonce, records in indexed.items()
+        }
 
     def save(self, attempt: Attempt) -> None:
-        self.rs.set(b'last_attempt', attempt.to_bytes())
+        if self.record_format == MSGPACK_FORMAT:
+            record = attempt.to_packed()
+        else:
+            record = attempt.to_bytes()
+        self.rs.hset(self.name, self._field(attempt), record)
+
+    def prune(self, nonces: Iterable[int]) -> None:
+        stale = set(nonces)
+        fields = [
+            field
+            for field in self.rs.hkeys(self.name)
+            if self._parse_field(field)[0] in stale
+        ]
+        if fields:
+            self.rs.hdel(self.name, *fields)
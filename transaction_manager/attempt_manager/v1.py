@@ -18,11 +18,12 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-from typing import Optional
+from typing import cast, Dict, Optional
 
 from .base import BaseAttemptManager, made
 from .storage import BaseAttemptStorage
 from ..eth import Eth
+from ..nonces import NonceManager
 from ..structures import Attempt, Fee, Tx
 from ..config import (
     BASE_WAITING_TIME,
@@ -46,12 +47,15 @@ class AttemptManagerV1(BaseAttemptManager):
         base_waiting_time: int = BASE_WAITING_TIME,
         min_gas_price_inc: int = MIN_GAS_PRICE_INC_PERCENT,
         gas_price_inc_percent: int = GAS_PRICE_INC_PERCENT,
-        grad_gas_price_inc_percent: int = GRAD_GAS_PRICE_INC_PERCENT
+        grad_gas_price_inc_percent: int = GRAD_GAS_PRICE_INC_PERCENT,
+        nonces: Optional[NonceManager] = None
     ) -> None:
         self.eth = eth
+        self.nonces = nonces or NonceManager(eth, source)
         self.storage = storage
         self.source = source
         self._current = current
+        self.attempts: Dict[int, Attempt] = {}
         self.max_gas_price = max_gas_price
         self.base_waiting_time = base_waiting_time
         self.min_gas_price_inc = min_gas_price_inc
@@ -59,12 +63,23 @@ class AttemptManagerV1(BaseAttemptManager):
         self.grad_gas_price_inc_percent = grad_gas_price_inc_percent
 
     def fetch(self) -> None:
-        self._current = self.storage.get()
+        self.attempts = {
+            nonce: history[-1]
+            for nonce, history in self.storage.load().items()
+        }
+        self._current = self.attempts[max(self.attempts)] if self.attempts else None
 
     @property
     def current(self) -> Optional[Attempt]:
         return self._current
 
+    def forget(self, nonce: int) -> None:
+        stale = [n for n in self.attempts if n <= nonce]
+        if stale:
+            self.storage.prune(stale)
+            for n in stale:
+                del self.attempts[n]
+
     @made
     def save(self) -> None:
         self.storage.save(self.current)  # type: ignore
@@ -96,6 +111,8 @@ class AttemptManagerV1(BaseAttemptManager):
             ngp = self.max_gas_price
         fee = Fee(gas_price=ngp)  # type: ignore
         tx.fee = self._current.fee = fee  # type: ignore
+        # Signed with the previous fee
+        self._current.raw_tx = None  # type: ignore
 
     def next_gas_price(
         self,
@@ -111,15 +128,27 @@ class AttemptManagerV1(BaseAttemptManager):
             next_gas_price = self.max_gas_price
         return max(average_gas_price, next_gas_price)
 
-    def make(self, tx: Tx) -> None:
-        last = self.current
+    def next_fee(self, attempt: Attempt) -> Optional[Fee]:
+        if attempt.fee is None or attempt.fee.gas_price is None:
+            return None
+        return Fee(gas_price=self.next_gas_price(attempt.fee.gas_price, 0))
 
-        nonce = self.eth.get_nonce(self.source)
-        logger.info(f'Received current nonce - {nonce}')
-        avg_gas_price = self.eth.avg_gas_price
+    def make(self, tx: Tx, nonce: Optional[int] = None) -> None:
+        state = self.eth.fetch_state(
+            self.source,
+            gas_price=True
+        )
+        if nonce is None:
+            nonce = self.nonces.get()
+            logger.info(f'Received current nonce - {nonce}')
+            self.forget(nonce - 1)
+        else:
+            logger.info(f'Using pipelined nonce - {nonce}')
+        last = self.attempts.get(nonce)
+        avg_gas_price = cast(int, state.avg_gas_price)
         logger.info(f'Received average gas price {avg_gas_price}')
 
-        if last is None or last.fee.gas_price is None or nonce > last.nonce:
+        if last is None or last.fee.gas_price is None:
             next_gp = avg_gas_price
             next_wait_time = self.base_waiting_time
             next_index = 1
@@ -131,7 +160,7 @@ class AttemptManagerV1(BaseAttemptManager):
         logger.info(f'Calculated new gas price {next_gp}')
         fee = Fee(gas_price=next_gp)
         tx.nonce = nonce
-        gas = self.eth.calculate_gas(tx)
+        gas = self.eth.calculate_gas(tx, gas_limit=state.block_gas_limit)
         logger.info(f'Estimated gas {gas}')
         tx.gas = gas
         tx.fee = fee
@@ -144,3 +173,4 @@ class AttemptManagerV1(BaseAttemptManager):
             wait_time=next_wait_time,
             gas=gas
         )
+        self.attempts[nonce] = self._current
@@ -18,7 +18,7 @@
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-from typing import Optional
+from typing import Dict, Optional
 
 from .base import BaseAttemptManager, made
 from .storage import BaseAttemptStorage
@@ -35,6 +35,7 @@ from ..config import (
     MIN_PRIORITY_FEE
 )
 from ..eth import Eth
+from ..nonces import NonceManager
 from ..structures import Attempt, Fee, Tx
 
 logger = logging.getLogger(__name__)
@@ -53,10 +54,13 @@ class AttemptManagerV2(BaseAttemptManager):
         min_inc_percent: int = MIN_FEE_INC_PERCENT,
         max_fee: int = MAX_FEE_VALUE,
         max_tx_cap: int = MAX_TX_CAP,
-        base_fee_adjustment_percent: int = BASE_FEE_ADJUSMENT_PERCENT
+        base_fee_adjustment_percent: int = BASE_FEE_ADJUSMENT_PERCENT,
+        nonces: Optional[NonceManager] = None
     ) -> None:
         self.eth = eth
+        self.nonces = nonces or NonceManager(eth, source)
         self._current = current
+        self.attempts: Dict[int, Attempt] = {}
         self.storage = storage
         self.source = source
         self.base_waiting_time = base_waiting_time
@@ -67,12 +71,23 @@ class AttemptManagerV2(BaseAttemptManager):
         self.max_fee = max_fee
 
     def fetch(self) -> None:
-        self._current = self.storage.get()
+        self.attempts = {
+            nonce: history[-1]
+            for nonce, history in self.storage.load().items()
+        }
+        self._current = self.attempts[max(self.attempts)] if self.attempts else None
 
     @property
     def current(self) -> Optional[Attempt]:
         return self._current
 
+    def forget(self, nonce: int) -> None:
+        stale = [n for n in self.attempts if n <= nonce]
+        if stale:
+            self.storage.prune(stale)
+            for n in stale:
+                del self.attempts[n]
+
     @made
     def save(self) -> None:
         if self.current:
@@ -116,6 +131,8 @@ class AttemptManagerV2(BaseAttemptManager):
 
         fee = Fee(max_priority_fee_per_gas=tip, max_fee_per_gas=gap)
         tx.fee = self._current.fee = fee  # type: ignore
+        # Signed with the previous fee
+        self._current.raw_tx = None  # type: ignore
 
     def next_fee_value(
         self,
@@ -125,11 +142,40 @@ class AttemptManagerV2(BaseAttemptManager):
     ) -> int:
         return self.inc_fee_value(fee_value, min_fee=min_fee, max_fee=max_fee)
 
+    def next_fee(self, attempt: Attempt) -> Optional[Fee]:
+        fee = attempt.fee
+        if fee is None or fee.max_fee_per_gas is None:
+            return None
+        history = self.eth.fetch_state(self.source, fee_history=True).fee_history
+        return self.escalate_fee(
+            fee,
+            self.eth.get_estimated_base_fee(history),
+            self.eth.get_p60_tip(history)
+        )
+
+    def escalate_fee(self, fee: Fee, estimated_base_fee: int, good_tip: int) -> Fee:
+        """ Fee of the next attempt, not lower than the fee history suggests """
+        tip = self.next_fee_value(
+            fee.max_priority_fee_per_gas,  # type: ignore
+            min_fee=good_tip
+        )
+        gap = self.next_fee_value(
+            fee.max_fee_per_gas,  # type: ignore
+            min_fee=estimated_base_fee
+        )
+        return Fee(max_priority_fee_per_gas=tip, max_fee_per_gas=gap)
+
     def next_waiting_time(self, attempt_index: int) -> int:
         return self.base_waiting_time + 10 * (attempt_index ** 2)
 
-    def max_allowed_fee(self, gas: int, value: int) -> int:
-        balance = self.eth.get_balance(self.source)
+    def max_allowed_fee(
+        self,
+        gas: int,
+        value: int,
+        balance: Optional[int] = None
+    ) -> int:
+        if balance is None:
+            balance = self.eth.get_balance(self.source)
         return max(0, (balance - value)) // gas
 
     def calculate_initial_fee(
@@ -142,40 +188,42 @@ class AttemptManagerV2(BaseAttemptManager):
         gap = (100 + self.base_fee_adjustment_percent) * raw_gap // 100
         return Fee(max_priority_fee_per_gas=tip, max_fee_per_gas=gap)
 
-    def make(self, tx: Tx) -> None:
-        last = self.current
-        nonce = self.eth.get_nonce(self.source)
-        logger.info(f'Received current nonce - {nonce}')
+    def make(self, tx: Tx, nonce: Optional[int] = None) -> None:
+        state = self.eth.fetch_state(
+            self.source,
+            fee_history=True,
+            # Balance limits the fee only if gas is set by the sender
+            balance=tx.gas is not None
+        )
+        if nonce is None:
+            nonce = self.nonces.get()
+            logger.info(f'Received current nonce - {nonce}')
+            self.forget(nonce - 1)
+        else:
+            logger.info(f'Using pipelined nonce - {nonce}')
+        last = self.attempts.get(nonce)
 
-        history = self.eth.get_fee_history()
+        history = state.fee_history
         estimated_base_fee = self.eth.get_estimated_base_fee(history)
         good_tip = self.eth.get_p60_tip(history)
 
-        if last is None or nonce > last.nonce or last.fee is None:
+        if last is None or last.fee is None:
             next_index = 1
             next_fee = self.calculate_initial_fee(estimated_base_fee, good_tip)
             next_wait_time = self.base_waiting_time
         else:
             next_index = last.index + 1
-            tip = self.next_fee_value(
-                last.fee.max_priority_fee_per_gas,  # type: ignore
-                min_fee=good_tip
-            )
-            gap = self.next_fee_value(
-                last.fee.max_fee_per_gas,  # type: ignore
-                min_fee=estimated_base_fee
-            )
-            next_fee = Fee(max_priority_fee_per_gas=tip, max_fee_per_gas=gap)
+            next_fee = self.escalate_fee(last.fee, estimated_base_fee, good_tip)
             next_wait_time = self.next_waiting_time(next_index)
 
         logger.info('Next fee %s', next_fee)
         tx.fee, tx.nonce = next_fee, nonce
-        estimated_gas = self.eth.calculate_gas(tx)
+        estimated_gas = self.eth.calculate_gas(tx, gas_limit=state.block_gas_limit)
 
         logger.info('Estimated gas %d', estimated_gas)
         tx.gas = max(estimated_gas, tx.gas or 0)
         if tx.gas > estimated_gas:
-            allowed_fee = self.max_allowed_fee(tx.gas, tx.value)
+            allowed_fee = self.max_allowed_fee(tx.gas, tx.value, state.balance)
             if allowed_fee < next_fee.max_fee_per_gas:   # type: ignore
                 logger.warning(
                     'Suggested fee exceeds allowance. Defaulting to %d',
@@ -196,3 +244,4 @@ class AttemptManagerV2(BaseAttemptManager):
             wait_time=next_wait_time,
             gas=tx.gas
         )
+        self.attempts[nonce] = self._current
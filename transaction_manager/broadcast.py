@@ -0,0 +1,170 @@
+#   -*- coding: utf-8 -*-
+#
+#   This file is part of SKALE Transaction Manager
+#
+#   Copyright (C) 2021 SKALE Labs
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import threading
+import time
+from concurrent import futures
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Union
+
+from hexbytes import HexBytes
+from web3 import Web3
+
+from .config import BROADCAST_ENDPOINTS, BROADCAST_TIMEOUT
+from .endpoints import post_request, with_main_endpoint
+from .eth import is_already_known, is_nonce_error, is_replacement_underpriced
+
+logger = logging.getLogger(__name__)
+
+KNOWN = 'known'
+NONCE = 'nonce'
+UNDERPRICED = 'underpriced'
+REJECTED = 'rejected'
+UNAVAILABLE = 'unavailable'
+
+# Error that is raised if no endpoint accepted the tx, the first one wins
+ERROR_PRIORITY = (NONCE, UNDERPRICED, REJECTED, UNAVAILABLE)
+
+
+def classify_error(err: Exception) -> str:
+    if is_already_known(err):
+        return KNOWN
+    if is_replacement_underpriced(err):
+        return UNDERPRICED
+    if is_nonce_error(err):
+        return NONCE
+    if isinstance(err, ValueError):
+        return REJECTED
+    return UNAVAILABLE
+
+
+@dataclass(slots=True)
+class EndpointStats:
+    sent: int = 0
+    accepted: int = 0
+    # Times the endpoint was the first one to accept a tx
+    fastest: int = 0
+    latency: float = 0
+    errors: Dict[str, int] = field(default_factory=dict)
+
+
+class Broadcaster:
+    """ Sends the same signed tx to all endpoints, returns the first accepted hash """
+
+    def __init__(
+        self,
+        endpoints: List[str],
+        timeout: int = BROADCAST_TIMEOUT
+    ) -> None:
+        self.endpoints = endpoints
+        self.timeout = timeout
+        self.executor = futures.ThreadPoolExecutor(
+            max_workers=len(endpoints),
+            thread_name_prefix='broadcast'
+        )
+        self.stats: Dict[str, EndpointStats] = {e: EndpointStats() for e in endpoints}
+        self.lock = threading.Lock()
+
+    def _send(self, endpoint: str, raw_tx: str) -> str:
+        payload = {
+            'jsonrpc': '2.0',
+            'method': 'eth_sendRawTransaction',
+            'params': [raw_tx],
+            'id': 1
+        }
+        start_ts = time.time()
+        try:
+            response = json.loads(post_request(
+                endpoint,
+                json.dumps(payload).encode('utf-8'),
+                timeout=self.timeout
+            ))
+            if 'error' in response:
+                raise ValueError(response['error'])
+        except Exception as err:
+            self.record(endpoint, error=err)
+            raise
+        self.record(endpoint, latency=time.time() - start_ts)
+        return response['result']
+
+    def record(
+        self,
+        endpoint: str,
+        latency: Optional[float] = None,
+        error: Optional[Exception] = None
+    ) -> None:
+        with self.lock:
+            stats = self.stats[endpoint]
+            stats.sent += 1
+            if error is not None:
+                kind = classify_error(error)
+                stats.errors[kind] = stats.errors.get(kind, 0) + 1
+            else:
+                stats.accepted += 1
+                stats.latency = latency or 0
+
+    def send(self, raw_tx: Union[str, bytes]) -> str:
+        raw_tx = Web3.to_hex(HexBytes(raw_tx))
+        pending: Dict[futures.Future, str] = {
+            self.executor.submit(self._send, endpoint, raw_tx): endpoint
+            for endpoint in self.endpoints
+        }
+        errors: Dict[str, Exception] = {}
+        try:
+            for future in futures.as_completed(pending, timeout=self.timeout):
+                endpoint = pending[future]
+                try:
+                    tx_hash = future.result()
+                except Exception as err:
+                    logger.info('Endpoint %s did not accept tx: %s', endpoint, err)
+                    errors.setdefault(classify_error(err), err)
+                    continue
+                with self.lock:
+                    self.stats[endpoint].fastest += 1
+                logger.info('Tx %s was first accepted by %s', tx_hash, endpoint)
+                return tx_hash
+        except futures.TimeoutError:
+            logger.warning('Broadcast timed out after %ds', self.timeout)
+
+        if KNOWN in errors:
+            # Tx is already in the pool of the node
+            return Web3.keccak(hexstr=raw_tx).hex()
+        for kind in ERROR_PRIORITY:
+            if kind in errors:
+                raise errors[kind]
+        raise ConnectionError('No endpoint accepted the tx')
+
+    @property
+    def fastest(self) -> Optional[str]:
+        """ Endpoint that was the first to accept most of the txs """
+        endpoint = max(self.stats, key=lambda e: self.stats[e].fastest)
+        return endpoint if self.stats[endpoint].fastest > 0 else None
+
+    def stop(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def make_broadcaster(
+    endpoints: str = BROADCAST_ENDPOINTS
+) -> Optional[Broadcaster]:
+    """ Broadcaster for the main and extra endpoints, None if no extra ones """
+    uris = with_main_endpoint(endpoints)
+    return Broadcaster(uris) if uris else None
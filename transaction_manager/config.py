@@ -46,6 +46,37 @@ TXRECORD_EXPIRATION = 24 * 60 * 60  # 1 day
 DEFAULT_ID_LEN = 19
 DEFAULT_GAS_LIMIT: int = 1000000
 IMA_ID_SUFFIX = 'js'
+PIPELINE_WINDOW: int = 1  # in-flight txs with consecutive nonces
+ENGINE: str = 'sync'  # or 'async', txs are followed by one event loop
+POOL_WAIT_TIMEOUT: int = 60
+POOL_NOTIFICATIONS: int = 0  # 1 enables keyspace events on the redis server
+POOL_POLL_INTERVAL: int = 1  # if keyspace notifications are not available
+SWEEP_INTERVAL: int = 10 * 60
+POOL_BACKEND: str = 'zset'  # or 'stream'
+RECORD_LAYOUT: str = 'json'  # or 'hash'
+RECORD_FORMAT: str = 'json'  # or 'msgpack', for json layout and attempts
+BLOCK_CACHE_TTL: int = 5  # if no new head is observed
+GAS_ESTIMATE_BLOCKS: int = 3  # estimates of the same call are reused, 0 disables
+HEAD_POLL_INTERVAL: int = 1  # 0 disables shared head poller
+FINALITY: str = 'blocks'  # or 'finalized', 'instant'
+HEADER_RING_SIZE: int = 64  # recent block hashes to detect reorgs
+NONCE_SYNC_INTERVAL: int = 10  # local nonce is checked against the chain
+PRESIGN: int = 0  # 1 signs the next fee level while the tx is waiting
+BROADCAST_ENDPOINTS: str = ''  # comma separated, signed txs are sent to ENDPOINT too
+BROADCAST_TIMEOUT: int = 10
+RPC_ENDPOINTS: str = ''  # comma separated, requests go to the fastest healthy one
+RPC_TIMEOUT: int = 10
+RPC_RETRIES: int = 5  # batches are retried as by the web3 http retry middleware
+RPC_FAILURE_THRESHOLD: int = 3  # consecutive failures to eject an endpoint
+RPC_EJECT_TIME: int = 30
+RPC_CHECK_INTERVAL: int = 5
+RPC_MAX_LAG: int = 5  # blocks behind the highest head to eject an endpoint
+
+# Stream pool
+STREAM_GROUP: str = 'tm'
+STREAM_CONSUMER: str = 'tm-0'
+STREAM_LANES: int = 10
+STREAM_CLAIM_IDLE_TIME: int = 10 * 60
 
 # V1
 AVG_GAS_PRICE_INC_PERCENT = 50
@@ -0,0 +1,278 @@
+#   -*- coding: utf-8 -*-
+#
+#   This file is part of SKALE Transaction Manager
+#
+#   Copyright (C) 2021 SKALE Labs
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from web3 import HTTPProvider
+from web3.types import RPCEndpoint, RPCResponse
+
+from .config import (
+    ENDPOINT,
+    RPC_CHECK_INTERVAL,
+    RPC_ENDPOINTS,
+    RPC_EJECT_TIME,
+    RPC_FAILURE_THRESHOLD,
+    RPC_MAX_LAG,
+    RPC_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Weight of the last health check in the endpoint latency
+LATENCY_WEIGHT = 0.2
+# Reads are moved to another endpoint only if it is faster by this ratio
+SWITCH_RATIO = 0.8
+
+# Shared by all threads to keep the connections to the endpoints alive
+session = requests.Session()
+
+
+def post_request(uri: str, data: bytes, **kwargs: Any) -> bytes:
+    """ Posts a JSON-RPC payload, raises requests errors as the provider does """
+    kwargs.setdefault('headers', {'Content-Type': 'application/json'})
+    response = session.post(uri, data=data, **kwargs)
+    response.raise_for_status()
+    return response.content
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        # Last count is for the values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """ Upper bound of the bucket with the quantile """
+        if self.count == 0:
+            return None
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')  # pragma: no cover
+
+    def to_dict(self) -> Dict[str, int]:
+        labels = [str(b) for b in self.buckets] + ['inf']
+        return dict(zip(labels, self.counts))
+
+
+class Endpoint:
+    def __init__(self, uri: str) -> None:
+        self.uri = uri
+        self.histogram = LatencyHistogram()
+        # Health check latency, requests of different methods are not compared
+        self.latency: Optional[float] = None
+        self.block: Optional[int] = None
+        self.failures = 0
+        self.ejected_ts: Optional[float] = None
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_ts is not None
+
+    @property
+    def rank(self) -> float:
+        return self.latency if self.latency is not None else float('inf')
+
+    def __repr__(self) -> str:
+        return self.uri
+
+
+class EndpointPool(HTTPProvider):
+    """
+    Provider that sends each request to the preferred endpoint and fails over
+    to the others. Endpoints are ejected after consecutive failures and get
+    requests again after a successful health check or the eject time
+    """
+
+    def __init__(
+        self,
+        uris: List[str],
+        timeout: int = RPC_TIMEOUT,
+        failure_threshold: int = RPC_FAILURE_THRESHOLD,
+        eject_time: int = RPC_EJECT_TIME,
+        max_lag: int = RPC_MAX_LAG
+    ) -> None:
+        super().__init__(uris[0], request_kwargs={'timeout': timeout})
+        self.endpoints = [Endpoint(uri) for uri in uris]
+        self.preferred = self.endpoints[0]
+        self.failure_threshold = failure_threshold
+        self.eject_time = eject_time
+        self.max_lag = max_lag
+        self.lock = threading.Lock()
+
+    def available(self, endpoint: Endpoint) -> bool:
+        return endpoint.ejected_ts is None or \
+            time.time() - endpoint.ejected_ts >= self.eject_time
+
+    def candidates(self) -> List[Endpoint]:
+        """ Preferred endpoint first, ejected ones are the last resort """
+        with self.lock:
+            return sorted(
+                self.endpoints,
+                key=lambda e: (not self.available(e), e is not self.preferred, e.rank)
+            )
+
+    def _post(self, endpoint: Endpoint, data: bytes) -> Tuple[bytes, float]:
+        start_ts = time.time()
+        raw = post_request(endpoint.uri, data, **self.get_request_kwargs())
+        return raw, time.time() - start_ts
+
+    def post(self, data: bytes) -> bytes:
+        err: Optional[Exception] = None
+        for endpoint in self.candidates():
+            try:
+                raw, latency = self._post(endpoint, data)
+            except Exception as e:
+                logger.info('Request to %s failed with %s', endpoint, e)
+                self.failed(endpoint, e)
+                err = e
+                continue
+            self.succeeded(endpoint, latency)
+            return raw
+        raise err  # type: ignore
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        raw = self.post(self.encode_rpc_request(method, params))
+        return self.decode_rpc_response(raw)
+
+    def succeeded(self, endpoint: Endpoint, latency: float) -> None:
+        with self.lock:
+            endpoint.histogram.observe(latency)
+            endpoint.failures = 0
+            if endpoint.ejected:
+                self._restore(endpoint)
+
+    def failed(self, endpoint: Endpoint, err: Exception) -> None:
+        with self.lock:
+            endpoint.failures += 1
+            if not endpoint.ejected and endpoint.failures >= self.failure_threshold:
+                self._eject(endpoint, f'{endpoint.failures} failures, last {err}')
+
+    def _eject(self, endpoint: Endpoint, reason: str) -> None:
+        logger.warning('Ejecting endpoint %s: %s', endpoint, reason)
+        endpoint.ejected_ts = time.time()
+        self._reroute()
+
+    def _restore(self, endpoint: Endpoint) -> None:
+        logger.info('Endpoint %s is healthy again', endpoint)
+        endpoint.ejected_ts = None
+        self._reroute()
+
+    def _reroute(self) -> None:
+        healthy = [e for e in self.endpoints if not e.ejected]
+        if not healthy:
+            return
+        best = min(healthy, key=lambda e: e.rank)
+        current = self.preferred
+        if best is not current and (
+            current.ejected or best.rank < current.rank * SWITCH_RATIO
+        ):
+            logger.info('Routing requests to %s, latency %s', best, best.latency)
+            self.preferred = best
+
+    def check(self) -> None:
+        """ Measures latency and head of each endpoint with eth_blockNumber """
+        data = self.encode_rpc_request(RPCEndpoint('eth_blockNumber'), [])
+        results: Dict[Endpoint, Tuple[int, float]] = {}
+        for endpoint in self.endpoints:
+            try:
+                raw, latency = self._post(endpoint, data)
+                results[endpoint] = (int(json.loads(raw)['result'], 16), latency)
+            except Exception as err:
+                logger.info('Health check of %s failed with %s', endpoint, err)
+                self.failed(endpoint, err)
+        if not results:
+            return
+        head = max(block for block, _ in results.values())
+        with self.lock:
+            for endpoint, (block, latency) in results.items():
+                endpoint.block = block
+                endpoint.histogram.observe(latency)
+                endpoint.latency = latency if endpoint.latency is None else \
+                    LATENCY_WEIGHT * latency + (1 - LATENCY_WEIGHT) * endpoint.latency
+                if head - block > self.max_lag:
+                    if not endpoint.ejected:
+                        self._eject(endpoint, f'{head - block} blocks behind')
+                else:
+                    endpoint.failures = 0
+                    if endpoint.ejected:
+                        self._restore(endpoint)
+            self._reroute()
+
+    @property
+    def metrics(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {
+                e.uri: {
+                    'preferred': e is self.preferred,
+                    'ejected': e.ejected,
+                    'latency': e.latency,
+                    'block': e.block,
+                    'p50': e.histogram.quantile(0.5),
+                    'p99': e.histogram.quantile(0.99),
+                    'histogram': e.histogram.to_dict()
+                }
+                for e in self.endpoints
+            }
+
+
+class HealthChecker(threading.Thread):
+    def __init__(self, pool: EndpointPool, interval: int = RPC_CHECK_INTERVAL) -> None:
+        super().__init__(name='rpc-health', daemon=True)
+        self.pool = pool
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.pool.check()
+            except Exception:
+                logger.exception('Endpoint health check failed')
+            self.stopped.wait(self.interval)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+def with_main_endpoint(endpoints: str) -> List[str]:
+    """ ENDPOINT and comma separated extra endpoints, empty if there are no extra """
+    extra = [e.strip() for e in endpoints.split(',') if e.strip() not in ('', ENDPOINT)]
+    return [ENDPOINT] + extra if extra else []
+
+
+def make_endpoint_pool(endpoints: str = RPC_ENDPOINTS) -> Optional[EndpointPool]:
+    uris = with_main_endpoint(endpoints)
+    return EndpointPool(uris) if uris else None
@@ -17,28 +17,64 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import json
 import logging
+import threading
 import time
+from dataclasses import dataclass
 from functools import cached_property
-from typing import cast, Dict, Optional
+from typing import (
+    Any,
+    Callable,
+    cast,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+    Union
+)
 
 from eth_typing.evm import HexStr
-from web3 import Web3
+from hexbytes import HexBytes
+from requests import exceptions as http
+from skale.config import LAST_BLOCK_FILE, NO_SYNC_TS_DIFF  # type: ignore
+from skale.utils.helper import is_test_env  # type: ignore
+from skale.utils.web3_utils import (  # type: ignore
+    EthClientOutdatedError,
+    get_last_known_block_number,
+    outdated_client_file_msg,
+    outdated_client_time_msg,
+    save_last_known_block_number
+)
+from web3 import HTTPProvider, Web3
 from web3.exceptions import ContractLogicError, TransactionNotFound
 from web3.types import FeeHistory, TxParams
 
 from .config import (
+    ALLOWED_TS_DIFF,
     AVG_GAS_PRICE_INC_PERCENT,
+    BLOCK_CACHE_TTL,
     CONFIRMATION_BLOCKS,
     DEFAULT_GAS_LIMIT,
     DISABLE_GAS_ESTIMATION,
+    GAS_ESTIMATE_BLOCKS,
     GAS_MULTIPLIER,
+    HEADER_RING_SIZE,
     MAX_WAITING_TIME,
+    RPC_RETRIES,
     TARGET_REWARD_PERCENTILE
 )
+from .endpoints import EndpointPool, post_request
 from .resources import w3 as gw3
 from .structures import Tx
 
+if TYPE_CHECKING:
+    from .broadcast import Broadcaster
+    from .heads import HeadFeed
+
 logger = logging.getLogger(__name__)
 
 
@@ -61,6 +97,264 @@ REVERT_CODES = [
 ]
 
 
+# JSON-RPC method and its params
+RpcCall = Tuple[str, List]
+
+# Errors retried by the web3 http retry middleware
+RETRY_ERRORS = (http.ConnectionError, http.HTTPError, http.Timeout, http.TooManyRedirects)
+RETRY_BACKOFF = 0.3
+# Calls that are not checked by the client checking middleware of skale
+HEAD_METHODS = ('eth_blockNumber', 'eth_getBlockByNumber')
+
+# Invalid request and parse error, replied to a batch by nodes without support
+BATCH_UNSUPPORTED_CODES = (-32600, -32700)
+
+
+def to_int(value: Any) -> int:
+    return int(value, 16) if isinstance(value, str) else value
+
+
+@dataclass
+class ChainState:
+    """ Chain data required to make an attempt, read with one batch """
+    block_gas_limit: int
+    nonce: Optional[int] = None
+    fee_history: Optional[FeeHistory] = None
+    avg_gas_price: Optional[int] = None
+    balance: Optional[int] = None
+
+
+# Value that is not cached, None is a valid cached value
+MISSING = object()
+
+
+class BlockCache:
+    """
+    Keeps chain values that can change only with a new block. Values are
+    dropped once a new head is observed or the head was not confirmed for ttl.
+    Shared by the processor and the head feed threads
+    """
+
+    def __init__(self, ttl: float = BLOCK_CACHE_TTL) -> None:
+        self.ttl = ttl
+        self.block: Optional[int] = None
+        self.observed_ts: float = 0
+        self.values: Dict[str, Any] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def observe(self, block: int) -> None:
+        with self.lock:
+            # Head read before the latest observed one is stale
+            if self.fresh and block < cast(int, self.block):
+                return
+            if block != self.block:
+                self.block = block
+                self.values = {}
+            self.observed_ts = time.time()
+
+    @property
+    def fresh(self) -> bool:
+        return self.block is not None and \
+            time.time() - self.observed_ts < self.ttl
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self.lock:
+            if self.fresh and key in self.values:
+                self.hits += 1
+                return self.values[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: str, value: Any, block: Optional[int]) -> None:
+        """ Value read at the block is dropped if another head was observed since """
+        with self.lock:
+            if block == self.block:
+                self.values[key] = value
+
+
+class HeaderRing:
+    """ Hashes of the recent canonical blocks, shared by all confirmations """
+
+    def __init__(self, size: int = HEADER_RING_SIZE) -> None:
+        self.size = size
+        self.head: Optional[int] = None
+        self.hashes: Dict[int, str] = {}
+        self.lock = threading.Lock()
+        # Held by the thread that moves the ring to the latest block
+        self.syncing = threading.Lock()
+
+    def get(self, number: int) -> Optional[str]:
+        with self.lock:
+            return self.hashes.get(number)
+
+    def update(self, blocks: List[Dict]) -> None:
+        """ Stores consecutive blocks, the last one is the head """
+        with self.lock:
+            for block in blocks:
+                self.hashes[to_int(block['number'])] = block['hash']
+            self.head = to_int(blocks[-1]['number'])
+            for number in [
+                n for n in self.hashes
+                if n > self.head or n <= self.head - self.size
+            ]:
+                del self.hashes[number]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.head = None
+            self.hashes = {}
+
+
+class ReceiptCache:
+    """ Receipt found for each tx, reused while it goes from wait to confirm """
+
+    def __init__(self) -> None:
+        self.receipts: Dict[str, Tuple[str, Dict]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tx_id: str) -> Tuple[Optional[str], Optional[Dict]]:
+        if tx_id in self.receipts:
+            self.hits += 1
+            return self.receipts[tx_id]
+        self.misses += 1
+        return None, None
+
+    def put(self, tx_id: str, tx_hash: str, receipt: Dict) -> None:
+        self.receipts[tx_id] = (tx_hash, receipt)
+
+    def pop(self, tx_id: str) -> None:
+        self.receipts.pop(tx_id, None)
+
+
+# From, to, data hash and value of the estimated call
+CallShape = Tuple[Optional[str], Optional[str], str, int]
+
+
+class EstimateCache:
+    """
+    Gas estimated for each call shape. An estimate is reused for the given
+    number of blocks unless the tx it was made for reverts or uses more gas
+    """
+
+    def __init__(self, blocks: int = GAS_ESTIMATE_BLOCKS) -> None:
+        self.blocks = blocks
+        # Call shape -> (estimated gas, block of the estimation)
+        self.estimates: Dict[CallShape, Tuple[int, int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    @classmethod
+    def shape(cls, etx: Dict) -> CallShape:
+        data = Web3.keccak(HexBytes(etx.get('data') or b'')).hex()
+        return etx.get('from'), etx.get('to'), data, etx.get('value') or 0
+
+    def get(self, shape: CallShape, block: int) -> Optional[int]:
+        if shape in self.estimates:
+            gas, estimated_block = self.estimates[shape]
+            if block - estimated_block < self.blocks:
+                self.hits += 1
+                return gas
+            del self.estimates[shape]
+        self.misses += 1
+        return None
+
+    def put(self, shape: CallShape, gas: int, block: int) -> None:
+        for stale in [
+            s for s, (_, b) in self.estimates.items()
+            if block - b >= self.blocks
+        ]:
+            del self.estimates[stale]
+        self.estimates[shape] = (gas, block)
+
+    def invalidate(self, shape: CallShape) -> None:
+        if self.estimates.pop(shape, None) is not None:
+            self.invalidated += 1
+
+    def check(self, shape: CallShape, receipt: Dict) -> None:
+        """ Drops the estimate if the mined tx has shown it is wrong """
+        if shape not in self.estimates:
+            return
+        gas, _ = self.estimates[shape]
+        gas_used = to_int(receipt.get('gasUsed', 0))
+        if receipt.get('status') == 0 or gas_used > gas:
+            logger.info(
+                'Estimate %d does not match receipt: status %s, gas used %d',
+                gas, receipt.get('status'), gas_used
+            )
+            self.invalidate(shape)
+
+
+def check_client(
+    latest_block: Dict,
+    allowed_ts_diff: int = ALLOWED_TS_DIFF,
+    state_path: Optional[str] = LAST_BLOCK_FILE
+) -> None:
+    """ Checks of the client checking middleware for requests that bypass it """
+    if allowed_ts_diff == NO_SYNC_TS_DIFF:
+        return
+    current_time = time.time()
+    timestamp = to_int(latest_block['timestamp'])
+    ts_diff = current_time - timestamp
+    if not is_test_env():
+        ts_diff = abs(ts_diff)
+    if ts_diff > allowed_ts_diff:
+        raise EthClientOutdatedError(
+            outdated_client_time_msg('batch', current_time, timestamp, allowed_ts_diff)
+        )
+    if state_path:
+        number = to_int(latest_block['number'])
+        saved_number = get_last_known_block_number(state_path)
+        if number < saved_number:
+            raise EthClientOutdatedError(
+                outdated_client_file_msg('batch', number, saved_number, state_path)
+            )
+        save_last_known_block_number(state_path, number)
+
+
+def is_batch_unsupported(responses: Any) -> bool:
+    """ Whether the node replied to the batch with a single error of batch support """
+    error = responses.get('error') if isinstance(responses, dict) else None
+    return isinstance(error, dict) and (
+        error.get('code') in BATCH_UNSUPPORTED_CODES or
+        'batch' in str(error.get('message', '')).lower()
+    )
+
+
+def batch_results(responses: Any, amount: int) -> List[Any]:
+    """ Results of the batch in the order of calls, responses are matched by id """
+    if not isinstance(responses, list):
+        raise ValueError(f'Unexpected batch response: {responses}')
+    by_id = {
+        response.get('id'): response
+        for response in responses
+        if isinstance(response, dict)
+    }
+    results = []
+    for i in range(amount):
+        response = by_id.get(i)
+        if response is None:
+            raise ValueError(f'Batch response has no id {i}: {responses}')
+        if 'error' in response:
+            raise ValueError(response['error'])
+        results.append(response.get('result'))
+    return results
+
+
+def latest_receipt(
+    hashes: List[str],
+    receipts: Dict[str, Dict]
+) -> Tuple[Optional[str], Optional[Dict]]:
+    """ Picks the latest of the hashes that has a receipt """
+    for h in reversed(hashes):
+        if h in receipts:
+            return h, receipts[h]
+    return None, None
+
+
 def is_replacement_underpriced(err: Exception) -> bool:
     return isinstance(err, ValueError) and \
         isinstance(err.args[0], dict) and \
@@ -71,15 +365,73 @@ def is_nonce_too_low(err: Exception) -> bool:
     return isinstance(err, ValueError) and 'nonce' in err.args[0]['message']
 
 
+def is_already_known(err: Exception) -> bool:
+    return isinstance(err, ValueError) and \
+        isinstance(err.args[0], dict) and \
+        'known' in err.args[0].get('message', '')
+
+
+def is_nonce_error(err: Exception) -> bool:
+    return isinstance(err, ValueError) and \
+        isinstance(err.args[0], dict) and \
+        'nonce' in err.args[0].get('message', '')
+
+
 class Eth:
-    def __init__(self, web3: Optional[Web3] = None) -> None:
+    def __init__(
+        self,
+        web3: Optional[Web3] = None,
+        broadcaster: Optional['Broadcaster'] = None
+    ) -> None:
         self.w3: Web3 = web3 or gw3
+        self.broadcaster = broadcaster
+        self.batching: bool = True
+        self.allowed_ts_diff = ALLOWED_TS_DIFF
+        self.cache = BlockCache()
+        self.estimates = EstimateCache()
+        self.headers = HeaderRing()
+        self.feed: Optional['HeadFeed'] = None
+
+    @property
+    def block_number(self) -> int:
+        block = self.w3.eth.block_number
+        self.cache.observe(block)
+        return block
+
+    def _cached(self, key: str, call: RpcCall, formatter: Callable) -> Any:
+        value = self.cache.get(key, MISSING)
+        if value is MISSING:
+            if self.cache.fresh:
+                block = self.cache.block
+                result = self.batch([call])[0]
+            else:
+                latest, result = self.batch([('eth_blockNumber', []), call])
+                block = to_int(latest)
+                self.cache.observe(block)
+            value = formatter(result)
+            self.cache.put(key, value, block)
+        return value
 
     @property
     def block_gas_limit(self) -> int:
-        latest_block_number = self.w3.eth.block_number
-        block = self.w3.eth.get_block(latest_block_number)
-        return block['gasLimit']
+        return self._cached(
+            'block_gas_limit',
+            ('eth_getBlockByNumber', ['latest', False]),
+            lambda block: to_int(block['gasLimit'])
+        )
+
+    @property
+    def finalized_block(self) -> Optional[int]:
+        """ Latest finalized block, None if the tag is not supported """
+        try:
+            return self._cached(
+                'finalized_block',
+                ('eth_getBlockByNumber', ['finalized', False]),
+                lambda block: to_int(block['number']) if block else None
+            )
+        except ValueError as err:
+            logger.warning('Finalized block is not available: %s', err)
+            return None
 
     @cached_property
     def chain_id(self) -> int:
@@ -102,11 +454,125 @@ class Eth:
         'maxPriorityFeePerGas'
     ]
 
+    FEE_HISTORY_CALL: RpcCall = (
+        'eth_feeHistory',
+        [hex(1), 'latest', [50, TARGET_REWARD_PERCENTILE]]
+    )
+
     def get_fee_history(self) -> FeeHistory:
-        return self.w3.eth.fee_history(
-            1,
-            'latest',
-            [50, TARGET_REWARD_PERCENTILE]
+        return self._cached(
+            'fee_history',
+            self.FEE_HISTORY_CALL,
+            self.format_fee_history
+        )
+
+    @classmethod
+    def format_fee_history(cls, raw: Dict) -> FeeHistory:
+        return cast(FeeHistory, {
+            'oldestBlock': to_int(raw['oldestBlock']),
+            'baseFeePerGas': [to_int(fee) for fee in raw['baseFeePerGas']],
+            'gasUsedRatio': raw['gasUsedRatio'],
+            'reward': [
+                [to_int(reward) for reward in rewards]
+                for rewards in raw.get('reward', [])
+            ]
+        })
+
+    def batch(self, calls: List[RpcCall]) -> List[Any]:
+        """
+        Sends independent calls as one JSON-RPC batch, returns raw results.
+        The batch bypasses web3 middlewares, so it is retried and the latest
+        block it carries is checked as the middlewares of init_web3 do
+        """
+        if not calls:
+            return []
+        provider = self.w3.provider
+        if not self.batching or not isinstance(provider, HTTPProvider):
+            return [self.w3.manager.request_blocking(m, p) for m, p in calls]  # type: ignore
+        checked = self.allowed_ts_diff != NO_SYNC_TS_DIFF and \
+            any(method not in HEAD_METHODS for method, _ in calls)
+        if checked:
+            calls = calls + [('eth_getBlockByNumber', ['latest', False])]
+        payload = [
+            {'jsonrpc': '2.0', 'method': method, 'params': params, 'id': i}
+            for i, (method, params) in enumerate(calls)
+        ]
+        responses = json.loads(self.post(provider, json.dumps(payload).encode('utf-8')))
+        if is_batch_unsupported(responses):
+            logger.warning('Batch request is not supported: %s', responses)
+            self.batching = False
+            return self.batch(calls[:-1] if checked else calls)
+        results = batch_results(responses, len(calls))
+        if checked:
+            latest_block = results.pop()
+            check_client(latest_block, self.allowed_ts_diff)
+            self.cache.observe(to_int(latest_block['number']))
+        return results
+
+    def post(self, provider: HTTPProvider, data: bytes) -> bytes:
+        for i in range(RPC_RETRIES):
+            try:
+                if isinstance(provider, EndpointPool):
+                    return provider.post(data)
+                return post_request(
+                    cast(str, provider.endpoint_uri),
+                    data,
+                    **provider.get_request_kwargs()
+                )
+            except RETRY_ERRORS:
+                if i == RPC_RETRIES - 1:
+                    raise
+                logger.info('Batch request failed, retrying')
+                time.sleep(RETRY_BACKOFF)
+        raise ConnectionError('Batch request was not sent')  # pragma: no cover
+
+    def fetch_state(
+        self,
+        address: str,
+        nonce: bool = False,
+        fee_history: bool = False,
+        gas_price: bool = False,
+        balance: bool = False
+    ) -> ChainState:
+        """ Reads missing values with one batch. Block values may be cached """
+        checksum_address = self.w3.to_checksum_address(address)
+        block = self.cache.block
+        values: Dict[str, Any] = {'block_gas_limit': self.cache.get('block_gas_limit')}
+        if fee_history:
+            values['fee_history'] = self.cache.get('fee_history')
+        if gas_price:
+            values['avg_gas_price'] = self.cache.get('avg_gas_price')
+
+        calls: Dict[str, RpcCall] = {}
+        if values['block_gas_limit'] is None:
+            # Latest block also updates the observed head
+            calls['block'] = ('eth_getBlockByNumber', ['latest', False])
+        if nonce:
+            calls['nonce'] = ('eth_getTransactionCount', [checksum_address, 'latest'])
+        if fee_history and values['fee_history'] is None:
+            calls['fee_history'] = self.FEE_HISTORY_CALL
+        if gas_price and values['avg_gas_price'] is None:
+            calls['avg_gas_price'] = ('eth_gasPrice', [])
+        if balance:
+            calls['balance'] = ('eth_getBalance', [checksum_address, 'latest'])
+
+        results = dict(zip(calls, self.batch(list(calls.values()))))
+        if 'block' in results:
+            block = to_int(results['block']['number'])
+            self.cache.observe(block)
+            values['block_gas_limit'] = to_int(results['block']['gasLimit'])
+            self.cache.put('block_gas_limit', values['block_gas_limit'], block)
+        if 'fee_history' in results:
+            values['fee_history'] = self.format_fee_history(results['fee_history'])
+            self.cache.put('fee_history', values['fee_history'], block)
+        if 'avg_gas_price' in results:
+            values['avg_gas_price'] = self.adjust_gas_price(to_int(results['avg_gas_price']))
+            self.cache.put('avg_gas_price', values['avg_gas_price'], block)
+
+        return ChainState(
+            nonce=to_int(results['nonce']) if nonce else None,
+            balance=to_int(results['balance']) if balance else None,
+            **values
         )
 
     def get_estimated_base_fee(
@@ -122,34 +588,55 @@ class Eth:
 
     @classmethod
     def convert_tx(cls, tx: Tx) -> Dict:
-        raw_tx = tx.raw_tx
-        etx = {attr: raw_tx[attr] for attr in cls.TX_ATTRS}
-        if etx.get('maxPriorityFeePerGas') is not None or \
-                etx.get('maxFeePerGas') is not None:
-            etx['type'] = 2
-            etx.pop('gasPrice', None)
-        else:
-            etx['type'] = 1
-            etx.pop('maxPriorityFeePerGas', None)
-            etx.pop('maxFeePerGas', None)
+        return tx.eth_tx
 
-        if etx.get('gas') is None:
-            etx.pop('gas')
-        if etx.get('data') is None:
-            etx.pop('data')
-        return etx
+    @classmethod
+    def adjust_gas_price(cls, gas_price: int) -> int:
+        return gas_price * (100 + AVG_GAS_PRICE_INC_PERCENT) // 100
 
     @property
     def avg_gas_price(self) -> int:
-        return self.w3.eth.gas_price * (100 + AVG_GAS_PRICE_INC_PERCENT) // 100
+        return self._cached(
+            'avg_gas_price',
+            ('eth_gasPrice', []),
+            lambda price: self.adjust_gas_price(to_int(price))
+        )
 
-    def calculate_gas(self, tx: Tx) -> int:
+    def calculate_gas(self, tx: Tx, gas_limit: Optional[int] = None) -> int:
         etx = self.convert_tx(tx)
         multiplier = tx.multiplier
         multiplier = multiplier or GAS_MULTIPLIER
         if DISABLE_GAS_ESTIMATION:
             return int(etx.get('gas', DEFAULT_GAS_LIMIT) * multiplier)
 
+        # Dry run of an IMA tx is what drops it once its call reverts
+        if self.estimates.blocks <= 0 or tx.is_sent_by_ima():
+            estimated = self.estimate_gas(etx)
+        else:
+            shape = self.estimates.shape(etx)
+            block = self.cache.block if self.cache.fresh else self.block_number
+            cached = self.estimates.get(shape, cast(int, block))
+            if cached is None:
+                estimated = self.estimate_gas(etx)
+                self.estimates.put(shape, estimated, cast(int, block))
+            else:
+                logger.info('Reusing estimate %s of gas', cached)
+                estimated = cached
+
+        gas = int(estimated * multiplier)
+        logger.info('Multiplied gas: %s', gas)
+        gas_limit = gas_limit or self.block_gas_limit
+        if gas > gas_limit:
+            logger.warning(
+                'Estimated gas is to high. Defaulting to %s',
+                gas_limit
+            )
+            gas = gas_limit
+        gas = int(gas)
+        logger.info('Estimation result %s of gas', gas)
+        return gas
+
+    def estimate_gas(self, etx: Dict) -> int:
         logger.info('Estimating gas for %s', etx)
 
         try:
@@ -170,63 +657,186 @@ class Eth:
                 raise
 
         logger.info('eth_estimateGas returned: %s of gas', estimated)
-        gas = int(estimated * multiplier)
-        logger.info('Multiplied gas: %s', gas)
-        gas_limit = self.block_gas_limit
-        if gas > gas_limit:
-            logger.warning(
-                'Estimated gas is to high. Defaulting to %s',
-                gas_limit
-            )
-            gas = gas_limit
-        gas = int(gas)
-        logger.info('Estimation result %s of gas', gas)
-        return gas
+        return estimated
+
+    def check_estimate(self, tx: Tx, receipt: Dict) -> None:
+        self.estimates.check(self.estimates.shape(self.convert_tx(tx)), receipt)
 
     def send_tx(self, signed_tx: Dict) -> str:
-        tx_hash = self.w3.eth.send_raw_transaction(
-            signed_tx['rawTransaction']
-        ).hex()
-        return tx_hash
+        return self.send_raw_tx(signed_tx['rawTransaction'])
+
+    def send_raw_tx(self, raw_tx: Union[str, bytes]) -> str:
+        if self.broadcaster is not None:
+            return self.broadcaster.send(raw_tx)
+        return self.w3.eth.send_raw_transaction(HexBytes(raw_tx)).hex()
+
+    def is_tx_known(self, tx_hash: str) -> bool:
+        """ Whether the node has the tx in its pool or in a block """
+        return self.batch([('eth_getTransactionByHash', [tx_hash])])[0] is not None
 
     def get_nonce(self, address: str) -> int:
         checksum_addres = self.w3.to_checksum_address(address)
         return self.w3.eth.get_transaction_count(checksum_addres)
 
+    def get_nonces(self, address: str) -> Tuple[int, int]:
+        """ Latest and pending transaction counts, read with one batch """
+        checksum_address = self.w3.to_checksum_address(address)
+        latest, pending = self.batch([
+            ('eth_getTransactionCount', [checksum_address, 'latest']),
+            ('eth_getTransactionCount', [checksum_address, 'pending'])
+        ])
+        return to_int(latest), to_int(pending)
+
+    def running_feed(self) -> Optional['HeadFeed']:
+        if self.feed is not None and self.feed.is_alive():
+            return self.feed
+        return None
+
     def wait_for_blocks(
         self,
         amount: int = CONFIRMATION_BLOCKS,
         max_time: int = MAX_WAITING_TIME,
         start_block: Optional[int] = None
     ) -> None:
-        current_block = self.w3.eth.block_number
+        # Head is observed, so values of the block cache are refreshed
+        current_block: int = self.block_number
         start_block = start_block or current_block
         current_ts = start_ts = time.time()
         while current_block - start_block < amount and \
                 current_ts - start_ts < max_time:
-            time.sleep(1)
-            current_block = self.w3.eth.block_number
+            feed = self.running_feed()
+            if feed is not None:
+                current_block = feed.wait_for_head(
+                    after=current_block,
+                    timeout=max_time - (current_ts - start_ts)
+                )
+            else:
+                time.sleep(1)
+                current_block = self.block_number
             current_ts = time.time()
         if current_block - start_block < amount:
             raise BlockTimeoutError(
                 f'{amount} blocks has not been mined withing {max_time}'
             )
 
+    def sync_headers(self) -> int:
+        """ Moves the header ring to the latest block, replaces reorganized ones """
+        # Feed and processor threads do not update the ring at the same time
+        with self.headers.syncing:
+            latest = self.batch([('eth_getBlockByNumber', ['latest', False])])[0]
+            head = to_int(latest['number'])
+            self.cache.observe(head)
+            top = self.headers.head
+            if top is not None and self.headers.get(head) == latest['hash']:
+                return head
+            if top is None or head - top >= self.headers.size:
+                self.headers.clear()
+                top = head - 1
+            blocks = self.batch([
+                ('eth_getBlockByNumber', [hex(number), False])
+                for number in range(min(top + 1, head), head)
+            ]) + [latest]
+            while True:
+                self.headers.update(blocks)
+                number = to_int(blocks[0]['number']) - 1
+                known = self.headers.get(number)
+                if known is None or known == blocks[0]['parentHash']:
+                    return head
+                logger.warning('Block %d was reorganized', number)
+                blocks = self.batch([('eth_getBlockByNumber', [hex(number), False])]) + blocks
+
+    def is_canonical(self, number: int, block_hash: str) -> bool:
+        """ Checks the block against the header ring, synced by the feed if it runs """
+        if self.running_feed() is None and not (
+            self.cache.fresh and self.headers.head == self.cache.block
+        ):
+            self.sync_headers()
+        known = self.headers.get(number)
+        if known is None:
+            # Block is older than the ring
+            block = self.batch([('eth_getBlockByNumber', [hex(number), False])])[0]
+            known = block['hash'] if block else None
+        return known == block_hash
+
+    def find_receipt(self, hashes: List[str]) -> Tuple[Optional[str], Optional[Dict]]:
+        """ Returns the latest of the hashes that has a receipt """
+        return latest_receipt(hashes, self.get_receipts(hashes) if hashes else {})
+
+    def wait_for_receipts(
+        self,
+        hashes: List[str],
+        max_time: int = MAX_WAITING_TIME
+    ) -> Tuple[str, Dict]:
+        """ Waits until any of the hashes is mined, returns it with the receipt """
+        start_ts = time.time()
+        while time.time() - start_ts < max_time:
+            h, receipt = self.find_receipt(hashes)
+            if receipt is None:
+                feed = self.running_feed()
+                if feed is not None:
+                    receipts = feed.wait_for_receipts(
+                        hashes,
+                        timeout=max_time - (time.time() - start_ts)
+                    )
+                    h, receipt = latest_receipt(hashes, receipts)
+                else:
+                    time.sleep(1)
+            if receipt is not None:
+                if receipt.get('status', -1) >= 0:
+                    return cast(str, h), receipt
+                logger.error('Receipt has no "status" field')
+                time.sleep(1)
+        raise ReceiptTimeoutError(f'No receipt after {max_time}')
+
     def wait_for_receipt(
         self,
         tx_hash: str,
         max_time: int = MAX_WAITING_TIME,
     ) -> int:
-        start_ts = time.time()
-        rstatus = -1
-        while rstatus == -1 and time.time() - start_ts < max_time:
-            rstatus = self.get_status(tx_hash)
-            if rstatus == -1:
-                time.sleep(1)
+        return self.wait_for_receipts([tx_hash], max_time)[1]['status']
+
+    RECEIPT_QUANTITIES = (
+        'blockNumber',
+        'cumulativeGasUsed',
+        'effectiveGasPrice',
+        'gasUsed',
+        'status',
+        'transactionIndex',
+        'type'
+    )
 
-        if rstatus == -1:
-            raise ReceiptTimeoutError(f'No receipt after {max_time}')
-        return rstatus
+    @classmethod
+    def format_receipt(cls, raw: Dict) -> Dict:
+        return {
+            key: to_int(value) if key in cls.RECEIPT_QUANTITIES else value
+            for key, value in raw.items()
+        }
+
+    def get_block_receipts(
+        self,
+        numbers: Iterable[int],
+        hashes: Set[str]
+    ) -> Dict[str, Dict]:
+        """ Receipts of hashes mined in the blocks, blocks are read with one batch """
+        blocks = self.batch([
+            ('eth_getBlockByNumber', [hex(number), False])
+            for number in numbers
+        ])
+        mined = [
+            h
+            for block in blocks if block is not None
+            for h in block['transactions'] if h in hashes
+        ]
+        return self.get_receipts(mined) if mined else {}
+
+    def get_receipts(self, hashes: List[str]) -> Dict[str, Dict]:
+        """ Receipts of the mined txs among hashes, requested with one batch """
+        results = self.batch([('eth_getTransactionReceipt', [h]) for h in hashes])
+        return {
+            h: self.format_receipt(receipt)
+            for h, receipt in zip(hashes, results)
+            if receipt is not None
+        }
 
     def get_receipt(self, tx_hash: str) -> Optional[Dict]:
         casted_hash = cast(HexStr, tx_hash)
@@ -0,0 +1,149 @@
+#   -*- coding: utf-8 -*-
+#
+#   This file is part of SKALE Transaction Manager
+#
+#   Copyright (C) 2021 SKALE Labs
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import time
+from abc import ABCMeta, abstractmethod
+from typing import Dict, Optional
+
+from .config import CONFIRMATION_BLOCKS, FINALITY, MAX_WAITING_TIME
+from .eth import BlockTimeoutError, Eth
+from .structures import Tx
+
+logger = logging.getLogger(__name__)
+
+BLOCKS_FINALITY = 'blocks'
+FINALIZED_FINALITY = 'finalized'
+INSTANT_FINALITY = 'instant'
+
+
+class BaseFinality(metaclass=ABCMeta):
+    """ Decides when a mined tx can no longer be reorganized """
+    name: str
+    # Whether the block of a final tx should be checked against the headers
+    reorgs: bool = True
+
+    @abstractmethod
+    def is_final(
+        self,
+        eth: Eth,
+        block: int,
+        head: int
+    ) -> bool:  # pragma: no cover
+        pass
+
+    @abstractmethod
+    def wait(
+        self,
+        eth: Eth,
+        block: int,
+        max_time: int = MAX_WAITING_TIME
+    ) -> None:  # pragma: no cover
+        pass
+
+    def __repr__(self) -> str:
+        return self.name
+
+
+class BlockCountFinality(BaseFinality):
+    name = BLOCKS_FINALITY
+
+    def __init__(self, blocks: int = CONFIRMATION_BLOCKS) -> None:
+        self.blocks = blocks
+
+    def is_final(self, eth: Eth, block: int, head: int) -> bool:
+        return head - block >= self.blocks
+
+    def wait(self, eth: Eth, block: int, max_time: int = MAX_WAITING_TIME) -> None:
+        eth.wait_for_blocks(
+            amount=self.blocks,
+            max_time=max_time,
+            start_block=block
+        )
+
+
+class FinalizedTagFinality(BaseFinality):
+    """ Relies on the finalized block tag, counts blocks if it is not supported """
+    name = FINALIZED_FINALITY
+
+    def __init__(self, fallback: Optional[BaseFinality] = None) -> None:
+        self.fallback = fallback or BlockCountFinality()
+
+    def is_final(self, eth: Eth, block: int, head: int) -> bool:
+        finalized = eth.finalized_block
+        if finalized is None:
+            return self.fallback.is_final(eth, block, head)
+        return finalized >= block
+
+    def wait(self, eth: Eth, block: int, max_time: int = MAX_WAITING_TIME) -> None:
+        start_ts = time.time()
+        finalized = eth.finalized_block
+        while finalized is not None and finalized < block:
+            left = max_time - (time.time() - start_ts)
+            if left <= 0:
+                raise BlockTimeoutError(
+                    f'Block {block} has not been finalized within {max_time}'
+                )
+            eth.wait_for_blocks(amount=1, max_time=int(left))
+            finalized = eth.finalized_block
+        if finalized is None:
+            self.fallback.wait(eth, block, max_time)
+
+
+class InstantFinality(BaseFinality):
+    """ Mined blocks are final, as on SKALE chains """
+    name = INSTANT_FINALITY
+    reorgs = False
+
+    def is_final(self, eth: Eth, block: int, head: int) -> bool:
+        return True
+
+    def wait(self, eth: Eth, block: int, max_time: int = MAX_WAITING_TIME) -> None:
+        pass
+
+
+def make_finality(name: str = FINALITY) -> BaseFinality:
+    policies = {
+        BLOCKS_FINALITY: BlockCountFinality,
+        FINALIZED_FINALITY: FinalizedTagFinality,
+        INSTANT_FINALITY: InstantFinality
+    }
+    if name not in policies:
+        raise ValueError(f'Unknown finality {name}')
+    return policies[name]()
+
+
+class FinalitySelector:
+    """ Chain policy that could be overridden by tx meta 'finality' """
+
+    def __init__(self, default: Optional[BaseFinality] = None) -> None:
+        self.default = default or make_finality()
+        self.policies: Dict[str, BaseFinality] = {self.default.name: self.default}
+
+    def get(self, tx: Tx) -> BaseFinality:
+        name = tx.meta.get('finality') if isinstance(tx.meta, dict) else None
+        if name is None:
+            return self.default
+        if name not in self.policies:
+            try:
+                self.policies[name] = make_finality(name)
+            except ValueError:
+                logger.warning('Tx %s has unknown finality %s', tx.tx_id, name)
+                return self.default
+        return self.policies[name]
@@ -0,0 +1,167 @@
+#   -*- coding: utf-8 -*-
+#
+#   This file is part of SKALE Transaction Manager
+#
+#   Copyright (C) 2021 SKALE Labs
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+from .config import HEAD_POLL_INTERVAL
+from .eth import Eth
+
+logger = logging.getLogger(__name__)
+
+# Larger gaps are checked with direct receipt lookups
+MAX_SCANNED_BLOCKS = 32
+
+
+class HeadFeed(threading.Thread):
+    """
+    Single poller of the chain head shared by all waiters. On each new block
+    its transactions are matched against the index of pending hashes, so
+    receipts are requested only for the hashes that were actually mined
+    """
+
+    def __init__(
+        self,
+        eth: Eth,
+        interval: int = HEAD_POLL_INTERVAL,
+        max_scanned_blocks: int = MAX_SCANNED_BLOCKS
+    ) -> None:
+        super().__init__(name='head-feed', daemon=True)
+        self.eth = eth
+        self.interval = interval
+        self.max_scanned_blocks = max_scanned_blocks
+        self.head: Optional[int] = None
+        # Number of waiters for each hash
+        self.watched: Dict[str, int] = {}
+        # Hashes of each tracked tx
+        self.index: Dict[str, Set[str]] = {}
+        # Hashes registered since the last poll, they could be mined earlier
+        self.fresh: Set[str] = set()
+        self.receipts: Dict[str, Dict] = {}
+        self.updated = threading.Condition()
+        self.stopped = threading.Event()
+
+    @property
+    def referenced(self) -> Set[str]:
+        hashes = set(self.watched)
+        for tx_hashes in self.index.values():
+            hashes |= tx_hashes
+        return hashes
+
+    @property
+    def pending(self) -> Set[str]:
+        return self.referenced - set(self.receipts)
+
+    def _register(self, hashes: Iterable[str]) -> None:
+        self.fresh.update(set(hashes) - self.referenced)
+
+    def _forget(self, hashes: Iterable[str]) -> None:
+        for h in set(hashes) - self.referenced:
+            self.receipts.pop(h, None)
+            self.fresh.discard(h)
+
+    def _invalidate(self, hashes: Iterable[str]) -> None:
+        for h in hashes:
+            if self.receipts.pop(h, None) is not None:
+                self.fresh.add(h)
+
+    def poll(self) -> None:
+        block = self.eth.sync_headers()
+        with self.updated:
+            self._invalidate([
+                h for h, receipt in self.receipts.items()
+                if self.eth.headers.get(receipt['blockNumber']) not in
+                (None, receipt['blockHash'])
+            ])
+        if self.head is not None and block <= self.head:
+            return
+        with self.updated:
+            fresh, self.fresh = self.fresh, set()
+            scanned = self.pending - fresh
+        first = block if self.head is None else self.head + 1
+        if block - first >= self.max_scanned_blocks:
+            logger.info('Head moved by %d blocks, requesting receipts directly', block - first)
+            fresh, scanned = fresh | scanned, set()
+        receipts = self.eth.get_receipts(list(fresh)) if fresh else {}
+        if scanned:
+            receipts.update(self.eth.get_block_receipts(range(first, block + 1), scanned))
+        with self.updated:
+            self.head = block
+            self.receipts.update(receipts)
+            self.updated.notify_all()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Head polling failed')
+            self.stopped.wait(self.interval)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        with self.updated:
+            self.updated.notify_all()
+
+    def track(self, key: str, hashes: List[str]) -> Dict[str, Dict]:
+        """ Indexes hashes of the tx, returns the receipts known so far """
+        with self.updated:
+            self._register(hashes)
+            self.index[key] = set(hashes)
+            return {h: self.receipts[h] for h in hashes if h in self.receipts}
+
+    def invalidate(self, hashes: Iterable[str]) -> None:
+        """ Drops receipts from reorganized blocks, the hashes are looked up again """
+        with self.updated:
+            self._invalidate(hashes)
+
+    def untrack(self, key: str) -> None:
+        with self.updated:
+            self._forget(self.index.pop(key, set()))
+
+    def wait_for_head(self, after: int, timeout: float) -> int:
+        """ Returns the head once it is above after or on timeout """
+        with self.updated:
+            self.updated.wait_for(
+                lambda: self.stopped.is_set() or
+                (self.head is not None and self.head > after),
+                timeout
+            )
+            return after if self.head is None else self.head
+
+    def wait_for_receipts(self, hashes: List[str], timeout: float) -> Dict[str, Dict]:
+        """ Waits until any of the hashes is mined """
+        with self.updated:
+            self._register(hashes)
+            for h in hashes:
+                self.watched[h] = self.watched.get(h, 0) + 1
+            try:
+                self.updated.wait_for(
+                    lambda: self.stopped.is_set() or
+                    any(h in self.receipts for h in hashes),
+                    timeout
+                )
+                return {h: self.receipts[h] for h in hashes if h in self.receipts}
+            finally:
+                for h in hashes:
+                    self.watched[h] -= 1
+                    if self.watched[h] == 0:
+                        del self.watched[h]
+                self._forget(hashes)
@@ -17,37 +17,93 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import logging
 import time
 
 from . import config
+from .aio import AsyncEth, AsyncProcessor, AsyncTxPool
 from .attempt_manager import AttemptManagerV2, RedisAttemptStorage
+from .broadcast import make_broadcaster
+from .endpoints import EndpointPool, HealthChecker
 from .eth import Eth
+from .heads import HeadFeed
 from .log import init_logger
 from .processor import Processor
-from .txpool import TxPool
+from .streampool import StreamTxPool
+from .txpool import PoolSweeper, TxPool
 from .utils import config_string
 from .wallet import init_wallet
 
 logger = logging.getLogger(__name__)
 
 
+class ConfigError(Exception):
+    pass
+
+
+def check_config() -> None:
+    """ Rejects values that no restart can fix, before any thread starts """
+    if config.ENGINE not in ('sync', 'async'):
+        raise ConfigError(f'Unknown engine {config.ENGINE}')
+    if config.POOL_BACKEND not in ('zset', 'stream'):
+        raise ConfigError(f'Unknown pool backend {config.POOL_BACKEND}')
+    if config.ENGINE == 'async' and config.POOL_BACKEND == 'stream':
+        raise ConfigError('Async engine supports only zset pool backend')
+
+
+def run_async(eth, pool, attempt_manager, wallet):
+    proc = AsyncProcessor(
+        AsyncEth(broadcaster=eth.broadcaster),
+        AsyncTxPool(pool),
+        attempt_manager,
+        wallet
+    )
+    asyncio.run(proc.run())
+
+
 def run_proc():
-    eth = Eth()
-    pool = TxPool()
+    eth = Eth(broadcaster=make_broadcaster())
+    pool = StreamTxPool() if config.POOL_BACKEND == 'stream' else TxPool()
     wallet = init_wallet()
     attempt_manager = AttemptManagerV2(
         eth,
         RedisAttemptStorage(),
         wallet.address
     )
-    proc = Processor(eth, pool, attempt_manager, wallet)
+    proc = None
+    sweeper = PoolSweeper(pool)
+    sweeper.start()
+    checker = None
+    if isinstance(eth.w3.provider, EndpointPool):
+        checker = HealthChecker(eth.w3.provider)
+        checker.start()
     logger.info('Starting transaction processor')
-    proc.run()
+    try:
+        if config.ENGINE == 'async':
+            # Heads are polled by the receipt watcher of the event loop
+            run_async(eth, pool, attempt_manager, wallet)
+        else:
+            if config.HEAD_POLL_INTERVAL > 0:
+                eth.feed = HeadFeed(eth)
+                eth.feed.start()
+            proc = Processor(eth, pool, attempt_manager, wallet)
+            proc.run()
+    finally:
+        sweeper.stop()
+        if eth.feed is not None:
+            eth.feed.stop()
+        if proc is not None and proc.presigner is not None:
+            proc.presigner.stop()
+        if eth.broadcaster is not None:
+            eth.broadcaster.stop()
+        if checker is not None:
+            checker.stop()
 
 
 def main() -> None:
     init_logger()
+    check_config()
     while True:
         try:
             logger.info('Running processor. Config:\n%s', config_string(vars(config)))
@@ -0,0 +1,119 @@
+#   -*- coding: utf-8 -*-
+#
+#   This file is part of SKALE Transaction Manager
+#
+#   Copyright (C) 2021 SKALE Labs
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import time
+from typing import Dict, Optional
+
+from .config import NONCE_SYNC_INTERVAL
+from .eth import Eth
+
+logger = logging.getLogger(__name__)
+
+
+class NonceManager:
+    """
+    Keeps the lowest not mined nonce of the account locally. It is moved by
+    the txs mined by the processor and checked against the latest and
+    pending counts every sync interval or after a nonce error
+    """
+
+    def __init__(
+        self,
+        eth: Eth,
+        address: str,
+        sync_interval: int = NONCE_SYNC_INTERVAL
+    ) -> None:
+        self.eth = eth
+        self.address = address
+        self.sync_interval = sync_interval
+        self.latest: Optional[int] = None
+        self.pending: Optional[int] = None
+        # Highest nonce sent by the processor
+        self.highest: Optional[int] = None
+        # First nonce missing from the node below a sent one
+        self.gap: Optional[int] = None
+        self.synced_ts: float = 0
+        self.syncs = 0
+        self.gaps = 0
+        self.filled = 0
+
+    @property
+    def stale(self) -> bool:
+        return self.latest is None or \
+            time.time() - self.synced_ts >= self.sync_interval
+
+    def sync(self) -> int:
+        latest, pending = self.eth.get_nonces(self.address)
+        if self.latest is not None and latest != self.latest:
+            logger.warning('Local nonce %d differs from chain nonce %d', self.latest, latest)
+        self.latest, self.pending = latest, pending
+        self.synced_ts = time.time()
+        self.syncs += 1
+        self.gap = None
+        if self.highest is not None and pending < self.highest:
+            self.gap = pending
+            self.gaps += 1
+            logger.warning(
+                'Nonce gap: %d is not known to the node, %d was sent',
+                pending, self.highest
+            )
+        return latest
+
+    def get(self) -> int:
+        """ Lowest nonce that is not mined yet """
+        if self.stale:
+            return self.sync()
+        return self.latest  # type: ignore
+
+    def sent(self, nonce: int) -> None:
+        if self.highest is None or nonce > self.highest:
+            self.highest = nonce
+        if nonce == self.gap:
+            self.gap = None
+
+    def mined(self, nonce: int) -> None:
+        if self.latest is not None and nonce >= self.latest:
+            self.latest = nonce + 1
+        if self.gap is not None and nonce >= self.gap:
+            self.gap = None
+
+    def fill(self, nonce: int) -> None:
+        """ Gap was filled, the next one could be found by the next sync """
+        self.filled += 1
+        self.sent(nonce)
+        # Next gap could be found right away
+        self.reset()
+
+    def reset(self) -> None:
+        """ Local nonce and gap are synced with the chain on the next request """
+        self.latest = None
+        self.gap = None
+
+    @property
+    def metrics(self) -> Dict[str, Optional[int]]:
+        return {
+            'latest': self.latest,
+            'pending': self.pending,
+            'highest': self.highest,
+            'gap': self.gap,
+            'gaps': self.gaps,
+            'filled': self.filled,
+            'syncs': self.syncs
+        }
@@ -0,0 +1,89 @@
+#   -*- coding: utf-8 -*-
+#
+#   This file is part of SKALE Transaction Manager
+#
+#   Copyright (C) 2021 SKALE Labs
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import replace
+from typing import Dict, Optional, Tuple
+
+from hexbytes import HexBytes
+from skale.wallets import BaseWallet  # type: ignore
+from web3 import Web3
+
+from .eth import Eth
+from .structures import Fee, Tx
+
+logger = logging.getLogger(__name__)
+
+
+class Presigner:
+    """
+    Signs the next fee level of a sent tx in the background, so the
+    replacement can be sent right after the wait time is out
+    """
+
+    def __init__(self, eth: Eth, wallet: BaseWallet) -> None:
+        self.eth = eth
+        self.wallet = wallet
+        self.executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='presigner'
+        )
+        # Tx id -> (eth tx that is signed, signing result)
+        self.signed: Dict[str, Tuple[Dict, Future]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def sign_ahead(self, tx: Tx, fee: Fee) -> None:
+        etx = self.eth.convert_tx(replace(tx, fee=fee))
+        logger.info('Signing tx %s with the next fee %s ahead', tx.tx_id, fee)
+        self.signed[tx.tx_id] = (etx, self.executor.submit(self._sign, etx))
+
+    def _sign(self, etx: Dict) -> str:
+        signed = self.wallet.sign(etx)
+        return Web3.to_hex(HexBytes(signed['rawTransaction']))
+
+    def pop(self, tx_id: str, etx: Dict) -> Optional[str]:
+        """ Raw tx signed ahead if it has the same fields as the tx to send """
+        entry = self.signed.pop(tx_id, None)
+        if entry is None:
+            return None
+        expected, future = entry
+        if expected != etx:
+            logger.info('Tx %s was signed ahead with other fields', tx_id)
+            self.misses += 1
+            future.cancel()
+            return None
+        try:
+            raw_tx = future.result()
+        except Exception:
+            logger.exception('Signing tx %s ahead failed', tx_id)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return raw_tx
+
+    def discard(self, tx_id: str) -> None:
+        entry = self.signed.pop(tx_id, None)
+        if entry is not None:
+            entry[1].cancel()
+
+    def stop(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.signed = {}
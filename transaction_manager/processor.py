@@ -20,23 +20,38 @@
 import logging
 import time
 from contextlib import contextmanager
-from typing import Generator, Optional, Tuple
+from typing import cast, Dict, Generator, Optional, Set, Tuple
 
+from hexbytes import HexBytes
 from skale.wallets import BaseWallet  # type: ignore
+from web3 import Web3
 
 from .attempt_manager import BaseAttemptManager
-from .config import CONFIRMATION_BLOCKS, UNDERPRICED_RETRIES
+from .config import (
+    BASE_WAITING_TIME,
+    PIPELINE_WINDOW,
+    PRESIGN,
+    UNDERPRICED_RETRIES
+)
 from .eth import (
     EstimateGasRevertError,
     Eth,
+    is_already_known,
+    is_nonce_error,
     is_replacement_underpriced,
+    latest_receipt,
+    ReceiptCache,
     ReceiptTimeoutError
 )
-from .structures import Tx, TxStatus
+from .finality import BaseFinality, FinalitySelector
+from .presigner import Presigner
+from .structures import Attempt, Tx, TxStatus
 from .txpool import TxPool
 
 logger = logging.getLogger(__name__)
 
+SELF_TRANSFER_GAS = 21000
+
 
 class ConfirmationError(Exception):
     pass
@@ -56,34 +71,46 @@ class Processor:
         eth: Eth,
         pool: TxPool,
         attempt_manager: BaseAttemptManager,
-        wallet: BaseWallet
+        wallet: BaseWallet,
+        window: int = PIPELINE_WINDOW,
+        finality: Optional[BaseFinality] = None,
+        presign: bool = bool(PRESIGN)
     ) -> None:
         self.eth: Eth = eth
         self.attempt_manager = attempt_manager
         self.pool: TxPool = pool
         self.wallet: BaseWallet = wallet
         self.address = wallet.address
+        self.window = window
+        self.inflight: Dict[int, Tx] = {}
+        self.receipts = ReceiptCache()
+        # Signed hashes that were sent again. Each is sent again once, so a tx
+        # dropped by the node gets the next attempt with a higher fee
+        self.rebroadcasted: Set[str] = set()
+        self.finality = FinalitySelector(finality)
+        self.presigner = Presigner(eth, wallet) if presign else None
 
     def send(self, tx: Tx) -> None:
         tx_hash, err = None, None
         retry = 0
         replaced = False
         while tx_hash is None and retry < UNDERPRICED_RETRIES:
-            logger.info('Signing tx %s, retry %d', tx.tx_id, retry)
-            etx = self.eth.convert_tx(tx)
-            signed = self.wallet.sign(etx)
-            logger.info('Sending transaction %s', tx)
+            raw_tx = self.sign(tx)
+            logger.info('Sending transaction %s, retry %d', tx, retry)
             try:
-                tx_hash = self.eth.send_tx(signed)
+                tx_hash = self.eth.send_raw_tx(raw_tx)
             except Exception as e:
-                logger.info(f'Sending failed with error {err}')
                 err = e
+                logger.info(f'Sending failed with error {err}')
                 if is_replacement_underpriced(err):
                     logger.info('Replacement fee is too low. Increasing')
                     self.attempt_manager.replace(tx, replace_attempt=retry)
                     replaced = True
                     retry += 1
                 else:
+                    if is_nonce_error(err):
+                        logger.info('Nonce is not valid. Syncing with the chain')
+                        self.attempt_manager.nonces.reset()
                     break
 
         if tx_hash is not None or replaced:
@@ -94,8 +121,70 @@ class Processor:
             raise SendingError(err)
 
         tx.set_as_sent(tx_hash)
+        self.attempt_manager.nonces.sent(cast(int, tx.nonce))
         self.pool.save(tx)
         logger.info(f'Tx {tx.tx_id} was sent successfully')
+        self.sign_ahead(tx)
+
+    def sign(self, tx: Tx) -> str:
+        """ Signed tx of the current attempt, signed again only if the fee changed """
+        attempt = cast(Attempt, self.attempt_manager.current)
+        if attempt.raw_tx is None:
+            etx = self.eth.convert_tx(tx)
+            if self.presigner is not None:
+                attempt.raw_tx = self.presigner.pop(tx.tx_id, etx)
+            if attempt.raw_tx is None:
+                logger.info('Signing tx %s', tx.tx_id)
+                signed = self.wallet.sign(etx)
+                attempt.raw_tx = Web3.to_hex(HexBytes(signed['rawTransaction']))
+            else:
+                logger.info('Using tx %s signed ahead', tx.tx_id)
+            # Written ahead, so the same bytes can be sent after a restart
+            self.attempt_manager.save()
+        return attempt.raw_tx
+
+    def sign_ahead(self, tx: Tx) -> None:
+        """ Signs the fee that the next attempt gets after the wait time """
+        attempt = self.attempt_manager.current
+        if self.presigner is None or attempt is None:
+            return
+        fee = self.attempt_manager.next_fee(attempt)
+        if fee is not None and fee != attempt.fee:
+            self.presigner.sign_ahead(tx, fee)
+
+    def rebroadcast(self, tx: Tx, nonce: Optional[int] = None) -> bool:
+        """ Sends the last signed attempt again if the node does not know it """
+        attempt = self.attempt_manager.last_signed(tx)
+        if attempt is None or nonce not in (None, attempt.nonce) or \
+                attempt.nonce < self.attempt_manager.nonces.get():
+            return False
+        tx_hash = cast(str, attempt.signed_hash)
+        if tx_hash in self.rebroadcasted or self.eth.is_tx_known(tx_hash):
+            # Tx is pending or lost again, so it should be replaced with a higher fee
+            return False
+        logger.info('Sending signed attempt %d of tx %s again', attempt.index, tx.tx_id)
+        self.rebroadcasted.add(tx_hash)
+        try:
+            self.eth.send_raw_tx(cast(str, attempt.raw_tx))
+        except Exception as err:
+            if not is_already_known(err):
+                logger.info('Sending signed attempt failed with %s', err)
+                return False
+        self.attempt_manager.resume(attempt)
+        if tx_hash in tx.hashes:
+            tx.status = TxStatus.SENT
+            tx.tx_hash = tx_hash
+            tx.sent_ts = int(time.time())
+        else:
+            tx.set_as_sent(tx_hash)
+        self.attempt_manager.nonces.sent(attempt.nonce)
+        self.pool.save(tx)
+        self.sign_ahead(tx)
+        return True
+
+    def discard_signed(self, tx: Tx) -> None:
+        if self.presigner is not None:
+            self.presigner.discard(tx.tx_id)
 
     def wait(self, tx: Tx, max_time: int) -> Optional[int]:
         if not tx.tx_hash:
@@ -103,67 +192,88 @@ class Processor:
             return None
         try:
             logger.info(
-                'Waiting for %s, with hash %s, timeout %d',
-                tx.tx_id, tx.tx_hash, max_time
+                'Waiting for %s, with hashes %s, timeout %d',
+                tx.tx_id, tx.hashes, max_time
             )
-            self.eth.wait_for_receipt(
-                tx_hash=tx.tx_hash,
+            # Any of the replaced attempts could be mined
+            h, receipt = self.eth.wait_for_receipts(
+                hashes=tx.hashes,
                 max_time=max_time
             )
         except ReceiptTimeoutError as err:
             logger.info(f'{tx.tx_id} is not mined within {max_time}')
             tx.status = TxStatus.TIMEOUT
+            # Nonce could be stuck behind a gap
+            self.attempt_manager.nonces.reset()
             raise WaitTimeoutError(err)
 
-        rstatus = self.eth.wait_for_receipt(
-            tx_hash=tx.tx_hash,
-            max_time=max_time
-        )
-        if rstatus is not None:
-            logger.info('Setting tx %s as mined', tx.tx_id)
-            tx.set_as_mined()
-            self.pool.save(tx)
-        return rstatus
+        self.receipts.put(tx.tx_id, h, receipt)
+        self.eth.check_estimate(tx, receipt)
+        logger.info('Setting tx %s as mined', tx.tx_id)
+        tx.set_as_mined()
+        self.nonce_mined(tx)
+        self.pool.save(tx)
+        return receipt['status']
 
     def confirm(self, tx: Tx) -> None:
-        logger.info(
-            'Tx %s: confirming within %d blocks',
-            tx.tx_id, CONFIRMATION_BLOCKS
-        )
-        start_block = self.eth.get_tx_block(tx.tx_hash)  # type: ignore
-        self.eth.wait_for_blocks(
-            amount=CONFIRMATION_BLOCKS,
-            start_block=start_block
-        )
-        h, r = self.get_exec_data(tx)
+        finality = self.finality.get(tx)
+        logger.info('Tx %s: confirming with %s finality', tx.tx_id, finality)
+        h, receipt = self.receipts.get(tx.tx_id)
+        if receipt is None:
+            h, receipt = self.eth.find_receipt(tx.hashes)
+        start_block = receipt['blockNumber'] if receipt else -1
+        finality.wait(self.eth, start_block)
+        if receipt is None:
+            h, r = self.get_exec_data(tx)
+        elif finality.reorgs and not self.is_canonical(receipt):
+            self.reorganized(tx)
+            raise ConfirmationError('Tx block was reorganized')
+        else:
+            r = receipt.get('status', -1)
+        self.receipts.pop(tx.tx_id)
         if h is None or r not in (0, 1):
             tx.status = TxStatus.UNCONFIRMED
             raise ConfirmationError('Tx is not confirmed')
         logger.info('Setting tx %s as completed, result %d', tx.tx_id, r)
         tx.set_as_completed(h, r)
         self.pool.save(tx)
-        logger.info('Tx %s was confirmed', tx.tx_id)
+        logger.info(
+            'Tx %s was confirmed. Receipt cache hits %d, misses %d',
+            tx.tx_id, self.receipts.hits, self.receipts.misses
+        )
+
+    def is_canonical(self, receipt: Dict) -> bool:
+        return self.eth.is_canonical(receipt['blockNumber'], receipt['blockHash'])
+
+    def reorganized(self, tx: Tx) -> None:
+        logger.warning('Block of tx %s was reorganized. Tx is pending again', tx.tx_id)
+        tx.status = TxStatus.SENT
+        feed = self.eth.running_feed()
+        if feed is not None:
+            feed.invalidate(tx.hashes)
+        self.pool.save(tx)
 
     def get_exec_data(self, tx: Tx) -> Tuple[Optional[str], Optional[int]]:
-        for h in reversed(tx.hashes):
-            r = self.eth.get_status(h)
-            if r >= 0:
-                return h, r
-        return None, None
+        h, receipt = self.eth.find_receipt(tx.hashes)
+        if receipt is None or receipt.get('status', -1) < 0:
+            return None, None
+        self.receipts.put(tx.tx_id, cast(str, h), receipt)
+        self.nonce_mined(tx)
+        return h, receipt['status']
 
-    def process(self, tx: Tx) -> None:
+    def nonce_mined(self, tx: Tx) -> None:
+        if tx.nonce is not None:
+            self.attempt_manager.nonces.mined(tx.nonce)
+
+    def prepare(self, tx: Tx) -> None:
         tx.chain_id = self.eth.chain_id
         tx.source = self.wallet.address
 
-        if tx.is_sent():
-            _, rstatus = self.get_exec_data(tx)
-            if rstatus is not None:
-                logger.info('Tx %s has been already mined', tx.tx_id)
-                self.confirm(tx)
-                return
-
+    def launch(self, tx: Tx, nonce: Optional[int] = None) -> None:
+        if self.rebroadcast(tx, nonce):
+            return
         try:
-            self.attempt_manager.make(tx)
+            self.attempt_manager.make(tx, nonce=nonce)
         except EstimateGasRevertError as e:
             logger.info('Estimate gas failed for %s with %s', tx.tx_id, e)
             if tx.is_sent_by_ima():
@@ -172,9 +282,20 @@ class Processor:
             raise
 
         logger.info('Current attempt: %s', self.attempt_manager.current)
-
         self.send(tx)
 
+    def process(self, tx: Tx) -> None:
+        self.prepare(tx)
+
+        if tx.is_sent():
+            _, rstatus = self.get_exec_data(tx)
+            if rstatus is not None:
+                logger.info('Tx %s has been already mined', tx.tx_id)
+                self.confirm(tx)
+                return
+
+        self.launch(tx)
+
         rstatus = self.wait(
             tx,
             self.attempt_manager.current.wait_time  # type: ignore
@@ -191,33 +312,212 @@ class Processor:
         try:
             yield tx
         finally:
+            self.receipts.pop(tx.tx_id)
             if tx.is_sent():
                 self.attempt_manager.save()
             if not tx.is_completed() and tx.is_last_attempt():
                 tx.set_as_dropped()
             if tx.is_completed():
+                self.discard_signed(tx)
+                self.rebroadcasted.difference_update(tx.hashes)
                 self.pool.release(tx)
             else:
                 self.pool.save(tx)
 
-    def process_next(self) -> None:
-        txs = self.pool.to_list()
-        if txs:
-            logger.info('Pool: %s', txs)
+    def process_next(self) -> bool:
         tx = self.pool.fetch_next()
-        self.attempt_manager.fetch()
-        if tx is not None:
-            with self.acquire_tx(tx) as tx:
-                logger.info(
-                    'Previous attempt %s', self.attempt_manager.current)
-                self.process(tx)
+        if tx is None:
+            return False
+        with self.acquire_tx(tx) as tx:
+            logger.info(
+                'Previous attempt %s', self.attempt_manager.current)
+            self.process(tx)
+        return True
+
+    def untrack(self, nonce: int) -> None:
+        tx = self.inflight.pop(nonce)
+        feed = self.eth.running_feed()
+        if feed is not None:
+            feed.untrack(tx.tx_id)
+
+    def track(
+        self,
+        tx: Tx,
+        block: int,
+        chain_nonce: int,
+        receipts: Dict[str, Dict]
+    ) -> None:
+        nonce = cast(int, tx.nonce)
+        h, receipt = latest_receipt(tx.hashes, receipts)
+
+        if receipt is None:
+            attempt = self.attempt_manager.attempts.get(nonce)
+            wait_time = attempt.wait_time if attempt else BASE_WAITING_TIME
+            dropped = nonce == self.attempt_manager.nonces.gap
+            if time.time() - (tx.sent_ts or 0) < wait_time and not dropped:
+                return
+            if dropped:
+                logger.info('Tx %s is not known to the node', tx.tx_id)
+            else:
+                logger.info('Tx %s is not mined within %d', tx.tx_id, wait_time)
+            self.attempt_manager.nonces.reset()
+            if nonce < chain_nonce:
+                logger.info('Nonce %d was taken by another tx. Resetting %s', nonce, tx.tx_id)
+                self.untrack(nonce)
+                self.attempt_manager.forget(nonce)
+                return
+            tx.status = TxStatus.TIMEOUT
+            try:
+                with self.acquire_tx(tx):
+                    self.prepare(tx)
+                    self.launch(tx, nonce)
+            finally:
+                if tx.is_completed():
+                    self.untrack(nonce)
+            return
+
+        if not tx.is_mined():
+            self.eth.check_estimate(tx, receipt)
+            logger.info('Setting tx %s as mined', tx.tx_id)
+            tx.set_as_mined()
+            self.nonce_mined(tx)
+            self.pool.save(tx)
+        finality = self.finality.get(tx)
+        if finality.is_final(self.eth, receipt['blockNumber'], block):
+            if finality.reorgs and not self.is_canonical(receipt):
+                self.reorganized(tx)
+                return
+            logger.info('Setting tx %s as completed, result %d', tx.tx_id, receipt['status'])
+            tx.set_as_completed(cast(str, h), receipt['status'])
+            self.discard_signed(tx)
+            self.pool.release(tx)
+            self.untrack(nonce)
+            self.attempt_manager.forget(nonce)
+
+    def get_inflight_receipts(self) -> Dict[str, Dict]:
+        feed = self.eth.running_feed()
+        if feed is None:
+            hashes = [h for tx in self.inflight.values() for h in tx.hashes]
+            return self.eth.get_receipts(hashes) if hashes else {}
+        receipts = {}
+        for tx in self.inflight.values():
+            receipts.update(feed.track(tx.tx_id, tx.hashes))
+        return receipts
+
+    def resume(self, tx: Tx) -> None:
+        """ Tracks the sent tx with its own nonce, sends it again if the node lost it """
+        nonce = cast(int, tx.nonce)
+        logger.info('Resuming tx %s with nonce %d', tx.tx_id, nonce)
+        self.prepare(tx)
+        try:
+            self.rebroadcast(tx, nonce)
+        except Exception:
+            logger.exception('Failed to send tx %s again', tx.tx_id)
+        self.attempt_manager.nonces.sent(nonce)
+        self.inflight[nonce] = tx
+
+    def fill_window(self, chain_nonce: int) -> None:
+        busy = {tx.tx_id for tx in self.inflight.values()}
+        txs = [
+            tx for tx in self.pool.fetch_many(self.window + len(self.inflight))
+            if tx.tx_id not in busy
+        ]
+        # Hash sent with the nonce could still be mined, so the tx keeps it.
+        # If another tx has taken the nonce, the tx waits until it is freed
+        for tx in txs:
+            if tx.is_sent() and tx.nonce is not None and tx.nonce >= chain_nonce:
+                if tx.nonce not in self.inflight:
+                    self.resume(tx)
+                busy.add(tx.tx_id)
+        next_nonce = chain_nonce
+        for tx in txs:
+            if len(self.inflight) >= self.window:
+                break
+            if tx.tx_id in busy:
+                continue
+            if tx.is_sent() and tx.nonce is not None and tx.nonce not in self.inflight:
+                _, rstatus = self.get_exec_data(tx)
+                if rstatus is not None:
+                    logger.info('Tx %s has been already mined', tx.tx_id)
+                    self.inflight[tx.nonce] = tx
+                    continue
+            # Nonces of the resumed txs are skipped
+            while next_nonce in self.inflight:
+                next_nonce += 1
+            try:
+                with self.acquire_tx(tx):
+                    self.prepare(tx)
+                    self.launch(tx, next_nonce)
+            except Exception:
+                logger.exception('Failed to launch tx %s', tx.tx_id)
+                continue
+            if not tx.is_completed():
+                self.inflight[next_nonce] = tx
+
+    def process_window(self) -> None:
+        chain_nonce = self.attempt_manager.nonces.get()
+        block = self.eth.block_number
+        receipts = self.get_inflight_receipts()
+        for nonce in sorted(self.inflight):
+            try:
+                self.track(self.inflight[nonce], block, chain_nonce, receipts)
+            except Exception:
+                logger.exception('Failed to track tx with nonce %d', nonce)
+        logger.info('In-flight nonces: %s', sorted(self.inflight))
+        # Txs mined while tracking have moved the local nonce
+        self.fill_window(self.attempt_manager.nonces.get())
+
+    def fill_gap(self) -> None:
+        """ Sends zero value transfer to itself with the missing nonce """
+        nonces = self.attempt_manager.nonces
+        gap = nonces.gap
+        # In-flight tx is resent and the next tx takes the lowest nonce itself
+        if gap is None or gap in self.inflight or \
+                (self.window == 1 and gap == nonces.latest):
+            return
+        logger.warning('Filling nonce gap %d', gap)
+        tx = {
+            'to': self.address,
+            'value': 0,
+            'gas': SELF_TRANSFER_GAS,
+            'gasPrice': self.eth.avg_gas_price,
+            'nonce': gap,
+            'chainId': self.eth.chain_id
+        }
+        try:
+            tx_hash = self.eth.send_tx(self.wallet.sign(tx))
+        except Exception:
+            logger.exception('Failed to fill nonce gap %d', gap)
+            nonces.reset()
+            return
+        nonces.fill(gap)
+        logger.info('Gap %d filled with %s. Nonce metrics %s', gap, tx_hash, nonces.metrics)
+
+    def wait_window(self) -> None:
+        if not self.inflight:
+            self.pool.wait()
+        elif len(self.inflight) < self.window:
+            # In-flight txs are tracked once a second
+            self.pool.wait(timeout=1)
+        else:
+            time.sleep(1)
 
     def run(self) -> None:
+        self.attempt_manager.fetch()
+        logger.info('Loaded attempts for nonces %s', sorted(self.attempt_manager.attempts))
+        for nonce in self.attempt_manager.attempts:
+            self.attempt_manager.nonces.sent(nonce)
+        # Subscribing before the first fetch to not miss any update
+        self.pool.subscribe()
         while True:
             try:
-                self.process_next()
+                self.fill_gap()
+                if self.window > 1:
+                    self.process_window()
+                    self.wait_window()
+                elif not self.process_next():
+                    self.pool.wait()
             except Exception:
                 logger.exception('Failed to process tx')
                 logger.info('Waiting for next tx')
-            finally:
                 time.sleep(1)
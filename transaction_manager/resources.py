@@ -23,7 +23,11 @@ from skale.utils.web3_utils import init_web3  # type: ignore
 from web3 import Web3
 
 from .config import ALLOWED_TS_DIFF, ENDPOINT, REDIS_URI
+from .endpoints import make_endpoint_pool
 
 cpool: redis.ConnectionPool = redis.ConnectionPool.from_url(REDIS_URI)
 rs: redis.Redis = redis.Redis(connection_pool=cpool)
 w3: Web3 = init_web3(ENDPOINT, ts_diff=ALLOWED_TS_DIFF)
+endpoint_pool = make_endpoint_pool()
+if endpoint_pool is not None:
+    w3.provider = endpoint_pool
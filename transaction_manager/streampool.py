@@ -0,0 +1,305 @@
+#   -*- coding: utf-8 -*-
+#
+#   This file is part of SKALE Transaction Manager
+#
+#   Copyright (C) 2021 SKALE Labs
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Affero General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Affero General Public License for more details.
+#
+#   You should have received a copy of the GNU Affero General Public License
+#   along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import redis
+
+from .config import (
+    POOL_POLL_INTERVAL,
+    POOL_WAIT_TIMEOUT,
+    RECORD_FORMAT,
+    RECORD_LAYOUT,
+    STREAM_CLAIM_IDLE_TIME,
+    STREAM_CONSUMER,
+    STREAM_GROUP,
+    STREAM_LANES
+)
+from .resources import rs as grs
+from .structures import Tx
+from .txpool import Record, SWEEP_BATCH_SIZE, to_record, TxPool
+
+logger = logging.getLogger(__name__)
+
+# Entry is (lane, stream entry id, tx id)
+Entry = Tuple[int, bytes, bytes]
+
+# Moves the first ARGV[1] ids of the sorted set KEYS[1] to the lanes
+# KEYS[2..], returns their number. Lane is chosen by priority as in lane_of
+MIRROR_SCRIPT = """
+local items = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1, 'WITHSCORES')
+local lanes = #KEYS - 1
+for i = 1, #items, 2 do
+    local lane = math.min(math.floor(tonumber(items[i + 1]) / 10000000000), lanes - 1)
+    redis.call('XADD', KEYS[lane + 2], '*', 'tx_id', items[i])
+    redis.call('ZREM', KEYS[1], items[i])
+end
+return #items / 2
+"""
+
+
+class StreamTxPool(TxPool):
+    """
+    Pool that queues tx ids in redis streams, one stream per priority lane.
+    Records are kept in the same keys and layout as in TxPool. Entries stay
+    pending for the consumer until the tx is released, so unfinished txs
+    are fetched again after a restart.
+
+    Producers that enqueue ids to the sorted set of TxPool, as skale.py
+    RedisWalletAdapter does, are still served: the ids are moved to the
+    lanes on each fetch, wait and sweep, so the sorted set is polled every
+    POOL_POLL_INTERVAL while waiting. Producers that add to the lanes
+    directly should use add_many.
+    """
+
+    def __init__(
+        self,
+        name: str = 'transactions',
+        rs: redis.Redis = grs,
+        group: str = STREAM_GROUP,
+        consumer: str = STREAM_CONSUMER,
+        lanes: int = STREAM_LANES,
+        layout: str = RECORD_LAYOUT,
+        record_format: str = RECORD_FORMAT
+    ) -> None:
+        super().__init__(name, rs, layout=layout, record_format=record_format)
+        self.group = group
+        self.consumer = consumer
+        self.lanes = lanes
+        self.created = False
+        self.delivered: Dict[bytes, Entry] = {}
+        self._mirror = self.rs.register_script(MIRROR_SCRIPT)
+
+    def lane_key(self, lane: int) -> str:
+        return f'{self.name}:lane:{lane}'
+
+    def lane_of(self, score: int) -> int:
+        return min(score // 10 ** 10, self.lanes - 1)
+
+    @property
+    def lane_keys(self) -> List[str]:
+        return [self.lane_key(lane) for lane in range(self.lanes)]
+
+    def create_groups(self) -> None:
+        if self.created:
+            return
+        for key in self.lane_keys:
+            try:
+                self.rs.xgroup_create(key, self.group, id='0', mkstream=True)
+            except redis.ResponseError as err:
+                if 'BUSYGROUP' not in str(err):
+                    raise
+        self.created = True
+
+    @property
+    def size(self) -> int:
+        pipe = self.rs.pipeline(transaction=False)
+        for key in self.lane_keys:
+            pipe.xlen(key)
+        # Ids of producers that are not moved to the lanes yet
+        pipe.zcard(self.name)
+        return sum(pipe.execute())
+
+    def _entries(self, amount: Optional[int] = None) -> List[Entry]:
+        pipe = self.rs.pipeline(transaction=False)
+        for key in self.lane_keys:
+            pipe.xrange(key, count=amount)
+        entries = [
+            (lane, entry_id, fields[b'tx_id'])
+            for lane, lane_entries in enumerate(pipe.execute())
+            for entry_id, fields in lane_entries
+        ]
+        return entries[:amount]
+
+    def to_list(self) -> List[bytes]:
+        return [tx_id for _, _, tx_id in self._entries()]
+
+    def get_next_ids(self, amount: int) -> List[bytes]:
+        return [tx_id for _, _, tx_id in self._entries(amount)]
+
+    def get_next_id(self) -> Optional[bytes]:
+        ids = self.get_next_ids(1)
+        return ids[0] if ids else None
+
+    def _read(
+        self,
+        last_id: str,
+        amount: int,
+        block: Optional[int] = None,
+        lanes: Optional[Iterable[int]] = None
+    ) -> List[Entry]:
+        """ Count is applied by redis to each of the lanes """
+        self.create_groups()
+        keys = {
+            self.lane_key(lane).encode('utf-8'): lane
+            for lane in (range(self.lanes) if lanes is None else lanes)
+        }
+        response = self.rs.xreadgroup(
+            self.group,
+            self.consumer,
+            {key: last_id for key in keys},
+            count=amount,
+            block=block
+        )
+        return sorted(
+            (keys[key], entry_id, fields[b'tx_id'])
+            for key, lane_entries in response or []
+            for entry_id, fields in lane_entries
+            # Pending entries deleted by another consumer have no fields
+            if fields
+        )
+
+    def mirror(self, batch_size: int = SWEEP_BATCH_SIZE) -> int:
+        """ Moves ids enqueued to the sorted set by producers to the lanes """
+        moved, batch = 0, batch_size
+        while batch == batch_size:
+            batch = self._mirror(keys=[self.name, *self.lane_keys], args=[batch_size])
+            moved += batch
+        if moved:
+            logger.info('Moved %d txs from the sorted set to the lanes', moved)
+        return moved
+
+    def _add_record(
+        self, tx_id: bytes,
+        score: int,
+        tx_record: Record
+    ) -> None:
+        pipe = self.rs.pipeline()
+        self._write_record(pipe, tx_id, tx_record)
+        pipe.xadd(self.lane_key(self.lane_of(score)), {'tx_id': tx_id})
+        pipe.execute()
+
+    def _add_chunk(self, chunk: List[Tx]) -> List[str]:
+        records = [(tx, self.validate(tx)) for tx in chunk]
+        pipe = self.rs.pipeline(transaction=False)
+        for tx, record in records:
+            self._write_record(pipe, tx.raw_id, record)
+            tx.mark_clean()
+        for tx in sorted(chunk, key=lambda tx: tx.score):
+            pipe.xadd(self.lane_key(self.lane_of(tx.score)), {'tx_id': tx.raw_id})
+        pipe.execute()
+        logger.info('Added %d txs to the pool', len(chunk))
+        return [tx.tx_id for tx in chunk]
+
+    def _ack(self, entries: List[Entry]) -> None:
+        pipe = self.rs.pipeline(transaction=False)
+        for lane, entry_id, _ in entries:
+            pipe.xack(self.lane_key(lane), self.group, entry_id)
+            pipe.xdel(self.lane_key(lane), entry_id)
+        pipe.execute()
+
+    def _pop_entries(self, tx_id: bytes) -> List[Entry]:
+        entry = self.delivered.pop(tx_id, None)
+        if entry is not None:
+            return [entry]
+        return [entry for entry in self._entries() if entry[2] == tx_id]
+
+    def drop(self, tx_id: bytes) -> None:
+        logger.info('Removing %s from pool', tx_id)
+        self._ack(self._pop_entries(tx_id))
+
+    def _clear(self) -> None:
+        self.rs.delete(self.name, *self.lane_keys)
+        self.created = False
+        self.delivered = {}
+
+    def fetch_many(self, amount: int) -> List[Tx]:
+        self.mirror()
+        # Entries that were delivered before are still being processed. New
+        # ones are read lane by lane, so that lower priority lanes are not
+        # delivered ahead of the entries of higher priority lanes
+        pending = self._read('0', amount)
+        entries: List[Entry] = []
+        for lane in range(self.lanes):
+            entries.extend(entry for entry in pending if entry[0] == lane)
+            if len(entries) < amount:
+                entries.extend(self._read('>', amount - len(entries), lanes=[lane]))
+            if len(entries) >= amount:
+                break
+        entries = entries[:amount]
+        if not entries:
+            return []
+
+        pipe = self.rs.pipeline(transaction=False)
+        for _, _, tx_id in entries:
+            self._read_record(pipe, tx_id)
+        txs, dead = [], []
+        for entry, record in zip(entries, pipe.execute()):
+            tx = self.decode(entry[2], to_record(record)) if record else None
+            if tx is None:
+                logger.error('Tx %s has no valid record. Going to remove', entry[2])
+                dead.append(entry)
+            else:
+                self.delivered[entry[2]] = entry
+                txs.append(tx)
+        if dead:
+            self._ack(dead)
+        return txs
+
+    def release(self, tx: Tx) -> None:
+        logger.info('Releasing tx %s', tx.tx_id)
+        self.save(tx)
+        self._ack(self._pop_entries(tx.raw_id))
+        self._forget_record(tx.raw_id)
+
+    def subscribe(self) -> None:
+        self.create_groups()
+
+    def wait(self, timeout: float = POOL_WAIT_TIMEOUT) -> bool:
+        """
+        Blocks on XREADGROUP. Received entries, one per lane at most, are
+        fetched as pending ones in the order of lanes
+        """
+        deadline = time.time() + timeout
+        while (remaining := deadline - time.time()) > 0:
+            if self.mirror() > 0:
+                return True
+            # Block of 0 would never expire
+            block = max(int(min(remaining, POOL_POLL_INTERVAL) * 1000), 1)
+            if self._read('>', 1, block=block):
+                return True
+        return False
+
+    def recover(self, min_idle_time: int = STREAM_CLAIM_IDLE_TIME) -> int:
+        """ Claims entries of consumers which have been idle for too long """
+        claimed = 0
+        for key in self.lane_keys:
+            pending: List[Dict] = self.rs.xpending_range(
+                key, self.group, min='-', max='+', count=1000
+            )
+            stale = [
+                p['message_id']
+                for p in pending
+                if p['consumer'].decode('utf-8') != self.consumer and
+                p['time_since_delivered'] >= min_idle_time * 1000
+            ]
+            if stale:
+                claimed += len(self.rs.xclaim(
+                    key, self.group, self.consumer,
+                    min_idle_time * 1000, stale
+                ))
+        if claimed:
+            logger.info('Claimed %d pending entries', claimed)
+        return claimed
+
+    def sweep(self, batch_size: int = SWEEP_BATCH_SIZE) -> int:
+        self.mirror(batch_size)
+        return self.recover()
@@ -22,7 +22,10 @@ import logging
 import time
 from dataclasses import asdict, dataclass, field
 from enum import Enum
-from typing import Dict, List, Optional
+from typing import Any, cast, Dict, Iterable, List, Optional, Set
+
+import msgpack  # type: ignore
+from web3 import Web3
 
 from .config import (
     DEFAULT_ID_LEN,
@@ -38,6 +41,62 @@ class InvalidFormatError(Exception):
     pass
 
 
+MSGPACK_FORMAT = 'msgpack'
+# JSON record never starts with this byte, so both formats can be stored
+PACKED_MARKER = b'\xff'
+PACKED_VERSION = 1
+BIG_INT_EXT = 1
+MAX_PACKED_INT = 2 ** 64 - 1
+MIN_PACKED_INT = -2 ** 63
+
+
+def is_packed(record: Any) -> bool:
+    return isinstance(record, bytes) and record[:1] == PACKED_MARKER
+
+
+def _wrap_big_ints(obj: Any) -> Any:
+    if isinstance(obj, int) and not MIN_PACKED_INT <= obj <= MAX_PACKED_INT:
+        return msgpack.ExtType(BIG_INT_EXT, str(obj).encode('utf-8'))
+    if isinstance(obj, (list, tuple)):
+        return [_wrap_big_ints(item) for item in obj]
+    if isinstance(obj, dict):
+        return {key: _wrap_big_ints(value) for key, value in obj.items()}
+    return obj
+
+
+def _ext_hook(code: int, data: bytes) -> Any:
+    if code == BIG_INT_EXT:
+        return int(data)
+    return msgpack.ExtType(code, data)
+
+
+def pack(values: List) -> bytes:
+    """ Encodes positional record values. Version defines the order """
+    try:
+        payload = msgpack.packb(values)
+    except OverflowError:
+        # Amounts in wei may not fit into 64 bits
+        payload = msgpack.packb(_wrap_big_ints(values))
+    return PACKED_MARKER + bytes((PACKED_VERSION,)) + payload
+
+
+def unpack(record: bytes) -> List:
+    version = record[1:2]
+    if version != bytes((PACKED_VERSION,)):
+        raise InvalidFormatError(f'Unsupported record version {version!r}')
+    try:
+        values = msgpack.unpackb(
+            record[2:],
+            ext_hook=_ext_hook,
+            strict_map_key=False
+        )
+    except ValueError as err:
+        raise InvalidFormatError(f'Invalid packed record: {err}')
+    if not isinstance(values, list):
+        raise InvalidFormatError('Packed record is not a list')
+    return values
+
+
 class TxStatus(Enum):
     PROPOSED = 1
     SEEN = 2
@@ -51,15 +110,21 @@ class TxStatus(Enum):
     DROPPED = 10
 
 
-@dataclass
+@dataclass(slots=True)
 class Fee:
     gas_price: Optional[int] = None
     max_fee_per_gas: Optional[int] = None
     max_priority_fee_per_gas: Optional[int] = None
 
 
-@dataclass
-class Tx:
+class Tracked:
+    """ Keeps names of the attributes assigned since the last save """
+    __slots__ = ('_dirty',)
+    _dirty: Set[str]
+
+
+@dataclass(slots=True)
+class Tx(Tracked):
     tx_id: str
     status: TxStatus
     score: int
@@ -87,10 +152,31 @@ class Tx:
         'from': 'source'
     }
 
+    FEE_FIELDS = ('gasPrice', 'maxFeePerGas', 'maxPriorityFeePerGas')
+
     def __post_init__(self):
         if isinstance(self.fee, dict):
             self.fee = Fee(**self.fee)
 
+    def __setattr__(self, name: str, value: Any) -> None:
+        # Slotted dataclass is a new class, so zero argument super() fails
+        object.__setattr__(self, name, value)
+        if name in self.__dataclass_fields__:
+            self.touch(name)
+
+    def touch(self, name: str) -> None:
+        try:
+            self._dirty.add(name)
+        except AttributeError:
+            self._dirty = {name}
+
+    @property
+    def dirty(self) -> Set[str]:
+        return getattr(self, '_dirty', set())
+
+    def mark_clean(self) -> None:
+        self._dirty = set()
+
     @property
     def raw_id(self) -> bytes:
         return self.tx_id.encode('utf-8')
@@ -130,6 +216,7 @@ class Tx:
         self.tx_hash = tx_hash
         self.sent_ts = int(time.time())
         self.hashes.append(tx_hash)
+        self.touch('hashes')
 
     def set_as_dropped(self) -> None:
         self.status = TxStatus.DROPPED
@@ -139,19 +226,127 @@ class Tx:
 
     @property
     def raw_tx(self) -> Dict:
-        raw_tx = asdict(self)
-        raw_tx['status'] = self.status.name
-        raw_tx.update(asdict(self.fee))
-        del raw_tx['fee']
-        for original, mapped in self.MAPPED_ATTR.items():
-            if mapped in raw_tx:
-                raw_tx[original] = raw_tx[mapped]
-                del raw_tx[mapped]
-        return raw_tx
+        """ Record representation. Nested values are not copied """
+        fee = self.fee
+        return {
+            'tx_id': self.tx_id,
+            'status': self.status.name,
+            'score': self.score,
+            'to': self.to,
+            'hashes': self.hashes,
+            'attempts': self.attempts,
+            'value': self.value,
+            'multiplier': self.multiplier,
+            'from': self.source,
+            'gas': self.gas,
+            'chainId': self.chain_id,
+            'nonce': self.nonce,
+            'data': self.data,
+            'tx_hash': self.tx_hash,
+            'sent_ts': self.sent_ts,
+            'method': self.method,
+            'meta': self.meta,
+            'gasPrice': fee.gas_price,
+            'maxFeePerGas': fee.max_fee_per_gas,
+            'maxPriorityFeePerGas': fee.max_priority_fee_per_gas
+        }
+
+    @property
+    def eth_tx(self) -> Dict:
+        """ EIP-1559 tx if any of its fees is set, legacy tx otherwise """
+        fee = self.fee
+        etx: Dict[str, Any] = {
+            'from': self.source,
+            'to': self.to,
+            'value': self.value,
+            'nonce': self.nonce,
+            'chainId': self.chain_id
+        }
+        if fee.max_priority_fee_per_gas is not None or \
+                fee.max_fee_per_gas is not None:
+            etx['maxFeePerGas'] = fee.max_fee_per_gas
+            etx['maxPriorityFeePerGas'] = fee.max_priority_fee_per_gas
+            etx['type'] = 2
+        else:
+            etx['gasPrice'] = fee.gas_price
+            etx['type'] = 1
+        if self.gas is not None:
+            etx['gas'] = self.gas
+        if self.data is not None:
+            etx['data'] = self.data
+        return etx
 
     def to_bytes(self) -> bytes:
         return json.dumps(self.raw_tx, sort_keys=True).encode('utf-8')
 
+    def to_packed(self) -> bytes:
+        fee = self.fee
+        return pack([
+            self.status.value, self.score, self.to,
+            fee.gas_price, fee.max_fee_per_gas, fee.max_priority_fee_per_gas,
+            self.hashes, self.attempts, self.value, self.multiplier,
+            self.source, self.gas, self.chain_id, self.nonce, self.data,
+            self.tx_hash, self.sent_ts, self.method, self.meta
+        ])
+
+    @classmethod
+    def from_packed(cls, tx_id: bytes, record: bytes) -> 'Tx':
+        values = unpack(record)
+        try:
+            (
+                status, score, to,
+                gas_price, max_fee_per_gas, max_priority_fee_per_gas,
+                hashes, attempts, value, multiplier,
+                source, gas, chain_id, nonce, data,
+                tx_hash, sent_ts, method, meta
+            ) = values
+            tx = Tx(
+                tx_id=tx_id.decode('utf-8'),
+                status=TxStatus(status),
+                score=score,
+                to=to,
+                fee=Fee(gas_price, max_fee_per_gas, max_priority_fee_per_gas),
+                hashes=hashes or [],
+                attempts=attempts,
+                value=value,
+                multiplier=multiplier,
+                source=source,
+                gas=gas,
+                chain_id=chain_id,
+                nonce=nonce,
+                data=data,
+                tx_hash=tx_hash,
+                sent_ts=sent_ts,
+                method=method,
+                meta=meta
+            )
+        except (ValueError, UnicodeError):
+            logger.error('Failed to make tx %s from packed record', tx_id)
+            raise InvalidFormatError(f'Invalid record for {str(tx_id)}')
+        tx.mark_clean()
+        return tx
+
+    def to_fields(self, names: Optional[Iterable[str]] = None) -> Dict[str, bytes]:
+        """ Encodes attributes as separate record fields, all by default """
+        if names is None:
+            names = self.__dataclass_fields__
+        mapped = {attr: original for original, attr in self.MAPPED_ATTR.items()}
+        fields = {}
+        for name in names:
+            if name == 'fee':
+                fee = self.fee or Fee()
+                values = [fee.gas_price, fee.max_fee_per_gas, fee.max_priority_fee_per_gas]
+                fields.update({
+                    field: json.dumps(value).encode('utf-8')
+                    for field, value in zip(self.FEE_FIELDS, values)
+                })
+            elif name == 'status':
+                fields['status'] = json.dumps(self.status.name).encode('utf-8')
+            else:
+                value = json.dumps(getattr(self, name)).encode('utf-8')
+                fields[mapped.get(name, name)] = value
+        return fields
+
     @classmethod
     def _extract_fee(self, raw_tx: Dict) -> Fee:
         gas_price = raw_tx.pop('gas_price', None)
@@ -162,15 +357,41 @@ class Tx:
     @classmethod
     def from_bytes(cls, tx_id: bytes, tx_bytes: bytes) -> 'Tx':
         logger.debug('Tx %s bytes %s', tx_id, tx_bytes)
+        if is_packed(tx_bytes):
+            return cls.from_packed(tx_id, tx_bytes)
         try:
             raw_tx = json.loads(tx_bytes.decode('utf-8'))
             raw_tx['tx_id'] = tx_id.decode('utf-8')
         except (json.decoder.JSONDecodeError, UnicodeError, TypeError):
             logger.error('Failed to make tx %s from bytes', tx_id)
             raise InvalidFormatError(f'Invalid record for {str(tx_id)}')
+        return cls.from_raw(tx_id, raw_tx)
+
+    @classmethod
+    def decode_fields(cls, fields: Dict[bytes, bytes]) -> Dict[str, Any]:
+        try:
+            return {
+                name.decode('utf-8'): json.loads(value.decode('utf-8'))
+                for name, value in fields.items()
+            }
+        except (json.decoder.JSONDecodeError, UnicodeError, TypeError):
+            raise InvalidFormatError('Invalid record fields')
+
+    @classmethod
+    def from_fields(cls, tx_id: bytes, fields: Dict[bytes, bytes]) -> 'Tx':
+        logger.debug('Tx %s fields %s', tx_id, fields)
+        try:
+            raw_tx = cls.decode_fields(fields)
+            raw_tx['tx_id'] = tx_id.decode('utf-8')
+        except (InvalidFormatError, UnicodeError):
+            logger.error('Failed to make tx %s from fields', tx_id)
+            raise InvalidFormatError(f'Invalid record for {str(tx_id)}')
+        return cls.from_raw(tx_id, raw_tx)
 
+    @classmethod
+    def from_raw(cls, tx_id: bytes, raw_tx: Dict) -> 'Tx':
         try:
-            status_name = raw_tx.get('status')
+            status_name = cast(str, raw_tx.get('status'))
             raw_tx['status'] = TxStatus[status_name]
         except KeyError:
             logger.error('Tx %s has wrong status %s', tx_id, status_name)
@@ -189,10 +410,11 @@ class Tx:
         except TypeError:
             logger.exception('Tx creation for %s errored', tx_id)
             raise InvalidFormatError(f'Missing fields for {str(tx_id)} record')
+        tx.mark_clean()
         return tx
 
 
-@dataclass
+@dataclass(slots=True)
 class Attempt:
     tx_id: str
     nonce: int
@@ -200,16 +422,59 @@ class Attempt:
     fee: Fee
     wait_time: int
     gas: Optional[int] = None
+    # Signed tx, written before it is sent
+    raw_tx: Optional[str] = None
 
     def __post_init__(self):
         if isinstance(self.fee, dict):
             self.fee = Fee(**self.fee)
 
+    @property
+    def signed_hash(self) -> Optional[str]:
+        if self.raw_tx is None:
+            return None
+        return Web3.keccak(hexstr=self.raw_tx).hex()
+
     def to_bytes(self) -> bytes:
-        return json.dumps(asdict(self), sort_keys=True).encode('utf-8')
+        raw = asdict(self)
+        if self.raw_tx is None:
+            del raw['raw_tx']
+        return json.dumps(raw, sort_keys=True).encode('utf-8')
+
+    def to_packed(self) -> bytes:
+        fee = self.fee
+        return pack([
+            self.tx_id, self.nonce, self.index,
+            fee.gas_price, fee.max_fee_per_gas, fee.max_priority_fee_per_gas,
+            self.wait_time, self.gas, self.raw_tx
+        ])
+
+    @classmethod
+    def from_packed(cls, record: bytes) -> 'Attempt':
+        values = unpack(record)
+        try:
+            (
+                tx_id, nonce, index,
+                gas_price, max_fee_per_gas, max_priority_fee_per_gas,
+                wait_time, gas, *rest
+            ) = values
+        except ValueError:
+            raise InvalidFormatError('Invalid packed attempt')
+        return Attempt(
+            tx_id=tx_id,
+            nonce=nonce,
+            index=index,
+            fee=Fee(gas_price, max_fee_per_gas, max_priority_fee_per_gas),
+            wait_time=wait_time,
+            gas=gas,
+            # Attempts packed before signed txs were kept have no raw tx
+            raw_tx=rest[0] if rest else None
+        )
 
     @classmethod
     def from_bytes(cls, attempt_bytes: bytes) -> 'Attempt':
+        if is_packed(attempt_bytes):
+            return cls.from_packed(attempt_bytes)
         raw = json.loads(attempt_bytes.decode('utf-8'))
         if gas_price := raw.get('gas_price') or None:
             raw.update({'fee': asdict(Fee(gas_price=gas_price))})
@@ -17,15 +17,27 @@
 #   You should have received a copy of the GNU Affero General Public License
 #   along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import binascii
 import logging
+import os
+import threading
+import time
 
-from typing import List, Optional
+from typing import cast, Dict, Iterable, List, Optional, Set, Union
 
 import redis
 
-from .config import TXRECORD_EXPIRATION
+from .config import (
+    POOL_NOTIFICATIONS,
+    POOL_POLL_INTERVAL,
+    POOL_WAIT_TIMEOUT,
+    RECORD_FORMAT,
+    RECORD_LAYOUT,
+    SWEEP_INTERVAL,
+    TXRECORD_EXPIRATION
+)
 from .resources import rs as grs
-from .structures import InvalidFormatError, Tx
+from .structures import InvalidFormatError, is_packed, MSGPACK_FORMAT, Tx
 
 
 logger = logging.getLogger(__name__)
@@ -35,13 +47,101 @@ class NoNextTransactionError(Exception):
     pass
 
 
+MAX_ORPHANS_PER_FETCH = 100
+SUBMIT_CHUNK_SIZE = 1000
+SWEEP_BATCH_SIZE = 1000
+
+HASH_LAYOUT = 'hash'
+
+# Record is either JSON bytes or the mapping of separately encoded fields
+Record = Union[bytes, Dict]
+
+# Returns the number of removed orphans followed by id, record pairs
+# of the first ARGV[1] ids that still have a record. KEYS[1] is the pool,
+# KEYS[2..] are the ids read from its head, ids released since then are
+# skipped. String records of external producers are read in the hash layout too
+FETCH_SCRIPT = """
+local amount = tonumber(ARGV[1])
+local result = {0}
+for i = 2, #KEYS do
+    local tx_id = KEYS[i]
+    if redis.call('ZSCORE', KEYS[1], tx_id) then
+        local record
+        if ARGV[2] == 'hash' and redis.call('TYPE', tx_id).ok == 'hash' then
+            record = redis.call('HGETALL', tx_id)
+        else
+            record = redis.call('GET', tx_id)
+        end
+        if record then
+            table.insert(result, tx_id)
+            table.insert(result, record)
+            if #result > 2 * amount then
+                break
+            end
+        else
+            redis.call('ZREM', KEYS[1], tx_id)
+            result[1] = result[1] + 1
+        end
+    end
+end
+return result
+"""
+
+# Reads the record in the hash layout, whichever type it has
+READ_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok == 'hash' then
+    return redis.call('HGETALL', KEYS[1])
+end
+return redis.call('GET', KEYS[1])
+"""
+
+
+def to_record(reply: Union[None, bytes, List]) -> Record:
+    """ Record from a script reply, HGETALL of a script is a flat list """
+    if isinstance(reply, list):
+        return dict(zip(reply[::2], reply[1::2]))
+    return reply or b''
+
+
+def make_tx_id() -> str:
+    return 'tx-' + binascii.b2a_hex(os.urandom(8)).decode('utf-8')
+
+
+def make_score(priority: int) -> int:
+    ts = int(time.time())
+    return priority * 10 ** len(str(ts)) + ts
+
+
 class TxPool:
     def __init__(
         self, name: str = 'transactions',
-        rs: redis.Redis = grs
+        rs: redis.Redis = grs,
+        layout: str = RECORD_LAYOUT,
+        record_format: str = RECORD_FORMAT,
+        keyspace_events: bool = bool(POOL_NOTIFICATIONS)
     ) -> None:
         self.rs: redis.Redis = rs
         self.name: str = name
+        self.layout: str = layout
+        self.record_format: str = record_format
+        self.keyspace_events: bool = keyspace_events
+        self.pubsub: Optional[redis.client.PubSub] = None
+        self.notifications: bool = False
+        # Ids of the string records found in the hash layout, kept as strings
+        self.string_records: Set[bytes] = set()
+        # Ids of the JSON records of other producers, kept as JSON
+        self.json_records: Set[bytes] = set()
+        self._fetch = self.rs.register_script(FETCH_SCRIPT)
+        self._get_record = self.rs.register_script(READ_SCRIPT)
+
+    @property
+    def channel(self) -> str:
+        return f'{self.name}:updates'
+
+    @property
+    def keyspace_channel(self) -> str:
+        db = self.rs.connection_pool.connection_kwargs.get('db', 0)
+        return f'__keyspace@{db}__:{self.name}'
 
     @property
     def size(self) -> int:
@@ -53,15 +153,28 @@ class TxPool:
     def get(self, tx_id: Optional[bytes]) -> Optional[Tx]:
         if tx_id is None:
             return None
-        r = self.rs.get(tx_id) or b''
+        if self.layout == HASH_LAYOUT:
+            r: Record = to_record(self._get_record(keys=[tx_id]))
+        else:
+            r = self.rs.get(tx_id) or b''
         logger.info('Received record %s', r)
+        return self.decode(tx_id, r)
+
+    def decode(self, tx_id: bytes, record: Record) -> Optional[Tx]:
         tx = None
         try:
-            tx = Tx.from_bytes(tx_id, r)
+            if isinstance(record, dict):
+                tx = Tx.from_fields(tx_id, record)
+            else:
+                tx = Tx.from_bytes(tx_id, record)
+                if self.layout == HASH_LAYOUT and record:
+                    self.string_records.add(tx_id)
+                if record and not is_packed(record):
+                    self.json_records.add(tx_id)
             if tx is None:
                 logger.error('Tx %s has no record', tx_id)
         except InvalidFormatError:
-            logger.error('Invalid record for %s %s', tx_id, r)
+            logger.error('Invalid record for %s %s', tx_id, record)
             tx = None
         return tx
 
@@ -70,42 +183,260 @@ class TxPool:
             return None
         return self.rs.zrange(self.name, 0, 0)[0]
 
+    def get_next_ids(self, amount: int) -> List[bytes]:
+        return self.rs.zrange(self.name, 0, amount - 1)
+
     def _add_record(
         self, tx_id: bytes,
         score: int,
-        tx_record: bytes
+        tx_record: Record
     ) -> None:
         pipe = self.rs.pipeline()
         pipe.zadd(self.name, {tx_id: score})
-        pipe.set(tx_id, tx_record, ex=TXRECORD_EXPIRATION)
+        self._write_record(pipe, tx_id, tx_record)
+        pipe.publish(self.channel, tx_id)
+        pipe.execute()
+
+    def _write_record(
+        self,
+        pipe: redis.client.Pipeline,
+        tx_id: bytes,
+        record: Record
+    ) -> None:
+        if isinstance(record, dict):
+            if record:
+                pipe.hset(tx_id, mapping=record)  # type: ignore
+            pipe.expire(tx_id, TXRECORD_EXPIRATION)
+        else:
+            pipe.set(tx_id, record, ex=TXRECORD_EXPIRATION)
+
+    def _read_record(self, pipe: redis.client.Pipeline, tx_id: bytes) -> None:
+        if self.layout == HASH_LAYOUT:
+            self._get_record(keys=[tx_id], client=pipe)
+        else:
+            pipe.get(tx_id)
+
+    def encode(self, tx: Tx, changed_only: bool = False) -> Record:
+        try:
+            if self.layout == HASH_LAYOUT and tx.raw_id not in self.string_records:
+                return tx.to_fields(tx.dirty if changed_only else None)
+            # Clients of the producer could read the record as JSON
+            if self.record_format == MSGPACK_FORMAT and tx.raw_id not in self.json_records:
+                return tx.to_packed()
+            return tx.to_bytes()
+        except (TypeError, ValueError) as err:
+            raise InvalidFormatError(f'Tx {tx.tx_id} is not serializable: {err}')
+
+    def validate(self, tx: Tx) -> Record:
+        record = self.encode(tx)
+        # Raises InvalidFormatError if processor will not be able to read it
+        if isinstance(record, dict):
+            Tx.from_fields(tx.raw_id, {k.encode('utf-8'): v for k, v in record.items()})
+        else:
+            Tx.from_bytes(tx.raw_id, record)
+        return record
+
+    def add_many(
+        self,
+        txs: Iterable[Tx],
+        chunk_size: int = SUBMIT_CHUNK_SIZE
+    ) -> List[str]:
+        """ Saves txs using one pipeline per chunk. Empty tx_id is generated """
+        ids: List[str] = []
+        chunk: List[Tx] = []
+        for tx in txs:
+            tx.tx_id = tx.tx_id or make_tx_id()
+            chunk.append(tx)
+            if len(chunk) == chunk_size:
+                ids.extend(self._add_chunk(chunk))
+                chunk = []
+        if chunk:
+            ids.extend(self._add_chunk(chunk))
+        return ids
+
+    def _add_chunk(self, chunk: List[Tx]) -> List[str]:
+        records = [(tx, self.validate(tx)) for tx in chunk]
+        pipe = self.rs.pipeline(transaction=False)
+        # Records go first so fetch never sees ids without them
+        for tx, record in records:
+            self._write_record(pipe, tx.raw_id, record)
+            tx.mark_clean()
+        pipe.zadd(self.name, {tx.raw_id: tx.score for tx in chunk})
+        pipe.publish(self.channel, chunk[-1].raw_id)
         pipe.execute()
+        logger.info('Added %d txs to the pool', len(chunk))
+        return [tx.tx_id for tx in chunk]
 
     def _clear(self) -> None:
-        for tx_id, _ in self.rs.zscan_iter(self.name):
-            self.drop(tx_id)
+        self.rs.delete(self.name)
+
+    def _remove_orphans(self, tx_ids: List[bytes]) -> int:
+        pipe = self.rs.pipeline(transaction=False)
+        for tx_id in tx_ids:
+            pipe.exists(tx_id)
+        orphans = [
+            tx_id
+            for tx_id, exists in zip(tx_ids, pipe.execute())
+            if not exists
+        ]
+        if orphans:
+            self.rs.zrem(self.name, *orphans)
+        return len(orphans)
+
+    def sweep(self, batch_size: int = SWEEP_BATCH_SIZE) -> int:
+        """ Removes ids which records have expired. Returns their number """
+        reclaimed = 0
+        batch: List[bytes] = []
+        for tx_id, _ in self.rs.zscan_iter(self.name, count=batch_size):
+            batch.append(tx_id)
+            if len(batch) == batch_size:
+                reclaimed += self._remove_orphans(batch)
+                batch = []
+        if batch:
+            reclaimed += self._remove_orphans(batch)
+        logger.info('Sweep of %s reclaimed %d ids', self.name, reclaimed)
+        return reclaimed
 
     def drop(self, tx_id: bytes) -> None:
         logger.info('Removing %s from pool', tx_id)
         self.rs.zrem(self.name, tx_id)
 
+    def _update_record(self, pipe: redis.client.Pipeline, tx: Tx) -> None:
+        """ Queues the write of the changed fields, led by the check of the key """
+        pipe.exists(tx.raw_id)
+        self._write_record(pipe, tx.raw_id, self.encode(tx, changed_only=True))
+
+    def _full_record(self, tx: Tx, existed: int) -> Optional[Record]:
+        """ Record to write again if changed fields were written to the expired key """
+        if existed:
+            return None
+        record = self.encode(tx)
+        return record if isinstance(record, dict) else None
+
+    def _restore_record(self, tx: Tx, existed: int) -> None:
+        record = self._full_record(tx, existed)
+        if record is not None:
+            logger.warning('Record of tx %s has expired. Writing it in full', tx.tx_id)
+            pipe = self.rs.pipeline(transaction=False)
+            self._write_record(pipe, tx.raw_id, record)
+            pipe.execute()
+
     def save(self, tx: Tx) -> None:
         logger.info('Updating record for tx %s', tx.tx_id)
-        self.rs.set(tx.tx_id, tx.to_bytes(), ex=TXRECORD_EXPIRATION)
+        pipe = self.rs.pipeline(transaction=False)
+        self._update_record(pipe, tx)
+        existed, *_ = pipe.execute()
+        self._restore_record(tx, existed)
+        tx.mark_clean()
 
     def fetch_next(self) -> Optional[Tx]:
-        tx = None
-        while tx is None and self.size > 0:
-            tx_id = self.get_next_id()
-            logger.debug('Received %s from pool', tx_id)
-            tx = self.get(tx_id)
-            if tx is None:
-                logger.error('Received malformed tx %s. Going to remove')
-                self.drop(tx_id)  # type: ignore
-        return tx
+        txs = self.fetch_many(1)
+        return txs[0] if txs else None
+
+    def fetch_many(self, amount: int) -> List[Tx]:
+        txs: List[Tx] = []
+        removed = 1
+        # Orphans and malformed records free places that are filled on retry
+        while len(txs) < amount and removed > 0:
+            # Keys of the records are passed to the script, as redis requires
+            ids = self.get_next_ids(amount + MAX_ORPHANS_PER_FETCH)
+            removed, *records = self._fetch(
+                keys=[self.name, *ids],
+                args=[amount, self.layout]
+            )
+            if removed > 0:
+                logger.info('Removed %d expired ids from pool', removed)
+            txs = []
+            for tx_id, record in zip(records[::2], records[1::2]):
+                logger.debug('Received %s from pool', tx_id)
+                tx = self.decode(tx_id, to_record(record))
+                if tx is None:
+                    logger.error('Received malformed tx %s. Going to remove', tx_id)
+                    self.drop(tx_id)
+                    removed += 1
+                else:
+                    txs.append(tx)
+        return txs
 
     def release(self, tx: Tx) -> None:
         logger.info('Releasing tx %s', tx.tx_id)
         pipe = self.rs.pipeline()
-        pipe.set(tx.tx_id, tx.to_bytes(), ex=TXRECORD_EXPIRATION)
+        self._update_record(pipe, tx)
         pipe.zrem(self.name, tx.tx_id)
-        pipe.execute()
+        existed, *_ = pipe.execute()
+        self._restore_record(tx, existed)
+        tx.mark_clean()
+        self._forget_record(tx.raw_id)
+
+    def _forget_record(self, tx_id: bytes) -> None:
+        self.string_records.discard(tx_id)
+        self.json_records.discard(tx_id)
+
+    def enable_notifications(self) -> bool:
+        """
+        Makes redis report ZADD from producers that do not publish. Server
+        config is changed only if keyspace events are enabled for the pool,
+        otherwise the pool is polled
+        """
+        try:
+            flags = self.rs.config_get('notify-keyspace-events').get(
+                'notify-keyspace-events', ''
+            )
+            if 'K' in flags and ('z' in flags or 'A' in flags):
+                return True
+            if not self.keyspace_events:
+                logger.info('Keyspace events are disabled. Polling the pool')
+                return False
+            self.rs.config_set('notify-keyspace-events', f'{flags}Kz')
+        except redis.ResponseError as err:
+            # CONFIG can be renamed or not permitted for the user
+            logger.info('Keyspace events are not available: %s. Polling the pool', err)
+            return False
+        return True
+
+    def subscribe(self) -> None:
+        if self.pubsub is not None:
+            return
+        self.notifications = self.enable_notifications()
+        self.pubsub = self.rs.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(self.channel, self.keyspace_channel)
+
+    def is_addition(self, message: dict) -> bool:
+        return message['channel'].decode('utf-8') == self.channel or \
+            message['data'] == b'zadd'
+
+    def wait(self, timeout: float = POOL_WAIT_TIMEOUT) -> bool:
+        """ Blocks until a tx is added to the pool or timeout expires """
+        self.subscribe()
+        pubsub = cast(redis.client.PubSub, self.pubsub)
+        if not self.notifications:
+            timeout = min(timeout, POOL_POLL_INTERVAL)
+        deadline = time.time() + timeout
+        woken = False
+        while not woken and (remaining := deadline - time.time()) > 0:
+            message = pubsub.get_message(timeout=remaining)
+            woken = message is not None and self.is_addition(message)
+        # Drop duplicate wakeups that were buffered in the meantime
+        while pubsub.get_message() is not None:
+            pass
+        return woken
+
+
+class PoolSweeper(threading.Thread):
+    def __init__(self, pool: TxPool, interval: int = SWEEP_INTERVAL) -> None:
+        super().__init__(name='pool-sweeper', daemon=True)
+        self.pool = pool
+        self.interval = interval
+        self.reclaimed = 0
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            try:
+                self.reclaimed += self.pool.sweep()
+            except Exception:
+                logger.exception('Pool sweep failed')
+            self.stopped.wait(self.interval)
+
+    def stop(self) -> None:
+        self.stopped.set()